@@ -1,15 +1,14 @@
 """API endpoints для управления клиентами"""
 
 from fastapi import APIRouter, HTTPException
-from typing import List, Dict
+from typing import List
 from pydantic import BaseModel
-from datetime import datetime
-import uuid
 
-router = APIRouter()
+from app.core.bus import bus
+from app.services.client_registry import client_registry
+from app.core.database import run_db
 
-# Хранилище зарегистрированных клиентов (в памяти, позже перенесем в БД)
-clients_storage: Dict[str, dict] = {}
+router = APIRouter()
 
 
 class ClientRegister(BaseModel):
@@ -31,45 +30,40 @@ class ClientResponse(BaseModel):
 
 @router.post("/register", response_model=ClientResponse)
 async def register_client(client: ClientRegister):
-    """Регистрация Android-клиента"""
-    client_id = str(uuid.uuid4())
-    now = datetime.now().isoformat()
-    
-    client_data = {
-        "client_id": client_id,
-        "device_id": client.device_id,
-        "device_name": client.device_name,
-        "platform": client.platform,
-        "registered_at": now,
-        "last_seen": now
-    }
-    
-    clients_storage[client_id] = client_data
-    
+    """Регистрация Android-клиента (повторная регистрация устройства возвращает прежний client_id)"""
+    client_data = await _register_client(device_id=client.device_id, device_name=client.device_name,
+                                         platform=client.platform)
     return ClientResponse(**client_data)
 
 
+# Реестр изменяет только основной процесс (единственный, кто пишет в БД)
+
+@bus.method("clients.register")
+async def _register_client(device_id: str, device_name: str, platform: str):
+    return await run_db(client_registry.register, device_id, device_name, platform)
+
+
 @router.post("/unregister/{client_id}")
+@bus.method("clients.unregister")
 async def unregister_client(client_id: str):
     """Отмена регистрации клиента"""
-    if client_id not in clients_storage:
+    if not await run_db(client_registry.unregister, client_id):
         raise HTTPException(status_code=404, detail="Клиент не найден")
-    
-    del clients_storage[client_id]
+
     return {"message": "Клиент успешно отменен", "client_id": client_id}
 
 
 @router.get("/clients", response_model=List[ClientResponse])
 async def get_clients():
     """Получение списка зарегистрированных клиентов"""
-    return [ClientResponse(**client) for client in clients_storage.values()]
+    return [ClientResponse(**client) for client in await run_db(client_registry.get_all)]
 
 
 @router.get("/clients/{client_id}", response_model=ClientResponse)
 async def get_client(client_id: str):
     """Получение информации о конкретном клиенте"""
-    if client_id not in clients_storage:
+    client = await run_db(client_registry.get, client_id)
+    if client is None:
         raise HTTPException(status_code=404, detail="Клиент не найден")
-    
-    return ClientResponse(**clients_storage[client_id])
 
+    return ClientResponse(**client)
@@ -0,0 +1,55 @@
+"""API endpoint потока событий веб-интерфейса (Server-Sent Events)"""
+
+from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
+
+from app.core.bus import bus
+from app.services.event_service import event_service
+from app.services.monitoring_service import monitoring_service
+from app.services.detection_service import detection_service
+from app.services.zone_service import zone_service
+
+router = APIRouter()
+
+
+@router.get("/events")
+async def events_stream():
+    """
+    Поток изменений состояния для веб-интерфейса
+
+    Первым приходит событие "snapshot" с текущим состоянием (мониторинг,
+    зоны, модель), далее только изменения: "monitoring", "violation",
+    "violation_status", "violation_deleted", "zone", "model". При
+    переподключении EventSource снова получает "snapshot".
+    """
+    # Подписываемся до чтения состояния, чтобы изменения, опубликованные
+    # пока оно читается, пришли клиенту следом за ним
+    subscriber = event_service.subscribe()
+    try:
+        snapshot = await _get_state()
+        snapshot["zones"] = [zone_service.zone_to_dict(zone) for zone in zone_service.get_all_zones()]
+    except Exception:
+        event_service.unsubscribe(subscriber)
+        raise
+    return StreamingResponse(
+        event_service.stream(subscriber, [event_service.format_event("snapshot", snapshot)]),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Отключение буферизации ответа в обратном прокси (nginx)
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
+@bus.method("events.state")
+async def _get_state():
+    """Состояние мониторинга и модели (хранится в основном процессе)"""
+    return {
+        "monitoring": {
+            "is_monitoring": monitoring_service.is_monitoring,
+            "pending_violations": len(monitoring_service.get_pending_violations()),
+            "total_violations": len(monitoring_service.get_all_violations())
+        },
+        "model": detection_service.get_model_info()
+    }
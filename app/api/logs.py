@@ -1,14 +1,27 @@
 """API endpoints для логов"""
 
 from fastapi import APIRouter, HTTPException, Query
-from fastapi.responses import Response
-from typing import Optional
+from fastapi.responses import StreamingResponse
+from typing import Optional, Tuple
 
 from app.services.logging_service import logging_service
+from app.services.snapshot_store import image_index
+from app.core.database import run_db
 
 router = APIRouter()
 
 
+def parse_region(region: Optional[str]) -> Optional[Tuple[int, int, int, int]]:
+    """Разбор прямоугольника области кадра в формате x1,y1,x2,y2"""
+    if not region:
+        return None
+    try:
+        x1, y1, x2, y2 = (int(v) for v in region.split(','))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Неверный формат области: {region!r}, ожидается x1,y1,x2,y2")
+    return x1, y1, x2, y2
+
+
 @router.get("/")
 async def get_logs(
     status: Optional[str] = Query(None, description="Фильтр по статусу"),
@@ -16,68 +29,84 @@ async def get_logs(
     start_date: Optional[str] = Query(None, description="Начальная дата (ISO format)"),
     end_date: Optional[str] = Query(None, description="Конечная дата (ISO format)"),
     limit: int = Query(100, ge=1, le=1000, description="Лимит записей"),
-    offset: int = Query(0, ge=0, description="Смещение")
+    offset: int = Query(0, ge=0, description="Смещение"),
+    after: Optional[str] = Query(None, description="Курсор keyset-пагинации: <timestamp>,<id> последней записи предыдущей страницы"),
+    region: Optional[str] = Query(None, description="Область кадра x1,y1,x2,y2, в которую попадает центр детекции")
 ):
-    """Получение логов с фильтрацией и пагинацией"""
-    violations = logging_service.get_violations(
-        status=status,
-        zone_id=zone_id,
-        start_date=start_date,
-        end_date=end_date,
-        limit=limit,
-        offset=offset
-    )
+    """
+    Получение логов с фильтрацией и пагинацией
     
-    total = logging_service.get_violations_count(
-        status=status,
-        zone_id=zone_id,
-        start_date=start_date,
-        end_date=end_date
-    )
+    total считается только для первой страницы: COUNT(*) проходит по всем
+    подходящим записям, а страницы по курсору after должны читать лишь
+    limit записей. Для страниц по курсору total равен null.
+    """
+    region_rect = parse_region(region)
+    try:
+        violations = await run_db(
+            logging_service.get_violations,
+            status=status,
+            zone_id=zone_id,
+            start_date=start_date,
+            end_date=end_date,
+            limit=limit,
+            offset=offset,
+            after=after,
+            region=region_rect
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # Заполняем индекс путей: страница логов сразу запрашивает миниатюры
+    for violation in violations:
+        image_index.put(violation["id"], violation["image_path"])
+    
+    total = None
+    if after is None:
+        total = await run_db(
+            logging_service.get_violations_count,
+            status=status,
+            zone_id=zone_id,
+            start_date=start_date,
+            end_date=end_date,
+            region=region_rect
+        )
     
     return {
         "violations": violations,
         "total": total,
         "limit": limit,
-        "offset": offset
+        "offset": offset,
+        "next_cursor": logging_service.make_cursor(violations[-1]) if len(violations) == limit else None
     }
 
 
 @router.get("/stats")
 async def get_statistics(
     start_date: Optional[str] = Query(None, description="Начальная дата (ISO format)"),
-    end_date: Optional[str] = Query(None, description="Конечная дата (ISO format)")
+    end_date: Optional[str] = Query(None, description="Конечная дата (ISO format)"),
+    group_by: Optional[str] = Query(None, regex="^(zone|hour|day)$", description="Разбивка по зонам или интервалам времени")
 ):
     """Получение статистики по нарушениям"""
-    stats = logging_service.get_statistics(start_date=start_date, end_date=end_date)
+    stats = await run_db(logging_service.get_statistics, start_date=start_date, end_date=end_date, group_by=group_by)
     return stats
 
 
 @router.get("/export")
 async def export_logs(
-    format: str = Query("csv", regex="^(csv|json)$", description="Формат экспорта"),
+    format: str = Query("csv", regex="^(csv|json|ndjson)$", description="Формат экспорта"),
     start_date: Optional[str] = Query(None, description="Начальная дата (ISO format)"),
     end_date: Optional[str] = Query(None, description="Конечная дата (ISO format)")
 ):
-    """Экспорт логов"""
-    if format == "csv":
-        content = logging_service.export_violations_csv(
-            start_date=start_date,
-            end_date=end_date
-        )
-        return Response(
-            content=content,
-            media_type="text/csv",
-            headers={"Content-Disposition": "attachment; filename=violations.csv"}
-        )
-    elif format == "json":
-        content = logging_service.export_violations_json(
-            start_date=start_date,
-            end_date=end_date
-        )
-        return Response(
-            content=content,
-            media_type="application/json",
-            headers={"Content-Disposition": "attachment; filename=violations.json"}
-        )
-
+    """Потоковый экспорт логов (синхронный генератор обходится StreamingResponse в потоке, а не в event loop)"""
+    exporters = {
+        "csv": (logging_service.export_violations_csv, "text/csv"),
+        "json": (logging_service.export_violations_json, "application/json"),
+        "ndjson": (logging_service.export_violations_ndjson, "application/x-ndjson"),
+    }
+    exporter, media_type = exporters[format]
+    
+    return StreamingResponse(
+        exporter(start_date=start_date, end_date=end_date),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=violations.{format}"}
+    )
@@ -4,7 +4,9 @@ from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import List
 
+from app.core.bus import bus
 from app.services.detection_service import detection_service, DetectionModel
+from app.services.event_service import event_service
 
 router = APIRouter()
 
@@ -44,7 +46,11 @@ async def get_models():
     ]
 
 
+# Модель детекции загружена в основном процессе: на воркерах обработчики
+# выполняются через шину (bus.method)
+
 @router.get("/current")
+@bus.method("models.current")
 async def get_current_model():
     """Получение информации о текущей модели"""
     return detection_service.get_model_info()
@@ -53,26 +59,41 @@ async def get_current_model():
 @router.post("/set")
 async def set_model(request: SetModelRequest):
     """Установка модели детекции"""
-    if detection_service.set_model(request.model):
+    return await _set_model(model=request.model)
+
+
+@bus.method("models.set")
+async def _set_model(model: str):
+    if detection_service.set_model(model):
+        info = detection_service.get_model_info()
+        event_service.publish("model", info)
         return {
-            "message": f"Модель {request.model} успешно установлена",
-            "info": detection_service.get_model_info()
+            "message": f"Модель {model} успешно установлена",
+            "info": info
         }
     else:
         raise HTTPException(
             status_code=400,
-            detail=f"Не удалось установить модель {request.model}. Доступные модели: yolo, mediapipe"
+            detail=f"Не удалось установить модель {model}. Доступные модели: yolo, mediapipe"
         )
 
 
 @router.post("/config")
 async def set_model_config(config: ModelConfig):
     """Установка параметров модели"""
-    detection_service.set_confidence_threshold(config.confidence_threshold)
-    detection_service.set_iou_threshold(config.iou_threshold)
+    return await _set_model_config(confidence_threshold=config.confidence_threshold,
+                                   iou_threshold=config.iou_threshold)
+
+
+@bus.method("models.config")
+async def _set_model_config(confidence_threshold: float, iou_threshold: float):
+    detection_service.set_confidence_threshold(confidence_threshold)
+    detection_service.set_iou_threshold(iou_threshold)
+    info = detection_service.get_model_info()
+    event_service.publish("model", info)
     
     return {
         "message": "Параметры модели обновлены",
-        "info": detection_service.get_model_info()
+        "info": info
     }
 
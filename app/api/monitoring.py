@@ -3,6 +3,7 @@
 from fastapi import APIRouter
 from pydantic import BaseModel
 
+from app.core.bus import bus
 from app.services.monitoring_service import monitoring_service
 
 router = APIRouter()
@@ -13,7 +14,11 @@ class MonitoringControl(BaseModel):
     action: str  # start, stop
 
 
+# Мониторинг работает в основном процессе: на воркерах обработчики
+# выполняются через шину (bus.method)
+
 @router.post("/start")
+@bus.method("monitoring.start")
 async def start_monitoring():
     """Запуск мониторинга"""
     monitoring_service.start_monitoring()
@@ -21,6 +26,7 @@ async def start_monitoring():
 
 
 @router.post("/stop")
+@bus.method("monitoring.stop")
 async def stop_monitoring():
     """Остановка мониторинга"""
     monitoring_service.stop_monitoring()
@@ -28,6 +34,7 @@ async def stop_monitoring():
 
 
 @router.get("/status")
+@bus.method("monitoring.status")
 async def get_monitoring_status():
     """Получение статуса мониторинга"""
     return {
@@ -2,9 +2,12 @@
 
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 
+from app.core.bus import bus
 from app.services.notification_service import notification_service
+from app.services.client_registry import client_registry
+from app.core.database import run_db
 from app.services.monitoring_service import monitoring_service
 
 router = APIRouter()
@@ -16,26 +19,70 @@ class NotificationResponse(BaseModel):
     response: bool  # True - подтверждено, False - ложное срабатывание
 
 
+def parse_zones(zones: Optional[str]) -> Optional[List[str]]:
+    """Разбор списка зон из параметра запроса ("*" - все зоны)"""
+    if zones is None or zones.strip() == "*":
+        return None
+    return [zone_id.strip() for zone_id in zones.split(",") if zone_id.strip()]
+
+
 @router.websocket("/ws/{client_id}")
-async def websocket_endpoint(websocket: WebSocket, client_id: str):
-    """WebSocket endpoint для получения уведомлений"""
-    await notification_service.connect(client_id, websocket)
+async def websocket_endpoint(websocket: WebSocket, client_id: str, image_mode: Optional[str] = None,
+                             since: Optional[int] = None, zones: Optional[str] = None,
+                             heartbeat: bool = False):
+    """
+    WebSocket endpoint для получения уведомлений
+    
+    Параметр image_mode выбирает способ доставки снимков: base64 (по умолчанию,
+    снимок внутри JSON), binary (JSON-заголовок и бинарный кадр с JPEG) или
+    thumbnail (заголовок и бинарный кадр с миниатюрой, полный снимок по image_url).
+    
+    Уведомления о нарушениях нумеруются (поле seq). Клиент подтверждает
+    получение сообщением {"type": "ack", "seq": N}, а при переподключении
+    передает since=<последний полученный seq> и получает пропущенные уведомления.
+    
+    Параметр zones (ID зон через запятую, "*" - все зоны) или сообщение
+    {"type": "subscribe", "zones": [...]} ограничивает уведомления зонами.
+    
+    Клиенту, подключившемуся с heartbeat=true, сервер при молчании отправляет
+    {"type": "ping"} и ждет в ответ {"type": "pong"} (или любое другое
+    сообщение); соединение без ответа дольше notifications.idle_timeout
+    секунд закрывается. Остальные соединения проверяются ping/pong
+    протокола WebSocket.
+    """
+    connection = await notification_service.connect(client_id, websocket, image_mode, since,
+                                                     parse_zones(zones), heartbeat)
     
     try:
         while True:
             # Ожидаем сообщения от клиента (ответы на уведомления)
             data = await websocket.receive_json()
+            # Любое сообщение клиента (в том числе pong) подтверждает, что
+            # соединение живо, и отмечает активность устройства в реестре
+            connection.touch()
+            client_registry.touch(client_id)
             
             if data.get("type") == "response":
                 await notification_service.handle_response(client_id, data)
+            elif data.get("type") == "ack":
+                notification_service.ack(client_id, data.get("seq"))
+            elif data.get("type") == "subscribe":
+                zones_list = data.get("zones")
+                if zones_list is not None and not isinstance(zones_list, list):
+                    continue
+                notification_service.send_to(client_id, {
+                    "type": "subscribed",
+                    "zones": await notification_service.change_subscription(client_id, zones_list)
+                })
             elif data.get("type") == "ping":
-                # Heartbeat для поддержания соединения
-                await websocket.send_json({"type": "pong"})
+                # Heartbeat для поддержания соединения (через очередь клиента,
+                # чтобы не отправлять параллельно с его задачей-писателем)
+                notification_service.send_to(client_id, {"type": "pong"})
     except WebSocketDisconnect:
-        notification_service.disconnect(client_id)
+        notification_service.disconnect(client_id, connection)
     except Exception as e:
         print(f"Ошибка в WebSocket соединении: {e}")
-        notification_service.disconnect(client_id)
+        notification_service.disconnect(client_id, connection)
 
 
 @router.post("/response")
@@ -57,14 +104,18 @@ async def handle_notification_response(response: NotificationResponse):
 
 @router.get("/clients")
 async def get_connected_clients():
-    """Получение списка подключенных клиентов"""
+    """Получение списка подключенных клиентов (с данными зарегистрированных устройств)"""
+    connected = notification_service.get_connected_clients()
+    registered = {client["client_id"]: client for client in await run_db(client_registry.get_all)}
     return {
-        "connected_clients": notification_service.get_connected_clients(),
-        "total": len(notification_service.get_connected_clients())
+        "connected_clients": connected,
+        "devices": [registered[client_id] for client_id in connected if client_id in registered],
+        "total": len(connected)
     }
 
 
 @router.post("/test")
+@bus.method("notifications.test")
 async def send_test_notification():
     """Отправка тестового уведомления всем подключенным клиентам"""
     from app.services.detection_service import Detection
@@ -109,7 +160,9 @@ async def send_test_notification():
     )
     
     # Отправляем уведомление
-    sent_to = await notification_service.send_notification(test_violation)
+    # Тестовое нарушение не хранится в мониторинге, ответа на него не будет,
+    # поэтому эскалация для него не запускается
+    sent_to = await notification_service.send_notification(test_violation, track=False)
     
     return {
         "message": "Тестовое уведомление отправлено",
@@ -8,7 +8,8 @@ from pathlib import Path
 import io
 import time
 
-from app.services.video_service import video_service, VideoSource
+from app.services.video_service import video_service, remote_frames, VideoSource
+from app.core.bus import bus
 from app.core.config import config
 from app.utils.logger import logger
 
@@ -18,6 +19,8 @@ router = APIRouter()
 @router.get("/stream")
 async def video_stream(request: Request):
     """Получение видеопотока в формате MJPEG"""
+    # На воркере кадры приходят от основного процесса через шину
+    frame_source = video_service if bus.is_primary else remote_frames
     
     def generate():
         """Генератор кадров для MJPEG потока"""
@@ -45,7 +48,7 @@ async def video_stream(request: Request):
                 break
             
             try:
-                result = video_service.get_frame()
+                result = frame_source.get_frame()
                 if result is None:
                     max_iterations_without_frame -= 1
                     if max_iterations_without_frame <= 0:
@@ -98,8 +101,16 @@ async def video_stream(request: Request):
         
         logger.debug(f"Видеопоток завершен. Отправлено кадров: {frame_count}")
     
+    def generate_remote():
+        """Поток кадров основного процесса; подписка на шине держится, пока клиент подключен"""
+        remote_frames.attach()
+        try:
+            yield from generate()
+        finally:
+            remote_frames.detach()
+    
     return StreamingResponse(
-        generate(),
+        generate() if frame_source is video_service else generate_remote(),
         media_type="multipart/x-mixed-replace; boundary=frame"
     )
 
@@ -122,20 +133,26 @@ async def upload_video(file: UploadFile = File(...)):
             content = await file.read()
             f.write(content)
         
-        # Загрузка в сервис
-        if video_service.load_video_file(str(file_path)):
-            return {
-                "message": "Видеофайл успешно загружен",
-                "file_path": str(file_path),
-                "info": video_service.get_info()
-            }
-        else:
-            raise HTTPException(status_code=400, detail="Не удалось загрузить видеофайл")
+        # Загрузка в сервис (видео захватывает основной процесс)
+        return await _load_video_file(file_path=str(file_path))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при загрузке файла: {str(e)}")
 
 
+@bus.method("video.load_file")
+async def _load_video_file(file_path: str):
+    if video_service.load_video_file(file_path):
+        return {
+            "message": "Видеофайл успешно загружен",
+            "file_path": file_path,
+            "info": video_service.get_info()
+        }
+    else:
+        raise HTTPException(status_code=400, detail="Не удалось загрузить видеофайл")
+
+
 @router.post("/control")
+@bus.method("video.control")
 async def control_video(action: str):
     """Управление воспроизведением (play/pause/stop)"""
     logger.info(f"Запрос на управление видео: action={action}")
@@ -180,6 +197,7 @@ async def control_video(action: str):
 
 
 @router.get("/info")
+@bus.method("video.info")
 async def get_video_info():
     """Получение информации о текущем видеопотоке"""
     return video_service.get_info()
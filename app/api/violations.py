@@ -1,33 +1,84 @@
 """API endpoints для нарушений"""
 
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import FileResponse
-from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response
+from typing import List, Optional, Tuple
 from pathlib import Path
 
 from app.services.monitoring_service import monitoring_service
+from app.services.snapshot_store import snapshot_store, snapshot_cache, image_index
+from app.services.event_service import event_service
+from app.core.bus import bus
+from app.core.database import run_db
 
 router = APIRouter()
 
 
 @router.get("/")
-async def get_violations(status: Optional[str] = None, limit: int = 100):
-    """Получение списка нарушений с фильтрацией"""
+async def get_violations(status: Optional[str] = None, limit: int = 100, after: Optional[str] = None):
+    """
+    Получение списка нарушений с фильтрацией (after - курсор <timestamp>,<id> для следующей страницы)
+    
+    total считается только для первой страницы (без after), чтобы страница
+    по курсору не проходила COUNT(*) по всему журналу.
+    """
     from app.services.logging_service import logging_service
     
     # Получаем нарушения из базы данных (основной источник истины)
-    violations_from_db = logging_service.get_violations(
-        status=status,
-        limit=limit,
-        offset=0
-    )
+    try:
+        violations_from_db = await run_db(
+            logging_service.get_violations,
+            status=status,
+            limit=limit,
+            offset=0,
+            after=after
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # Заполняем индекс путей: список обычно сразу запрашивает изображения
+    for violation in violations_from_db:
+        image_index.put(violation["id"], violation["image_path"])
     
     # Получаем общее количество для подсчета total
-    total_count = logging_service.get_violations_count(status=status)
+    total_count = None
+    if after is None:
+        total_count = await run_db(logging_service.get_violations_count, status=status)
     
     return {
         "violations": violations_from_db,
-        "total": total_count
+        "total": total_count,
+        "next_cursor": logging_service.make_cursor(violations_from_db[-1]) if len(violations_from_db) == limit else None
+    }
+
+
+@router.get("/changes")
+async def get_violation_changes(cursor: Optional[str] = None, limit: int = Query(100, ge=1, le=500)):
+    """
+    Лента изменений нарушений для синхронизации клиентов
+    
+    Возвращает нарушения, созданные или измененные после курсора, и ID
+    удаленных. Без курсора лента начинается с начала журнала. Клиент
+    сохраняет cursor из ответа и повторяет запрос, пока has_more = true;
+    reset = true означает, что курсор устарел и нужна полная синхронизация.
+    """
+    from app.services.logging_service import logging_service
+    
+    try:
+        since = logging_service.parse_change_cursor(cursor) if cursor else 0
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    changes = await run_db(logging_service.get_changes, since, limit)
+    for violation in changes["violations"]:
+        image_index.put(violation["id"], violation["image_path"])
+    
+    return {
+        "violations": changes["violations"],
+        "deleted": changes["deleted"],
+        "cursor": logging_service.make_change_cursor(changes["change_seq"]),
+        "has_more": changes["has_more"],
+        "reset": changes["reset"]
     }
 
 
@@ -37,7 +88,7 @@ async def get_violation(violation_id: str):
     from app.services.logging_service import logging_service
     
     # Сначала проверяем в базе данных
-    violation = logging_service.get_violation_by_id(violation_id)
+    violation = await run_db(logging_service.get_violation_by_id, violation_id)
     
     # Если нет в базе, проверяем в памяти (на случай, если сервер не перезапускался)
     if violation is None:
@@ -49,45 +100,150 @@ async def get_violation(violation_id: str):
     return violation
 
 
+# Снимки неизменяемы (имя файла - хеш содержимого), поэтому кэшируются навсегда
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def _image_etag(image_path: Path, size: str) -> str:
+    """
+    Сильный ETag изображения без чтения файла
+    
+    Для снимков из хранилища имя файла - sha256 содержимого; старые снимки
+    имеют уникальные неизменяемые имена, поэтому имя тоже годится.
+    """
+    return f'"{image_path.stem}-{size}"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Проверка заголовка If-None-Match (список ETag через запятую или *)"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def _parse_range(range_header: str, length: int) -> Optional[Tuple[int, int]]:
+    """Разбор заголовка Range вида bytes=start-end (поддерживается один диапазон)"""
+    unit, _, spec = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    start_str, _, end_str = spec.strip().partition("-")
+    try:
+        if start_str:
+            start = int(start_str)
+            end = int(end_str) if end_str else length - 1
+        else:
+            # bytes=-N: последние N байт
+            start = max(0, length - int(end_str))
+            end = length - 1
+    except ValueError:
+        return None
+    end = min(end, length - 1)
+    if start > end:
+        raise HTTPException(status_code=416, detail="Запрошенный диапазон недоступен",
+                            headers={"Content-Range": f"bytes */{length}"})
+    return start, end
+
+
+def _image_response(data: bytes, headers: dict, range_header: Optional[str]) -> Response:
+    """Ответ с телом изображения, при запросе диапазона - 206 Partial Content"""
+    byte_range = _parse_range(range_header, len(data)) if range_header else None
+    if byte_range is None:
+        return Response(content=data, media_type="image/jpeg", headers=headers)
+    start, end = byte_range
+    return Response(
+        content=data[start:end + 1],
+        status_code=206,
+        media_type="image/jpeg",
+        headers={**headers, "Content-Range": f"bytes {start}-{end}/{len(data)}"}
+    )
+
+
 @router.get("/{violation_id}/image")
-async def get_violation_image(violation_id: str):
-    """Получение изображения нарушения"""
+async def get_violation_image(request: Request, violation_id: str,
+                              size: str = Query("full", regex="^(full|thumb)$")):
+    """Получение изображения нарушения (size=thumb - уменьшенная копия для списков)"""
     from app.services.logging_service import logging_service
     
-    # Сначала проверяем в базе данных
-    violation = logging_service.get_violation_by_id(violation_id)
+    if_none_match = request.headers.get("if-none-match")
+    range_header = request.headers.get("range")
     
-    # Если нет в базе, проверяем в памяти
-    if violation is None:
-        violation_in_memory = monitoring_service.get_violation(violation_id)
-        if violation_in_memory is None:
-            raise HTTPException(status_code=404, detail="Нарушение не найдено")
-        image_path_str = violation_in_memory.image_path
-    else:
-        image_path_str = violation.get("image_path")
+    # Снимки недавних нарушений отдаются из памяти без обращения к БД и диску
+    if size == "full":
+        snapshot = snapshot_cache.get(violation_id)
+        if snapshot is not None and not snapshot.path.exists():
+            # Файл удален очисткой журнала: ответ ниже будет 404
+            snapshot_cache.discard(violation_id)
+            snapshot = None
+        if snapshot is not None:
+            headers = {
+                "ETag": _image_etag(snapshot.path, size),
+                "Cache-Control": IMAGE_CACHE_CONTROL,
+                "Accept-Ranges": "bytes",
+                "Content-Disposition": f'attachment; filename="{snapshot.path.name}"'
+            }
+            if _etag_matches(if_none_match, headers["ETag"]):
+                return Response(status_code=304, headers=headers)
+            return _image_response(snapshot.data, headers, range_header)
     
-    if not image_path_str:
-        raise HTTPException(status_code=404, detail="Путь к изображению не найден")
+    # Путь к снимку ищем в индексе в памяти, в базу обращаемся только при промахе
+    image_path_str = image_index.get(violation_id)
+    if image_path_str is None:
+        violation = await run_db(logging_service.get_violation_by_id, violation_id)
+        
+        # Если нет в базе, проверяем в памяти
+        if violation is None:
+            violation_in_memory = monitoring_service.get_violation(violation_id)
+            if violation_in_memory is None:
+                raise HTTPException(status_code=404, detail="Нарушение не найдено")
+            image_path_str = violation_in_memory.image_path
+        else:
+            image_path_str = violation.get("image_path")
+        
+        if not image_path_str:
+            raise HTTPException(status_code=404, detail="Путь к изображению не найден")
+        image_index.put(violation_id, image_path_str)
     
     image_path = Path(image_path_str)
+    # Удаленный снимок не должен выглядеть "не измененным" для If-None-Match
     if not image_path.exists():
+        image_index.discard(violation_id)
         raise HTTPException(status_code=404, detail="Изображение не найдено")
     
+    headers = {
+        "ETag": _image_etag(image_path, size),
+        "Cache-Control": IMAGE_CACHE_CONTROL,
+        "Accept-Ranges": "bytes"
+    }
+    # Повторный запрос браузера или клиента не читает файл вовсе
+    if _etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    
+    if size == "thumb":
+        image_path = await run_db(snapshot_store.get_thumbnail, image_path)
+    
+    if range_header:
+        data = await run_db(image_path.read_bytes)
+        headers["Content-Disposition"] = f'attachment; filename="{image_path.name}"'
+        return _image_response(data, headers, range_header)
+    
     return FileResponse(
         path=str(image_path),
         media_type="image/jpeg",
-        filename=image_path.name
+        filename=image_path.name,
+        headers=headers
     )
 
 
 @router.delete("/{violation_id}")
+@bus.method("violations.delete")  # нарушения в памяти хранит основной процесс
 async def delete_violation(violation_id: str):
     """Удаление нарушения"""
     from app.services.logging_service import logging_service
     from app.utils.logger import logger
     
     # Сначала проверяем в базе данных (основной источник истины)
-    violation_from_db = logging_service.get_violation_by_id(violation_id)
+    violation_from_db = await run_db(logging_service.get_violation_by_id, violation_id)
     
     # Также проверяем в памяти (может быть, если сервер не перезапускался)
     violation_in_memory = monitoring_service.get_violation(violation_id)
@@ -110,19 +266,26 @@ async def delete_violation(violation_id: str):
             logger.warning(f"Не удалось удалить нарушение {violation_id} из памяти")
     
     # Удаляем из базы данных
-    db_success = logging_service.delete_violation(violation_id)
+    db_success = await run_db(logging_service.delete_violation, violation_id)
     if not db_success:
         raise HTTPException(status_code=500, detail="Ошибка при удалении нарушения из базы данных")
+    event_service.publish("violation_deleted", {"id": violation_id})
     
-    # Удаляем изображение, если оно существует
+    # Удаляем изображение, если оно существует и на него не ссылаются
+    # другие нарушения (снимок кадра общий для всех его нарушений)
+    snapshot_cache.discard(violation_id)
+    image_index.discard(violation_id)
     if image_path_str:
-        try:
-            image_path = Path(image_path_str)
-            if image_path.exists():
-                image_path.unlink()
-                logger.info(f"Изображение {image_path} удалено")
-        except Exception as e:
-            logger.warning(f"Не удалось удалить изображение {image_path_str}: {e}")
+        def remove_image():
+            if logging_service.is_image_referenced(image_path_str):
+                return
+            try:
+                snapshot_store.delete(Path(image_path_str))
+                logger.info(f"Изображение {image_path_str} удалено")
+            except Exception as e:
+                logger.warning(f"Не удалось удалить изображение {image_path_str}: {e}")
+        
+        await run_db(remove_image)
     
     return {"message": "Нарушение успешно удалено", "violation_id": violation_id}
 
@@ -3,6 +3,7 @@
 from fastapi import APIRouter, HTTPException
 from typing import List
 
+from app.core.bus import bus
 from app.models.zone import Zone, ZoneCreate, ZoneUpdate
 from app.services.zone_service import zone_service
 
@@ -15,13 +16,22 @@ async def get_zones():
     return zone_service.get_all_zones()
 
 
+# Файл зон изменяет только основной процесс (изменения выполняются через
+# шину), остальные процессы перечитывают его по сообщению zone_service
+
 @router.post("/", response_model=Zone, status_code=201)
 async def create_zone(zone_data: ZoneCreate):
     """Создание новой зоны"""
+    return await _create_zone(zone_data=zone_data.model_dump())
+
+
+@bus.method("zones.create")
+async def _create_zone(zone_data: dict):
     try:
-        return zone_service.create_zone(zone_data)
+        zone = zone_service.create_zone(ZoneCreate(**zone_data))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    return zone_service.zone_to_dict(zone)
 
 
 @router.get("/{zone_id}", response_model=Zone)
@@ -36,13 +46,19 @@ async def get_zone(zone_id: str):
 @router.put("/{zone_id}", response_model=Zone)
 async def update_zone(zone_id: str, zone_data: ZoneUpdate):
     """Обновление зоны"""
-    zone = zone_service.update_zone(zone_id, zone_data)
+    return await _update_zone(zone_id=zone_id, zone_data=zone_data.model_dump(exclude_unset=True))
+
+
+@bus.method("zones.update")
+async def _update_zone(zone_id: str, zone_data: dict):
+    zone = zone_service.update_zone(zone_id, ZoneUpdate(**zone_data))
     if zone is None:
         raise HTTPException(status_code=404, detail="Зона не найдена")
-    return zone
+    return zone_service.zone_to_dict(zone)
 
 
 @router.delete("/{zone_id}")
+@bus.method("zones.delete")
 async def delete_zone(zone_id: str):
     """Удаление зоны"""
     if not zone_service.delete_zone(zone_id):
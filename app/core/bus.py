@@ -0,0 +1,397 @@
+"""Локальная шина сообщений между процессами сервера"""
+
+import os
+import json
+import fcntl
+import socket
+import struct
+import asyncio
+import itertools
+import functools
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from fastapi import HTTPException
+
+from app.core.config import config
+from app.utils.logger import logger
+
+
+# Заголовок кадра шины: тип, длина темы, длина данных
+_HEADER = struct.Struct("!BHI")
+_MESSAGE, _SUBSCRIBE, _UNSUBSCRIBE = 1, 2, 3
+
+# Тема вызовов методов основного процесса
+RPC_TOPIC = "rpc"
+
+
+class LocalBus:
+    """
+    Pub/sub между процессами сервера через Unix domain socket, без внешнего брокера
+
+    Когда uvicorn запущен с несколькими воркерами, ровно один из них
+    становится основным: он держит блокировку bus.lock, слушает сокет шины
+    и выполняет захват видео, детекцию, мониторинг и эскалацию. Остальные
+    воркеры подключаются к нему, обслуживают HTTP и WebSocket клиентов и
+    получают через шину уведомления и события веб-интерфейса. Кадры
+    видеопотока передаются через разделяемую память (FrameRing), по шине
+    идут только их номера.
+
+    Основной процесс работает как концентратор: сообщение воркера
+    обрабатывается его подписчиками и пересылается другим воркерам,
+    подписанным на тему. Воркер сообщает о подписке на тему при первом
+    обработчике, поэтому, например, кадры видео пересылаются только тем
+    воркерам, у которых есть зрители.
+
+    Поверх pub/sub реализован вызов методов основного процесса (call):
+    на воркере он отправляется через шину, в основном процессе или при
+    выключенной шине (bus.enabled = false) выполняется напрямую.
+
+    Роль процесса определяется один раз при запуске. Если основной процесс
+    завершился, воркеры продолжают обслуживать HTTP, но видео, детекция,
+    уведомления и запись в БД останавливаются до перезапуска сервера:
+    воркер не может занять место основного на ходу, а uvicorn не
+    перезапускает завершившиеся воркеры.
+    """
+
+    def __init__(self):
+        self.enabled = config.get('bus.enabled', False)
+        self.socket_path = Path(config.get('bus.socket_path', 'data/bus.sock'))
+        self.lock_path = self.socket_path.with_suffix('.lock')
+        # Предел неотправленных байт на одно соединение; сверх него сообщения отбрасываются
+        self.max_buffer = config.get('bus.max_buffer', 8 * 1024 * 1024)
+        self.request_timeout = config.get('bus.request_timeout', 10.0)  # секунд на ответ основного процесса
+        self.reconnect_interval = config.get('bus.reconnect_interval', 1.0)
+
+        # Без шины процесс единственный и выполняет все сам
+        self.is_primary = True
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock_file = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        # Обработчики сообщений этого процесса: тема -> функции (вызываются в event loop)
+        self._handlers: Dict[str, List[Callable[[bytes], None]]] = {}
+        # Основной процесс: соединения воркеров и их подписки
+        self._peers: Dict[asyncio.StreamWriter, Set[str]] = {}
+        self._subscribed: Dict[str, asyncio.Event] = {}
+        # Воркер: соединение с основным процессом
+        self._hub: Optional[asyncio.StreamWriter] = None
+        self._hub_task: Optional[asyncio.Task] = None
+        # Методы, которые основной процесс выполняет по запросу воркеров
+        self._methods: Dict[str, Callable[..., Awaitable[Any]]] = {}
+        self._requests: Dict[int, asyncio.Future] = {}
+        self._request_ids = itertools.count(1)
+        self._reply_topic = f"reply.{os.getpid()}"
+        self._background_tasks = set()
+        self._primary_lost_reported = False
+
+    async def start(self):
+        """
+        Подключение к шине; определяет, является ли процесс основным
+
+        Основным становится процесс, первым захвативший блокировку.
+        """
+        self._loop = asyncio.get_running_loop()
+        if not self.enabled:
+            return
+
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock_file = open(self.lock_path, 'w')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lock_file.close()
+            self._lock_file = None
+            self.is_primary = False
+
+        if self.is_primary:
+            # Сокет мог остаться от завершившегося аварийно процесса
+            try:
+                self.socket_path.unlink()
+            except FileNotFoundError:
+                pass
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.bind(str(self.socket_path))
+            self._server = await asyncio.start_unix_server(self._serve_peer, sock=sock)
+            self.subscribe(RPC_TOPIC, self._on_request)
+            logger.info(f"Процесс {os.getpid()} - основной, шина сообщений: {self.socket_path}")
+        else:
+            self.subscribe(self._reply_topic, self._on_reply)
+            self._hub_task = asyncio.create_task(self._hub_loop())
+            logger.info(f"Процесс {os.getpid()} - воркер API, подключение к шине {self.socket_path}")
+
+    async def stop(self):
+        """Закрытие соединений шины"""
+        if self._hub_task is not None:
+            self._hub_task.cancel()
+            self._hub_task = None
+        if self._hub is not None:
+            self._hub.close()
+            self._hub = None
+        for writer in list(self._peers):
+            writer.close()
+        self._peers.clear()
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            try:
+                self.socket_path.unlink()
+            except FileNotFoundError:
+                pass
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def subscribe(self, topic: str, handler: Callable[[bytes], None]):
+        """
+        Подписка на сообщения других процессов
+
+        Обработчик вызывается в event loop. Может вызываться из любого потока.
+        """
+        if self._call_in_loop(self.subscribe, topic, handler):
+            return
+        handlers = self._handlers.setdefault(topic, [])
+        handlers.append(handler)
+        if len(handlers) == 1 and self._hub is not None:
+            self._write(self._hub, _SUBSCRIBE, topic)
+
+    def unsubscribe(self, topic: str, handler: Callable[[bytes], None]):
+        """Отмена подписки (может вызываться из любого потока)"""
+        if self._call_in_loop(self.unsubscribe, topic, handler):
+            return
+        handlers = self._handlers.get(topic)
+        if not handlers or handler not in handlers:
+            return
+        handlers.remove(handler)
+        if not handlers:
+            del self._handlers[topic]
+            if self._hub is not None:
+                self._write(self._hub, _UNSUBSCRIBE, topic)
+
+    def publish(self, topic: str, payload: bytes):
+        """
+        Отправка сообщения другим процессам, подписанным на тему
+
+        Обработчики этого же процесса не вызываются. Может вызываться из
+        любого потока.
+        """
+        if not self.enabled or self._loop is None or self._loop.is_closed():
+            return
+        if not self._call_in_loop(self._publish, topic, payload):
+            self._publish(topic, payload)
+
+    def _call_in_loop(self, func: Callable, *args) -> bool:
+        """
+        Передача вызова в event loop шины, если он сделан из другого потока
+
+        Returns:
+            True если вызов передан, False если его нужно выполнить на месте
+        """
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return False
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            return False
+        loop.call_soon_threadsafe(func, *args)
+        return True
+
+    def has_remote_subscribers(self, topic: str) -> bool:
+        """Есть ли в других процессах подписчики темы (для основного процесса)"""
+        if not self.enabled:
+            return False
+        if not self.is_primary:
+            return self._hub is not None
+        return any(topic in topics for topics in list(self._peers.values()))
+
+    async def wait_for_subscribers(self, topic: str):
+        """Ожидание появления подписчиков темы в других процессах"""
+        while not self.has_remote_subscribers(topic):
+            event = self._subscribed.setdefault(topic, asyncio.Event())
+            event.clear()
+            await event.wait()
+
+    def method(self, name: str):
+        """
+        Декоратор: функция выполняется в основном процессе
+
+        Функция регистрируется как метод шины, а вместо нее возвращается
+        обертка с той же сигнатурой, вызывающая ее через call. Аргументы
+        передаются по имени и должны сериализоваться в JSON.
+        """
+        def register(func: Callable[..., Awaitable[Any]]):
+            self._methods[name] = func
+
+            @functools.wraps(func)
+            async def call_method(**params):
+                return await self.call(name, **params)
+            return call_method
+        return register
+
+    async def call(self, name: str, **params) -> Any:
+        """
+        Вызов метода основного процесса
+
+        Raises:
+            HTTPException: ошибка метода (с его кодом) или 503, если
+                основной процесс не ответил за request_timeout
+        """
+        if self.is_primary:
+            return await self._methods[name](**params)
+        if self._hub is None:
+            raise HTTPException(status_code=503, detail="Основной процесс сервера недоступен")
+
+        request_id = next(self._request_ids)
+        future = self._loop.create_future()
+        self._requests[request_id] = future
+        self._publish(RPC_TOPIC, json.dumps({
+            "id": request_id, "reply_to": self._reply_topic, "method": name, "params": params
+        }, ensure_ascii=False).encode('utf-8'))
+        try:
+            reply = await asyncio.wait_for(future, self.request_timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="Основной процесс сервера не ответил")
+        finally:
+            self._requests.pop(request_id, None)
+        if "error" in reply:
+            raise HTTPException(status_code=reply.get("status_code", 500), detail=reply["error"])
+        return reply.get("result")
+
+    def _on_request(self, payload: bytes):
+        """Вызов метода по запросу воркера (в основном процессе)"""
+        request = json.loads(payload)
+        task = asyncio.ensure_future(self._execute(request))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def _execute(self, request: dict):
+        reply: Dict[str, Any] = {"id": request["id"]}
+        try:
+            method = self._methods.get(request["method"])
+            if method is None:
+                raise HTTPException(status_code=404, detail=f"Неизвестный метод шины {request['method']}")
+            reply["result"] = await method(**request.get("params", {}))
+        except HTTPException as e:
+            reply["error"] = e.detail
+            reply["status_code"] = e.status_code
+        except Exception as e:
+            logger.error(f"Ошибка при выполнении метода шины {request.get('method')}: {e}", exc_info=True)
+            reply["error"] = str(e)
+        self._publish(request["reply_to"], json.dumps(reply, ensure_ascii=False).encode('utf-8'))
+
+    def _on_reply(self, payload: bytes):
+        """Ответ основного процесса на вызов метода (на воркере)"""
+        reply = json.loads(payload)
+        future = self._requests.get(reply.get("id"))
+        if future is not None and not future.done():
+            future.set_result(reply)
+
+    def _publish(self, topic: str, payload: bytes):
+        if self.is_primary:
+            for writer, topics in list(self._peers.items()):
+                if topic in topics:
+                    self._write(writer, _MESSAGE, topic, payload)
+        elif self._hub is not None:
+            self._write(self._hub, _MESSAGE, topic, payload)
+
+    def _dispatch(self, topic: str, payload: bytes):
+        """Вызов обработчиков темы в этом процессе"""
+        for handler in list(self._handlers.get(topic, ())):
+            try:
+                handler(payload)
+            except Exception as e:
+                logger.error(f"Ошибка в обработчике сообщения шины {topic}: {e}", exc_info=True)
+
+    def _write(self, writer: asyncio.StreamWriter, kind: int, topic: str, payload: bytes = b""):
+        """Запись кадра без ожидания; при переполнении буфера соединения кадр отбрасывается"""
+        if writer.is_closing():
+            return
+        if kind == _MESSAGE and writer.transport.get_write_buffer_size() > self.max_buffer:
+            logger.warning(f"Получатель на шине не успевает принимать сообщения, сообщение {topic} отброшено")
+            return
+        encoded = topic.encode('utf-8')
+        writer.write(_HEADER.pack(kind, len(encoded), len(payload)) + encoded + payload)
+
+    @staticmethod
+    async def _read_frame(reader: asyncio.StreamReader):
+        header = await reader.readexactly(_HEADER.size)
+        kind, topic_length, payload_length = _HEADER.unpack(header)
+        topic = (await reader.readexactly(topic_length)).decode('utf-8')
+        payload = await reader.readexactly(payload_length) if payload_length else b""
+        return kind, topic, payload
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Соединение воркера с основным процессом"""
+        topics: Set[str] = set()
+        self._peers[writer] = topics
+        try:
+            while True:
+                kind, topic, payload = await self._read_frame(reader)
+                if kind == _SUBSCRIBE:
+                    topics.add(topic)
+                    event = self._subscribed.get(topic)
+                    if event is not None:
+                        event.set()
+                elif kind == _UNSUBSCRIBE:
+                    topics.discard(topic)
+                elif kind == _MESSAGE:
+                    self._dispatch(topic, payload)
+                    # Пересылка остальным подписанным воркерам
+                    for other, other_topics in list(self._peers.items()):
+                        if other is not writer and topic in other_topics:
+                            self._write(other, _MESSAGE, topic, payload)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._peers.pop(writer, None)
+            writer.close()
+
+    async def _hub_loop(self):
+        """Подключение воркера к основному процессу с повторными попытками"""
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(str(self.socket_path))
+            except (FileNotFoundError, ConnectionError, OSError):
+                self._check_primary_alive()
+                await asyncio.sleep(self.reconnect_interval)
+                continue
+
+            self._hub = writer
+            self._primary_lost_reported = False
+            for topic in self._handlers:
+                self._write(writer, _SUBSCRIBE, topic)
+            logger.info("Воркер подключен к шине сообщений")
+            try:
+                while True:
+                    kind, topic, payload = await self._read_frame(reader)
+                    if kind == _MESSAGE:
+                        self._dispatch(topic, payload)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                logger.warning("Соединение с основным процессом по шине потеряно")
+            finally:
+                self._hub = None
+                writer.close()
+                for future in self._requests.values():
+                    if not future.done():
+                        future.set_result({"error": "Основной процесс сервера недоступен", "status_code": 503})
+            await asyncio.sleep(self.reconnect_interval)
+
+    def _check_primary_alive(self):
+        """Сообщение в журнал, если основной процесс завершился (блокировка свободна)"""
+        if self._primary_lost_reported:
+            return
+        with open(self.lock_path, 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return  # основной процесс жив (например, еще запускается)
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        self._primary_lost_reported = True
+        logger.error("Основной процесс сервера завершился: видео, детекция и уведомления "
+                     "остановлены, требуется перезапуск сервера")
+
+
+# Глобальный экземпляр шины
+bus = LocalBus()
@@ -0,0 +1,122 @@
+"""Пул соединений SQLite"""
+
+import sqlite3
+import queue
+import asyncio
+import threading
+import functools
+from pathlib import Path
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Callable, Any
+
+from app.core.config import config
+
+
+class SQLitePool:
+    """
+    Пул долгоживущих соединений SQLite в режиме WAL
+
+    Одно соединение на запись (доступ сериализуется через lock) и несколько
+    соединений только на чтение. В режиме WAL читатели не блокируют писателя
+    и наоборот, а соединения не открываются заново на каждый запрос.
+    """
+
+    def __init__(self, db_path: Path, read_pool_size: int = None):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.read_pool_size = max(1, read_pool_size or config.get('database.read_pool_size', 4))
+
+        self.synchronous = config.get('database.synchronous', 'NORMAL')
+        self.cache_size = config.get('database.cache_size', -16000)  # отрицательное значение - KiB
+        self.mmap_size = config.get('database.mmap_size', 268435456)
+        self.busy_timeout = config.get('database.busy_timeout', 5000)  # мс
+
+        self.write_lock = threading.RLock()
+        self._writer = self._open(read_only=False)
+        # Освобожденные страницы возвращаются по частям (incremental_vacuum).
+        # Режим применяется только к новому файлу, поэтому задается до
+        # включения WAL и создания таблиц; старую базу переводит main.py --vacuum
+        self._writer.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self._writer.execute("PRAGMA journal_mode=WAL")
+
+        self._readers: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        self._all_readers: List[sqlite3.Connection] = []
+        for _ in range(self.read_pool_size):
+            conn = self._open(read_only=True)
+            self._all_readers.append(conn)
+            self._readers.put(conn)
+
+    def _open(self, read_only: bool) -> sqlite3.Connection:
+        """Открытие соединения с настроенными pragma"""
+        if read_only:
+            conn = sqlite3.connect(
+                f"file:{self.db_path.resolve()}?mode=ro",
+                uri=True,
+                check_same_thread=False,
+                timeout=self.busy_timeout / 1000
+            )
+        else:
+            conn = sqlite3.connect(
+                str(self.db_path),
+                check_same_thread=False,
+                timeout=self.busy_timeout / 1000
+            )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout)}")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA cache_size={int(self.cache_size)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    @contextmanager
+    def writer(self):
+        """Эксклюзивный доступ к соединению на запись"""
+        with self.write_lock:
+            try:
+                yield self._writer
+            except Exception:
+                self._writer.rollback()
+                raise
+
+    @contextmanager
+    def reader(self):
+        """Соединение только на чтение из пула"""
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            # Завершаем неявную транзакцию чтения, чтобы не удерживать снимок WAL
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
+
+    def close(self):
+        """Закрытие всех соединений пула"""
+        with self.write_lock:
+            for conn in self._all_readers:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._all_readers.clear()
+            try:
+                self._writer.close()
+            except sqlite3.Error:
+                pass
+
+
+# Отдельный пул потоков для обращений к БД из async-кода: блокирующие
+# запросы не выполняются в потоке event loop и не конкурируют с прочими
+# задачами стандартного threadpool (потоковые ответы, загрузка файлов)
+db_executor = ThreadPoolExecutor(
+    max_workers=config.get('database.executor_workers', config.get('database.read_pool_size', 4) + 1),
+    thread_name_prefix="db"
+)
+
+
+async def run_db(func: Callable, *args, **kwargs) -> Any:
+    """Выполнение синхронной функции доступа к БД в db_executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, functools.partial(func, *args, **kwargs))
@@ -0,0 +1,175 @@
+"""Кольцевой буфер кадров в разделяемой памяти"""
+
+import os
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Optional, Tuple
+
+import numpy as np
+
+from app.utils.logger import logger
+
+
+class FrameRing:
+    """
+    Кольцо слотов фиксированного размера для передачи кадров между процессами
+
+    Кадры пишет один процесс (основной), читают любые процессы, открывшие
+    буфер по имени. Читатель получает кадр как NumPy-представление памяти
+    слота, без сериализации и копирования.
+
+    Синхронизация без блокировок: у каждого слота есть номер кадра. Перед
+    записью писатель обнуляет его, после записи ставит номер нового кадра и
+    обновляет номер последнего кадра в заголовке. Читатель берет кадр, только
+    если номер слота совпадает с запрошенным, и после обработки проверяет
+    через is_current, что слот не был перезаписан (тогда результат
+    отбрасывается). Номера кадров не повторяются, поэтому совпадение номера
+    означает, что данные слота не менялись.
+
+    Раскладка памяти: заголовок (магическое число, число слотов, размер
+    слота, PID процесса-писателя, номер последнего кадра), метаданные
+    слотов (номер кадра, высота, ширина, число каналов; частота кадров,
+    время записи), затем данные слотов.
+    """
+
+    MAGIC = 0x46524E47  # "FRNG"
+    _HEADER_FIELDS = 5
+    _ALIGN = 64
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        self._shm = shm
+        self.owner = owner
+        self.name = shm.name
+        header = np.ndarray((self._HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+        if header[0] != self.MAGIC:
+            raise ValueError(f"Разделяемая память {shm.name} не является буфером кадров")
+        self.slots = int(header[1])
+        self.slot_size = int(header[2])
+        # Буфер, пересозданный перезапущенным писателем, отличается PID
+        self.writer_pid = int(header[3])
+        self._header = header
+        self._meta, self._timing, self._data_offset = self._layout(shm.buf, self.slots)
+
+    @classmethod
+    def _layout(cls, buf, slots: int):
+        meta_offset = cls._HEADER_FIELDS * 8
+        timing_offset = meta_offset + slots * 4 * 8
+        data_offset = timing_offset + slots * 2 * 8
+        data_offset = (data_offset + cls._ALIGN - 1) // cls._ALIGN * cls._ALIGN
+        meta = np.ndarray((slots, 4), dtype=np.int64, buffer=buf, offset=meta_offset)
+        timing = np.ndarray((slots, 2), dtype=np.float64, buffer=buf, offset=timing_offset)
+        return meta, timing, data_offset
+
+    @classmethod
+    def create(cls, name: str, slots: int, max_width: int, max_height: int, channels: int = 3) -> "FrameRing":
+        """
+        Создание буфера (в процессе-писателе)
+
+        Буфер с тем же именем, оставшийся от аварийно завершившегося
+        процесса, удаляется.
+        """
+        try:
+            stale = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            pass
+        else:
+            stale.close()
+            stale.unlink()
+
+        slot_size = (max_width * max_height * channels + cls._ALIGN - 1) // cls._ALIGN * cls._ALIGN
+        header_size = cls._HEADER_FIELDS * 8 + slots * 6 * 8
+        header_size = (header_size + cls._ALIGN - 1) // cls._ALIGN * cls._ALIGN
+        shm = shared_memory.SharedMemory(name=name, create=True, size=header_size + slots * slot_size)
+        header = np.ndarray((cls._HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+        header[:] = (cls.MAGIC, slots, slot_size, os.getpid(), 0)
+        del header
+        logger.info(f"Буфер кадров {name}: {slots} слотов по {slot_size // 1024} КБ")
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> Optional["FrameRing"]:
+        """Открытие буфера, созданного другим процессом; None, если его еще нет"""
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            return None
+        # Буфером владеет процесс-писатель: без этого resource_tracker
+        # читателя удалил бы разделяемую память при его завершении
+        resource_tracker.unregister(shm._name, "shared_memory")
+        try:
+            return cls(shm, owner=False)
+        except ValueError:
+            shm.close()
+            raise
+
+    @property
+    def latest_seq(self) -> int:
+        """Номер последнего записанного кадра (0 - кадров еще не было)"""
+        return int(self._header[4])
+
+    def write(self, frame: np.ndarray, fps: float) -> int:
+        """
+        Запись кадра в следующий слот (только в процессе-писателе)
+
+        Returns:
+            Номер записанного кадра
+        """
+        if frame.dtype != np.uint8 or frame.nbytes > self.slot_size:
+            raise ValueError(f"Кадр {frame.shape} {frame.dtype} не помещается в слот буфера")
+        seq = self.latest_seq + 1
+        slot = seq % self.slots
+        height, width = frame.shape[:2]
+        channels = frame.shape[2] if frame.ndim == 3 else 1
+
+        self._meta[slot, 0] = 0  # слот перезаписывается
+        target = np.ndarray(frame.shape, dtype=np.uint8, buffer=self._shm.buf,
+                            offset=self._data_offset + slot * self.slot_size)
+        np.copyto(target, frame)
+        self._meta[slot, 1:] = (height, width, channels)
+        self._timing[slot] = (fps, time.time())
+        self._meta[slot, 0] = seq
+        self._header[4] = seq
+        return seq
+
+    def read(self, seq: int) -> Optional[Tuple[np.ndarray, float]]:
+        """
+        Кадр с номером seq как представление памяти слота, без копирования
+
+        Представление остается корректным, пока is_current(seq) возвращает
+        True; результат обработки кадра нужно проверять после нее.
+
+        Returns:
+            (кадр, частота кадров) или None, если слот уже перезаписан
+        """
+        if seq <= 0:
+            return None
+        slot = seq % self.slots
+        if self._meta[slot, 0] != seq:
+            return None
+        height, width, channels = (int(v) for v in self._meta[slot, 1:])
+        fps = float(self._timing[slot, 0])
+        shape = (height, width, channels) if channels > 1 else (height, width)
+        frame = np.ndarray(shape, dtype=np.uint8, buffer=self._shm.buf,
+                           offset=self._data_offset + slot * self.slot_size)
+        frame.flags.writeable = False
+        if self._meta[slot, 0] != seq:
+            return None
+        return frame, fps
+
+    def is_current(self, seq: int) -> bool:
+        """Не перезаписан ли слот кадра seq"""
+        return seq > 0 and self._meta[seq % self.slots, 0] == seq
+
+    def close(self):
+        """Закрытие буфера; процесс-писатель также удаляет его"""
+        # Представления памяти должны быть освобождены до закрытия
+        self._header = self._meta = self._timing = None
+        try:
+            self._shm.close()
+        except BufferError:
+            logger.warning(f"Буфер кадров {self.name} закрыт при наличии представлений кадров")
+        if self.owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
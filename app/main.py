@@ -1,5 +1,6 @@
 """Основное приложение FastAPI"""
 
+import asyncio
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -7,11 +8,18 @@ from fastapi.templating import Jinja2Templates
 from pathlib import Path
 
 from app.core.config import config
-from app.api import status, clients, video, models, zones, violations, monitoring, notifications, logs
+from app.api import status, clients, video, models, zones, violations, monitoring, notifications, logs, events
 from app.services.detection_service import detection_service
-from app.services.video_service import video_service
+from app.services.video_service import video_service, relay_frames
 from app.services.monitoring_service import monitoring_service
 from app.services.notification_service import notification_service
+from app.services.logging_service import logging_service
+from app.services.retention_service import retention_service
+from app.services.escalation_service import escalation_service
+from app.services.event_service import event_service
+from app.services.client_registry import client_registry
+from app.core.bus import bus
+from app.core.database import db_executor
 from app.utils.logger import logger
 
 # Глобальный флаг для отслеживания состояния приложения
@@ -43,6 +51,7 @@ app.include_router(violations.router, prefix="/api/violations", tags=["violation
 app.include_router(monitoring.router, prefix="/api/monitoring", tags=["monitoring"])
 app.include_router(notifications.router, prefix="/api/notifications", tags=["notifications"])
 app.include_router(logs.router, prefix="/api/logs", tags=["logs"])
+app.include_router(events.router, prefix="/api", tags=["events"])
 
 # Статические файлы для веб-интерфейса
 static_path = Path(__file__).parent.parent / "static"
@@ -58,6 +67,19 @@ templates = Jinja2Templates(directory=str(templates_path)) if templates_path.exi
 async def startup_event():
     """Инициализация сервисов при старте"""
     logger.info("Запуск приложения...")
+    loop = asyncio.get_running_loop()
+    # Подключение к шине процессов; при нескольких воркерах определяет основной процесс
+    await bus.start()
+    notification_service.start(loop)
+    # Поток событий веб-интерфейса публикуется в event loop приложения
+    event_service.start(loop)
+    # Время активности устройств записывается в БД пачками
+    client_registry.start()
+    if not bus.is_primary:
+        # Видео, детекция, мониторинг и очистка журнала работают в основном процессе
+        logger.info("Приложение готово к работе (воркер API)")
+        return
+    
     # Инициализация модели детекции из конфигурации
     model_name = config.get_detection_model()
     if model_name:
@@ -72,6 +94,14 @@ async def startup_event():
             logger.error(f"Ошибка при загрузке модели {model_name}: {e}", exc_info=True)
     else:
         logger.info("Модель детекции не указана в конфигурации")
+    
+    # Фоновая очистка журнала по политикам хранения
+    retention_service.start()
+    # Таймеры эскалации неотвеченных нарушений работают в event loop приложения
+    escalation_service.start(loop)
+    if bus.enabled:
+        # Кадры видеопотока для зрителей, подключенных к другим воркерам
+        app.state.frame_relay = asyncio.create_task(relay_frames())
     logger.info("Приложение готово к работе")
 
 
@@ -83,6 +113,13 @@ async def shutdown_event():
     
     logger.info("Остановка приложения...")
     
+    # Закрываем потоки событий веб-интерфейса, чтобы сервер не ждал их завершения
+    event_service.stop()
+    
+    frame_relay = getattr(app.state, "frame_relay", None)
+    if frame_relay is not None:
+        frame_relay.cancel()
+    
     # Останавливаем мониторинг (первым, так как он может использовать другие сервисы)
     try:
         logger.info("Остановка мониторинга...")
@@ -100,6 +137,7 @@ async def shutdown_event():
         logger.error(f"Ошибка при остановке видеосервиса: {e}", exc_info=True)
     
     # Закрываем все WebSocket соединения
+    notification_service.stop()
     try:
         logger.info("Закрытие WebSocket соединений...")
         # Получаем список всех подключенных клиентов и отключаем их
@@ -121,6 +159,29 @@ async def shutdown_event():
     except Exception as e:
         logger.error(f"Ошибка при очистке ресурсов детекции: {e}", exc_info=True)
     
+    # Останавливаем таймеры эскалации и очистку журнала
+    escalation_service.stop()
+    try:
+        retention_service.stop()
+    except Exception as e:
+        logger.error(f"Ошибка при остановке очистки журнала: {e}", exc_info=True)
+    
+    client_registry.stop()
+    
+    try:
+        await bus.stop()
+    except Exception as e:
+        logger.error(f"Ошибка при закрытии шины сообщений: {e}", exc_info=True)
+    
+    # Закрываем соединения с базой данных (последними, так как их используют остальные сервисы)
+    try:
+        logger.info("Закрытие соединений с базой данных...")
+        db_executor.shutdown(wait=False)
+        logging_service.close()
+        logger.info("Соединения с базой данных закрыты")
+    except Exception as e:
+        logger.error(f"Ошибка при закрытии базы данных: {e}", exc_info=True)
+    
     logger.info("Приложение остановлено")
 
 
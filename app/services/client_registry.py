@@ -0,0 +1,124 @@
+"""Реестр зарегистрированных устройств"""
+
+import json
+import uuid
+import threading
+from typing import Dict, List, Optional
+from datetime import datetime
+
+from app.core.bus import bus
+from app.core.config import config
+from app.services.logging_service import logging_service
+from app.utils.logger import logger
+
+
+class ClientRegistry:
+    """
+    Зарегистрированные устройства (хранятся в SQLite)
+
+    Активность устройств (подключение, сообщения WebSocket, ping) только
+    отмечается в памяти: время последней активности каждого устройства
+    записывается в БД одной пачкой раз в flush_interval секунд, поэтому
+    heartbeat множества устройств не превращается в запись на каждый ping.
+    Чтение реестра учитывает еще не записанные отметки. В БД пишет только
+    основной процесс: воркеры передают ему пачку отметок через шину.
+    """
+
+    # Тема шины с отметками активности от воркеров
+    BUS_TOPIC = "clients.last_seen"
+
+    def __init__(self):
+        self.flush_interval = config.get('clients.last_seen_flush_interval', 30.0)  # секунд
+        self._last_seen: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Запуск фоновой записи времени активности"""
+        if self._thread and self._thread.is_alive():
+            return
+        if bus.is_primary:
+            bus.subscribe(self.BUS_TOPIC, self._on_remote_last_seen)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name="clients-last-seen", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Остановка фоновой записи с сохранением накопленных отметок"""
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=5.0)
+        self.flush()
+
+    def _loop(self):
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка при записи времени активности клиентов: {e}", exc_info=True)
+
+    def flush(self) -> int:
+        """
+        Запись накопленных отметок активности в БД
+
+        Returns:
+            Количество устройств в пачке
+        """
+        with self._lock:
+            batch, self._last_seen = self._last_seen, {}
+        if not batch:
+            return 0
+        if bus.is_primary:
+            logging_service.update_clients_last_seen(batch)
+        else:
+            bus.publish(self.BUS_TOPIC, json.dumps(batch).encode('utf-8'))
+        return len(batch)
+
+    def _on_remote_last_seen(self, payload: bytes):
+        """Отметки активности клиентов, подключенных к воркерам (в основном процессе)"""
+        logging_service.update_clients_last_seen(json.loads(payload))
+
+    def touch(self, client_id: str):
+        """Отметка активности устройства (без обращения к БД)"""
+        now = datetime.now().isoformat()
+        with self._lock:
+            self._last_seen[client_id] = now
+
+    def register(self, device_id: str, device_name: str, platform: str) -> Dict:
+        """
+        Регистрация устройства
+
+        Повторная регистрация того же device_id (например, после
+        переустановки приложения) возвращает прежний client_id.
+        """
+        client = logging_service.register_client(str(uuid.uuid4()), device_id, device_name, platform)
+        with self._lock:
+            self._last_seen.pop(client["client_id"], None)
+        return client
+
+    def unregister(self, client_id: str) -> bool:
+        """Удаление устройства из реестра"""
+        with self._lock:
+            self._last_seen.pop(client_id, None)
+        return logging_service.unregister_client(client_id)
+
+    def get(self, client_id: str) -> Optional[Dict]:
+        """Зарегистрированное устройство по client_id"""
+        client = logging_service.get_client(client_id)
+        return self._with_last_seen(client) if client is not None else None
+
+    def get_all(self) -> List[Dict]:
+        """Все зарегистрированные устройства"""
+        return [self._with_last_seen(client) for client in logging_service.get_clients()]
+
+    def _with_last_seen(self, client: Dict) -> Dict:
+        with self._lock:
+            seen = self._last_seen.get(client["client_id"])
+        if seen is not None and seen > client["last_seen"]:
+            client["last_seen"] = seen
+        return client
+
+
+# Глобальный экземпляр реестра
+client_registry = ClientRegistry()
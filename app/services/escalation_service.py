@@ -0,0 +1,189 @@
+"""Сервис эскалации неотвеченных нарушений"""
+
+import heapq
+import asyncio
+import itertools
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import config
+from app.core.database import run_db
+from app.utils.logger import logger
+
+
+class EscalationService:
+    """
+    Таймеры эскалации для нарушений, ожидающих ответа оператора
+
+    Для каждого нарушения, о котором отправлено уведомление, выполняется
+    один и тот же план: повторные уведомления, уведомление группы эскалации
+    и, если ответа так и нет, перевод в статус "unanswered".
+
+    Все таймеры хранятся в одной куче (deadline, ...) и обслуживаются одним
+    TimerHandle event loop приложения, взведенным на ближайший срок, без
+    отдельного потока и без задачи на каждое нарушение. В куче не больше
+    одной записи на нарушение: следующий шаг плана добавляется, когда
+    срабатывает предыдущий. Отвеченные нарушения удаляются из нее лениво.
+
+    Нарушения одного группового уведомления отслеживаются вместе: повторное
+    уведомление содержит только те из них, что еще ждут ответа.
+    """
+
+    def __init__(self):
+        self.enabled = config.get('notifications.escalation.enabled', True)
+        # Повторные уведомления всем клиентам, секунд после первого уведомления
+        renotify_after: List[float] = config.get('notifications.escalation.renotify_after', [60, 180])
+        # Уведомление группы эскалации (notifications.timeout, секунд)
+        escalate_after: float = config.get('notifications.timeout', 300)
+        self.escalation_clients: List[str] = config.get('notifications.escalation.clients', [])
+        # Перевод в статус "unanswered", секунд после первого уведомления
+        unanswered_after: Optional[float] = config.get('notifications.escalation.unanswered_after', 900)
+
+        # План эскалации: шаги (задержка, действие) по возрастанию задержки
+        plan: List[Tuple[float, str]] = [(delay, "renotify") for delay in renotify_after]
+        if self.escalation_clients:
+            plan.append((escalate_after, "escalate"))
+        if unanswered_after is not None:
+            plan.append((unanswered_after, "unanswered"))
+        self.plan = sorted(plan)
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._heap: List[Tuple[float, int, str, int]] = []  # (deadline, порядок, violation_id, шаг плана)
+        # ID первого нарушения группы -> (нарушения группы, время уведомления)
+        self._tracked: Dict[str, Tuple[List, float]] = {}
+        self._counter = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_deadline: Optional[float] = None
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        """Привязка планировщика к event loop приложения"""
+        self._loop = loop
+        if self.enabled and self.plan:
+            logger.info(f"Эскалация неотвеченных нарушений: {[f'{action} через {delay} сек' for delay, action in self.plan]}")
+
+    def stop(self):
+        """Отмена всех таймеров"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._heap.clear()
+        self._tracked.clear()
+
+    def track(self, violation, related: Optional[List] = None):
+        """
+        Начало отслеживания нарушения (и связанных с ним нарушений группового
+        уведомления), о котором отправлено уведомление
+
+        Может вызываться из любого потока: регистрация передается в event loop приложения.
+        """
+        if not self.enabled or not self.plan or self._loop is None or self._loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        group = [violation] + list(related or [])
+        if running is self._loop:
+            self._track(group)
+        else:
+            self._loop.call_soon_threadsafe(self._track, group)
+
+    def cancel(self, violation_id: str):
+        """Прекращение отслеживания, если у нарушения и его группы больше нет ожидающих ответа"""
+        tracked = self._tracked.get(violation_id)
+        if tracked is not None and all(v.status != "pending" for v in tracked[0]):
+            self._tracked.pop(violation_id, None)
+
+    def get_pending_count(self) -> int:
+        """Количество отслеживаемых нарушений"""
+        return len(self._tracked)
+
+    def _track(self, group: List):
+        key = group[0].id
+        if key in self._tracked:
+            return
+        started_at = self._loop.time()
+        self._tracked[key] = (group, started_at)
+        self._push(started_at + self.plan[0][0], key, 0)
+
+    def _push(self, deadline: float, violation_id: str, step: int):
+        heapq.heappush(self._heap, (deadline, next(self._counter), violation_id, step))
+        self._arm()
+
+    def _arm(self):
+        """Взвод единственного таймера на ближайший срок в куче"""
+        if not self._heap:
+            return
+        deadline = self._heap[0][0]
+        if self._timer is not None:
+            if self._timer_deadline <= deadline:
+                return
+            self._timer.cancel()
+        self._timer = self._loop.call_at(deadline, self._on_timer)
+        self._timer_deadline = deadline
+
+    def _on_timer(self):
+        """Выполнение всех наступивших шагов и перевзвод таймера"""
+        self._timer = None
+        self._timer_deadline = None
+        now = self._loop.time()
+        while self._heap and self._heap[0][0] <= now:
+            _, _, violation_id, step = heapq.heappop(self._heap)
+            tracked = self._tracked.get(violation_id)
+            if tracked is None:
+                continue
+            group, started_at = tracked
+            # Ответ мог быть получен по другому пути (веб-интерфейс, HTTP)
+            pending = [v for v in group if v.status == "pending"]
+            if not pending:
+                del self._tracked[violation_id]
+                continue
+
+            try:
+                self._run_step(pending, self.plan[step][1])
+            except Exception as e:
+                logger.error(f"Ошибка эскалации нарушения {violation_id}: {e}", exc_info=True)
+
+            if step + 1 < len(self.plan) and violation_id in self._tracked:
+                heapq.heappush(self._heap, (started_at + self.plan[step + 1][0], next(self._counter), violation_id, step + 1))
+            else:
+                self._tracked.pop(violation_id, None)
+        self._arm()
+
+    def _run_step(self, pending: List, action: str):
+        from app.services.notification_service import notification_service
+
+        violation, related = pending[0], pending[1:]
+        if action == "renotify":
+            logger.info(f"Повторное уведомление о неотвеченном нарушении {violation.id}")
+            notification_service._spawn(notification_service.send_notification(
+                violation, escalation="renotify", related=related
+            ))
+        elif action == "escalate":
+            logger.warning(f"Эскалация неотвеченного нарушения {violation.id} клиентам {self.escalation_clients}")
+            notification_service._spawn(notification_service.send_notification(
+                violation, client_ids=self.escalation_clients, escalation="escalate", related=related
+            ))
+        elif action == "unanswered":
+            for v in pending:
+                notification_service._spawn(run_db(self._mark_unanswered, v.id))
+
+    @staticmethod
+    def _mark_unanswered(violation_id: str):
+        """Перевод нарушения в статус "unanswered" (выполняется в db_executor)"""
+        from app.services.monitoring_service import monitoring_service
+        from app.services.logging_service import logging_service
+
+        violation = monitoring_service.get_violation(violation_id)
+        if violation is None or violation.status != "pending":
+            return
+        if monitoring_service.update_violation_status(violation_id, "unanswered"):
+            logger.warning(f"Нарушение {violation_id} осталось без ответа")
+            logging_service.log_system_event(
+                event_type="violation_unanswered",
+                message=f"Нарушение {violation_id} осталось без ответа оператора",
+                metadata={"violation_id": violation_id}
+            )
+
+
+# Глобальный экземпляр сервиса
+escalation_service = EscalationService()
@@ -0,0 +1,145 @@
+"""Сервис событий для веб-интерфейса (Server-Sent Events)"""
+
+import json
+import asyncio
+import itertools
+from typing import AsyncIterator, List, Optional, Set
+
+from app.core.bus import bus
+from app.core.config import config
+from app.utils.logger import logger
+
+
+class EventSubscriber:
+    """Очередь событий одного подключенного веб-клиента"""
+
+    def __init__(self, queue_size: int):
+        self.queue: "asyncio.Queue[Optional[str]]" = asyncio.Queue(maxsize=queue_size)
+
+
+class EventService:
+    """
+    Рассылка изменений состояния веб-интерфейсу через один поток SSE
+
+    Сервисы публикуют события (статус мониторинга, новые нарушения, смена
+    статуса, изменения зон и модели) из любого потока. Событие сериализуется
+    в кадр SSE один раз и раскладывается по очередям подписчиков в event loop
+    приложения. Пока ничего не меняется, клиенты не делают запросов.
+    """
+
+    # Тема шины, по которой события передаются веб-клиентам других процессов
+    BUS_TOPIC = "events"
+
+    def __init__(self):
+        self.queue_size = config.get('events.queue_size', 100)
+        self.keepalive = config.get('events.keepalive', 15.0)  # секунд между комментариями keep-alive
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._subscribers: Set[EventSubscriber] = set()
+        self._event_ids = itertools.count(1)
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        """Привязка к event loop приложения и прием событий других процессов"""
+        self._loop = loop
+        bus.subscribe(self.BUS_TOPIC, lambda payload: self._dispatch(payload.decode('utf-8')))
+
+    def stop(self):
+        """Закрытие всех потоков событий (иначе сервер ждет их завершения при остановке)"""
+        for subscriber in list(self._subscribers):
+            self._close(subscriber)
+
+    @staticmethod
+    def format_event(event_type: str, data, event_id: Optional[int] = None) -> str:
+        """Кадр SSE с событием event_type и данными в JSON"""
+        payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        prefix = f"id: {event_id}\n" if event_id is not None else ""
+        return f"{prefix}event: {event_type}\ndata: {payload}\n\n"
+
+    def publish(self, event_type: str, data):
+        """
+        Публикация события всем подписчикам
+
+        Может вызываться из любого потока. Если подписчиков нет ни в этом,
+        ни в других процессах, событие даже не сериализуется.
+        """
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        remote = bus.has_remote_subscribers(self.BUS_TOPIC)
+        if not self._subscribers and not remote:
+            return
+        frame = self.format_event(event_type, data, next(self._event_ids))
+        if remote:
+            bus.publish(self.BUS_TOPIC, frame.encode('utf-8'))
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._dispatch(frame)
+        else:
+            loop.call_soon_threadsafe(self._dispatch, frame)
+
+    def _dispatch(self, frame: str):
+        """Постановка кадра в очереди подписчиков (в event loop приложения)"""
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber.queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                # Клиент не успевает читать: закрываем поток, браузер
+                # переподключится и получит актуальное состояние заново
+                logger.warning("Подписчик событий не успевает принимать события, поток закрывается")
+                self._close(subscriber)
+
+    def _close(self, subscriber: EventSubscriber):
+        """Отписка с завершением потока клиента (непрочитанные события отбрасываются)"""
+        self._subscribers.discard(subscriber)
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(None)
+
+    def get_subscribers_count(self) -> int:
+        """Количество подключенных веб-клиентов"""
+        return len(self._subscribers)
+
+    def subscribe(self) -> EventSubscriber:
+        """
+        Регистрация подписчика (в event loop приложения)
+
+        Подписчика нужно зарегистрировать до чтения текущего состояния: тогда
+        изменения, опубликованные пока оно читается, накопятся в его очереди
+        и будут отправлены после состояния.
+        """
+        subscriber = EventSubscriber(self.queue_size)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: EventSubscriber):
+        """Отписка подписчика, поток которого так и не был запущен"""
+        self._subscribers.discard(subscriber)
+
+    async def stream(self, subscriber: EventSubscriber, initial: List[str]) -> AsyncIterator[str]:
+        """
+        Поток кадров SSE для одного клиента
+
+        Args:
+            subscriber: Подписчик, зарегистрированный через subscribe
+            initial: Кадры, отправляемые сразу после подключения (текущее состояние)
+        """
+        try:
+            for frame in initial:
+                yield frame
+            while True:
+                try:
+                    frame = await asyncio.wait_for(subscriber.queue.get(), self.keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if frame is None:
+                    break
+                yield frame
+        finally:
+            self._subscribers.discard(subscriber)
+
+
+# Глобальный экземпляр сервиса
+event_service = EventService()
@@ -1,14 +1,29 @@
 """Сервис для логирования событий системы"""
 
-import sqlite3
 import json
+import time
+import base64
+import queue
+import threading
 from pathlib import Path
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Callable, Set, Tuple, Iterator
 from datetime import datetime
-from contextlib import contextmanager
-import threading
 
 from app.core.config import config
+from app.core.database import SQLitePool
+from app.utils.logger import logger
+
+
+# Колонки нарушения в порядке, который ожидает _row_to_violation
+VIOLATION_COLUMNS = """
+    id, zone_id, zone_name, timestamp, image_path,
+    bbox_x1, bbox_y1, bbox_x2, bbox_y2, center_x, center_y, detection_confidence,
+    status, operator_response, operator_id, response_time,
+    crop_x1, crop_y1, crop_x2, crop_y2
+"""
+
+# Колонки зарегистрированного устройства (совпадают с полями ответа API)
+CLIENT_COLUMNS = ("client_id", "device_id", "device_name", "platform", "registered_at", "last_seen")
 
 
 class LoggingService:
@@ -16,13 +31,21 @@ class LoggingService:
     
     def __init__(self):
         self.db_path = Path(config.get_database_path())
-        self.db_path.parent.mkdir(parents=True, exist_ok=True)
-        self.lock = threading.Lock()
+        self.pool = SQLitePool(self.db_path)
+        self._vacuum_warned = False
         self._init_database()
+        
+        # Отложенная запись: операции копятся в очереди и фиксируются пачками
+        # одной транзакцией (один fsync на пачку вместо одного на событие)
+        self.write_batch_size = config.get('database.write_batch_size', 500)
+        self.write_max_latency = config.get('database.write_max_latency', 0.05)  # секунд
+        self._write_queue: "queue.Queue" = queue.Queue()
+        self._writer_thread = threading.Thread(target=self._writer_loop, name="db-writer", daemon=True)
+        self._writer_thread.start()
     
     def _init_database(self):
         """Инициализация базы данных"""
-        with self._get_connection() as conn:
+        with self.pool.writer() as conn:
             cursor = conn.cursor()
             
             # Таблица нарушений
@@ -66,258 +89,1132 @@ class LoggingService:
                 )
             """)
             
+            self._apply_migrations(cursor)
             conn.commit()
     
-    @contextmanager
-    def _get_connection(self):
-        """Контекстный менеджер для работы с БД"""
-        conn = sqlite3.connect(str(self.db_path))
-        conn.row_factory = sqlite3.Row
+    def _apply_migrations(self, cursor):
+        """
+        Применение миграций схемы
+        
+        Версия схемы хранится в PRAGMA user_version; миграция с номером N
+        применяется, если текущая версия меньше N.
+        
+        Базу одновременно открывают все воркеры uvicorn, поэтому каждая
+        миграция выполняется под блокировкой записи (BEGIN IMMEDIATE), а
+        версия перечитывается уже внутри транзакции: миграцию, примененную
+        другим процессом, пока этот ждал блокировку, повторно не применяем.
+        """
+        migrations = [
+            self._migration_1_indexes,
+            self._migration_2_stats_rollup,
+            self._migration_3_typed_geometry,
+            self._migration_4_notification_outbox,
+            self._migration_5_notification_zones,
+            self._migration_6_shared_snapshots,
+            self._migration_7_change_feed,
+            self._migration_8_clients,
+            self._migration_9_outbox_clients,
+            self._migration_10_integer_geometry,
+        ]
+        conn = cursor.connection
+        conn.commit()
+        # Миграция большой таблицы в другом процессе может идти дольше
+        # обычного busy_timeout
+        cursor.execute(f"PRAGMA busy_timeout = {int(config.get('database.migration_timeout', 600) * 1000)}")
         try:
-            yield conn
+            for number, migration in enumerate(migrations, start=1):
+                if cursor.execute("PRAGMA user_version").fetchone()[0] >= number:
+                    continue
+                # Каждая миграция вместе с номером версии применяется атомарно
+                cursor.execute("BEGIN IMMEDIATE")
+                if cursor.execute("PRAGMA user_version").fetchone()[0] >= number:
+                    conn.rollback()
+                    continue
+                logger.info(f"Применение миграции схемы БД №{number}: {migration.__doc__}")
+                try:
+                    migration(cursor)
+                    cursor.execute(f"PRAGMA user_version = {number}")
+                except Exception:
+                    conn.rollback()
+                    raise
+                conn.commit()
         finally:
-            conn.close()
+            cursor.execute(f"PRAGMA busy_timeout = {int(self.pool.busy_timeout)}")
+    
+    def _migration_1_indexes(self, cursor):
+        """Индексы для фильтрации и сортировки журнала нарушений"""
+        # Порядок (timestamp DESC, id DESC) совпадает с сортировкой выборок,
+        # поэтому страницы читаются по индексу без отдельной сортировки
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_violations_timestamp
+            ON violations (timestamp DESC, id DESC)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_violations_status_timestamp
+            ON violations (status, timestamp DESC, id DESC)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_violations_zone_timestamp
+            ON violations (zone_id, timestamp DESC, id DESC)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_operator_responses_violation
+            ON operator_responses (violation_id)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_system_events_timestamp
+            ON system_events (timestamp)
+        """)
+    
+    def _migration_2_stats_rollup(self, cursor):
+        """Почасовые агрегаты нарушений по зонам и статусам"""
+        # Агрегаты поддерживаются триггерами, поэтому обновляются в той же
+        # транзакции, что и вставка, смена статуса или удаление нарушения
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS violation_stats_hourly (
+                bucket TEXT NOT NULL,
+                zone_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (bucket, zone_id, status)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_violations_stats_insert
+            AFTER INSERT ON violations
+            BEGIN
+                INSERT INTO violation_stats_hourly (bucket, zone_id, status, count)
+                VALUES (substr(NEW.timestamp, 1, 13), NEW.zone_id, NEW.status, 1)
+                ON CONFLICT(bucket, zone_id, status) DO UPDATE SET count = count + 1;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_violations_stats_delete
+            AFTER DELETE ON violations
+            BEGIN
+                UPDATE violation_stats_hourly SET count = count - 1
+                WHERE bucket = substr(OLD.timestamp, 1, 13)
+                  AND zone_id = OLD.zone_id AND status = OLD.status;
+                DELETE FROM violation_stats_hourly
+                WHERE bucket = substr(OLD.timestamp, 1, 13)
+                  AND zone_id = OLD.zone_id AND status = OLD.status AND count <= 0;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_violations_stats_update
+            AFTER UPDATE OF timestamp, zone_id, status ON violations
+            WHEN OLD.timestamp IS NOT NEW.timestamp
+              OR OLD.zone_id IS NOT NEW.zone_id
+              OR OLD.status IS NOT NEW.status
+            BEGIN
+                UPDATE violation_stats_hourly SET count = count - 1
+                WHERE bucket = substr(OLD.timestamp, 1, 13)
+                  AND zone_id = OLD.zone_id AND status = OLD.status;
+                DELETE FROM violation_stats_hourly
+                WHERE bucket = substr(OLD.timestamp, 1, 13)
+                  AND zone_id = OLD.zone_id AND status = OLD.status AND count <= 0;
+                INSERT INTO violation_stats_hourly (bucket, zone_id, status, count)
+                VALUES (substr(NEW.timestamp, 1, 13), NEW.zone_id, NEW.status, 1)
+                ON CONFLICT(bucket, zone_id, status) DO UPDATE SET count = count + 1;
+            END
+        """)
+        # Заполнение агрегатов по уже накопленным нарушениям
+        cursor.execute("DELETE FROM violation_stats_hourly")
+        cursor.execute("""
+            INSERT INTO violation_stats_hourly (bucket, zone_id, status, count)
+            SELECT substr(timestamp, 1, 13), zone_id, status, COUNT(*)
+            FROM violations
+            GROUP BY substr(timestamp, 1, 13), zone_id, status
+        """)
+    
+    def _migration_3_typed_geometry(self, cursor):
+        """Целочисленные колонки bbox и center вместо JSON-строк"""
+        # SQLite не умеет менять тип колонки, поэтому таблица пересоздается
+        cursor.execute("""
+            CREATE TABLE violations_new (
+                id TEXT PRIMARY KEY,
+                zone_id TEXT NOT NULL,
+                zone_name TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                image_path TEXT NOT NULL,
+                bbox_x1 INTEGER NOT NULL,
+                bbox_y1 INTEGER NOT NULL,
+                bbox_x2 INTEGER NOT NULL,
+                bbox_y2 INTEGER NOT NULL,
+                center_x INTEGER NOT NULL,
+                center_y INTEGER NOT NULL,
+                detection_confidence REAL NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                operator_response INTEGER,
+                operator_id TEXT,
+                response_time TEXT
+            )
+        """)
+        # Старые записи могли хранить координаты дробными числами; INTEGER-колонка
+        # SQLite оставила бы их REAL, поэтому они отбрасывают дробную часть, как int()
+        cursor.execute("""
+            INSERT INTO violations_new
+            SELECT id, zone_id, zone_name, timestamp, image_path,
+                   CAST(json_extract(detection_bbox, '$[0]') AS INTEGER),
+                   CAST(json_extract(detection_bbox, '$[1]') AS INTEGER),
+                   CAST(json_extract(detection_bbox, '$[2]') AS INTEGER),
+                   CAST(json_extract(detection_bbox, '$[3]') AS INTEGER),
+                   CAST(json_extract(detection_center, '$[0]') AS INTEGER),
+                   CAST(json_extract(detection_center, '$[1]') AS INTEGER),
+                   detection_confidence, status, operator_response, operator_id, response_time
+            FROM violations
+        """)
+        cursor.execute("DROP TABLE violations")
+        cursor.execute("ALTER TABLE violations_new RENAME TO violations")
+        # Индексы и триггеры агрегатов удалены вместе со старой таблицей
+        self._migration_1_indexes(cursor)
+        self._migration_2_stats_rollup(cursor)
+    
+    def _migration_4_notification_outbox(self, cursor):
+        """Очередь неподтвержденных уведомлений клиентов"""
+        # last_seq - последний номер, выданный клиенту; хранится отдельно от
+        # outbox, чтобы нумерация не начиналась заново после подтверждения всех уведомлений
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS notification_clients (
+                client_id TEXT PRIMARY KEY,
+                last_seq INTEGER NOT NULL DEFAULT 0,
+                acked_seq INTEGER NOT NULL DEFAULT 0,
+                last_seen TEXT NOT NULL
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS notification_outbox (
+                client_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                violation_id TEXT,
+                payload TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                PRIMARY KEY (client_id, seq)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_notification_outbox_created
+            ON notification_outbox(created_at)
+        """)
+    
+    def _migration_5_notification_zones(self, cursor):
+        """Подписки клиентов уведомлений на зоны"""
+        # JSON-список ID зон; NULL - все зоны
+        cursor.execute("ALTER TABLE notification_clients ADD COLUMN zones TEXT")
+    
+    def _migration_6_shared_snapshots(self, cursor):
+        """Область нарушения на общем снимке кадра"""
+        # Один снимок кадра используется всеми нарушениями этого кадра;
+        # crop_* - рамка человека в координатах снимка (NULL у старых записей)
+        for column in ("crop_x1", "crop_y1", "crop_x2", "crop_y2"):
+            cursor.execute(f"ALTER TABLE violations ADD COLUMN {column} INTEGER")
+        # Проверка, используется ли снимок другими нарушениями, перед удалением файла
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_violations_image_path
+            ON violations(image_path)
+        """)
+    
+    def _migration_7_change_feed(self, cursor):
+        """Номер изменения нарушений для синхронизации клиентов"""
+        # change_seq - номер последнего изменения строки из общего счетчика
+        # sync_state. Счетчик увеличивается триггерами в транзакции записи,
+        # а писатель один, поэтому зафиксированные номера видны читателям
+        # строго по возрастанию и без пропусков
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS sync_state (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            ) WITHOUT ROWID
+        """)
+        # Удаленные нарушения: клиент узнает о них из той же ленты изменений
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS violation_tombstones (
+                id TEXT PRIMARY KEY,
+                change_seq INTEGER NOT NULL,
+                deleted_at TEXT NOT NULL
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_violation_tombstones_change_seq
+            ON violation_tombstones(change_seq)
+        """)
+        cursor.execute("ALTER TABLE violations ADD COLUMN change_seq INTEGER NOT NULL DEFAULT 0")
+        # Уже накопленные нарушения нумеруются в порядке вставки
+        cursor.execute("UPDATE violations SET change_seq = rowid")
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_violations_change_seq
+            ON violations(change_seq)
+        """)
+        cursor.execute("""
+            INSERT OR REPLACE INTO sync_state (name, value)
+            SELECT 'change_seq', COALESCE(MAX(change_seq), 0) FROM violations
+        """)
+        # Граница очищенных записей об удалении: курсор старше нее требует полной синхронизации
+        cursor.execute("INSERT OR REPLACE INTO sync_state (name, value) VALUES ('tombstones_pruned', 0)")
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_violations_change_insert
+            AFTER INSERT ON violations
+            BEGIN
+                UPDATE sync_state SET value = value + 1 WHERE name = 'change_seq';
+                UPDATE violations SET change_seq = (SELECT value FROM sync_state WHERE name = 'change_seq')
+                WHERE rowid = NEW.rowid;
+                DELETE FROM violation_tombstones WHERE id = NEW.id;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_violations_change_update
+            AFTER UPDATE OF zone_id, zone_name, timestamp, image_path, status,
+                            operator_response, operator_id, response_time ON violations
+            BEGIN
+                UPDATE sync_state SET value = value + 1 WHERE name = 'change_seq';
+                UPDATE violations SET change_seq = (SELECT value FROM sync_state WHERE name = 'change_seq')
+                WHERE rowid = NEW.rowid;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_violations_change_delete
+            AFTER DELETE ON violations
+            BEGIN
+                UPDATE sync_state SET value = value + 1 WHERE name = 'change_seq';
+                INSERT OR REPLACE INTO violation_tombstones (id, change_seq, deleted_at)
+                VALUES (OLD.id, (SELECT value FROM sync_state WHERE name = 'change_seq'),
+                        strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime'));
+            END
+        """)
+    
+    def _migration_8_clients(self, cursor):
+        """Реестр зарегистрированных устройств"""
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS clients (
+                client_id TEXT PRIMARY KEY,
+                device_id TEXT NOT NULL,
+                device_name TEXT NOT NULL,
+                platform TEXT NOT NULL,
+                registered_at TEXT NOT NULL,
+                last_seen TEXT NOT NULL
+            )
+        """)
+        # Повторная регистрация устройства возвращает прежний client_id
+        cursor.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_clients_device_id
+            ON clients(device_id)
+        """)
+    
+    def _migration_9_outbox_clients(self, cursor):
+        """Outbox только для клиентов, подтверждающих уведомления"""
+        # uses_ack = 1 у клиентов, передававших since или ack; старые клиенты
+        # уведомления не подтверждают, и outbox для них только разрастался бы
+        cursor.execute("ALTER TABLE notification_clients ADD COLUMN uses_ack INTEGER NOT NULL DEFAULT 0")
+        cursor.execute("UPDATE notification_clients SET uses_ack = 1 WHERE acked_seq > 0")
+        cursor.execute("""
+            DELETE FROM notification_outbox WHERE client_id IN (
+                SELECT client_id FROM notification_clients WHERE uses_ack = 0
+            )
+        """)
+    
+    def _migration_10_integer_geometry(self, cursor):
+        """Целые координаты у записей, перенесенных миграцией №3 дробными"""
+        cursor.execute("""
+            UPDATE violations SET
+                bbox_x1 = CAST(bbox_x1 AS INTEGER), bbox_y1 = CAST(bbox_y1 AS INTEGER),
+                bbox_x2 = CAST(bbox_x2 AS INTEGER), bbox_y2 = CAST(bbox_y2 AS INTEGER),
+                center_x = CAST(center_x AS INTEGER), center_y = CAST(center_y AS INTEGER)
+            WHERE typeof(bbox_x1) = 'real' OR typeof(bbox_y1) = 'real'
+               OR typeof(bbox_x2) = 'real' OR typeof(bbox_y2) = 'real'
+               OR typeof(center_x) = 'real' OR typeof(center_y) = 'real'
+        """)
+    
+    @staticmethod
+    def _row_to_violation(row) -> Dict:
+        """Преобразование строки (колонки VIOLATION_COLUMNS) в словарь нарушения"""
+        operator_response = row[13]
+        return {
+            "id": row[0],
+            "zone_id": row[1],
+            "zone_name": row[2],
+            "timestamp": row[3],
+            "image_path": row[4],
+            "detection": {
+                "bbox": [row[5], row[6], row[7], row[8]],
+                "confidence": row[11],
+                "center": [row[9], row[10]],
+                "class_id": 0
+            },
+            "status": row[12],
+            "operator_response": bool(operator_response) if operator_response is not None else None,
+            "operator_id": row[14],
+            "response_time": row[15],
+            "crop": [row[16], row[17], row[18], row[19]] if row[16] is not None else None
+        }
+    
+    def _writer_loop(self):
+        """
+        Цикл потока записи: забирает операции из очереди и фиксирует их пачками
+        
+        Каждая операция выполняется внутри своей точки сохранения: ошибка
+        откатывает только ее (без частично примененных изменений), а остальные
+        операции пачки фиксируются.
+        """
+        stopping = False
+        while not stopping:
+            item = self._write_queue.get()
+            batch = [item]
+            deadline = time.monotonic() + self.write_max_latency
+            while len(batch) < self.write_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._write_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            operations = []
+            barriers = []
+            for op in batch:
+                if op is None:
+                    stopping = True
+                elif isinstance(op, threading.Event):
+                    barriers.append(op)
+                else:
+                    operations.append(op)
+            
+            if operations:
+                try:
+                    with self.pool.writer() as conn:
+                        cursor = conn.cursor()
+                        if not conn.in_transaction:
+                            cursor.execute("BEGIN")
+                        for op in operations:
+                            cursor.execute("SAVEPOINT write_op")
+                            try:
+                                op(cursor)
+                            except Exception as e:
+                                cursor.execute("ROLLBACK TO write_op")
+                                logger.error(f"Ошибка при выполнении отложенной записи: {e}", exc_info=True)
+                            cursor.execute("RELEASE write_op")
+                        conn.commit()
+                except Exception as e:
+                    logger.error(f"Ошибка при фиксации пачки записей ({len(operations)} шт.): {e}", exc_info=True)
+            
+            # Барьеры освобождаются только после фиксации всего, что было до них
+            for barrier in barriers:
+                barrier.set()
+    
+    def _enqueue_write(self, operation: Callable):
+        """Постановка операции записи в очередь (operation получает cursor)"""
+        self._write_queue.put(operation)
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Ожидание фиксации всех ранее поставленных в очередь записей
+        
+        Returns:
+            True если все записи зафиксированы, False при истечении таймаута
+        """
+        if not self._writer_thread.is_alive():
+            return True
+        barrier = threading.Event()
+        self._write_queue.put(barrier)
+        return barrier.wait(timeout)
     
     def log_violation(self, violation: Dict):
         """Логирование нарушения"""
-        with self.lock:
-            with self._get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    INSERT OR REPLACE INTO violations 
-                    (id, zone_id, zone_name, timestamp, image_path, 
-                     detection_bbox, detection_confidence, detection_center,
-                     status, operator_response, operator_id, response_time)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    violation['id'],
-                    violation['zone_id'],
-                    violation['zone_name'],
-                    violation['timestamp'],
-                    violation['image_path'],
-                    json.dumps(violation['detection']['bbox']),
-                    violation['detection']['confidence'],
-                    json.dumps(violation['detection']['center']),
-                    violation.get('status', 'pending'),
-                    violation.get('operator_response'),
-                    violation.get('operator_id'),
-                    violation.get('response_time')
-                ))
-                conn.commit()
+        bbox = violation['detection']['bbox']
+        center = violation['detection']['center']
+        crop = violation.get('crop') or (None, None, None, None)
+        params = (
+            violation['id'],
+            violation['zone_id'],
+            violation['zone_name'],
+            violation['timestamp'],
+            violation['image_path'],
+            int(bbox[0]), int(bbox[1]), int(bbox[2]), int(bbox[3]),
+            int(center[0]), int(center[1]),
+            violation['detection']['confidence'],
+            violation.get('status', 'pending'),
+            violation.get('operator_response'),
+            violation.get('operator_id'),
+            violation.get('response_time'),
+            crop[0], crop[1], crop[2], crop[3]
+        )
+        self._enqueue_write(lambda cursor: cursor.execute(f"""
+            INSERT INTO violations 
+            ({VIOLATION_COLUMNS})
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                zone_id = excluded.zone_id,
+                zone_name = excluded.zone_name,
+                timestamp = excluded.timestamp,
+                image_path = excluded.image_path,
+                bbox_x1 = excluded.bbox_x1,
+                bbox_y1 = excluded.bbox_y1,
+                bbox_x2 = excluded.bbox_x2,
+                bbox_y2 = excluded.bbox_y2,
+                center_x = excluded.center_x,
+                center_y = excluded.center_y,
+                detection_confidence = excluded.detection_confidence,
+                status = excluded.status,
+                operator_response = excluded.operator_response,
+                operator_id = excluded.operator_id,
+                response_time = excluded.response_time,
+                crop_x1 = excluded.crop_x1,
+                crop_y1 = excluded.crop_y1,
+                crop_x2 = excluded.crop_x2,
+                crop_y2 = excluded.crop_y2
+        """, params))
     
     def update_violation_status(self, violation_id: str, status: str, 
                                 operator_id: Optional[str] = None, 
                                 operator_response: Optional[bool] = None):
         """Обновление статуса нарушения"""
-        with self.lock:
-            with self._get_connection() as conn:
-                cursor = conn.cursor()
-                response_time = datetime.now().isoformat()
-                
+        response_time = datetime.now().isoformat()
+        
+        def operation(cursor):
+            cursor.execute("""
+                UPDATE violations 
+                SET status = ?, operator_id = ?, operator_response = ?, response_time = ?
+                WHERE id = ?
+            """, (status, operator_id, operator_response, response_time, violation_id))
+            
+            # Логируем ответ оператора (если нарушение еще не удалено или заархивировано)
+            if operator_id and operator_response is not None and cursor.rowcount:
                 cursor.execute("""
-                    UPDATE violations 
-                    SET status = ?, operator_id = ?, operator_response = ?, response_time = ?
-                    WHERE id = ?
-                """, (status, operator_id, operator_response, response_time, violation_id))
-                
-                # Логируем ответ оператора
-                if operator_id and operator_response is not None:
-                    cursor.execute("""
-                        INSERT INTO operator_responses 
-                        (violation_id, operator_id, response, timestamp)
-                        VALUES (?, ?, ?, ?)
-                    """, (violation_id, operator_id, 1 if operator_response else 0, response_time))
-                
-                conn.commit()
+                    INSERT INTO operator_responses 
+                    (violation_id, operator_id, response, timestamp)
+                    VALUES (?, ?, ?, ?)
+                """, (violation_id, operator_id, 1 if operator_response else 0, response_time))
+        
+        self._enqueue_write(operation)
     
     def get_violation_by_id(self, violation_id: str) -> Optional[Dict]:
         """Получение нарушения по ID из базы данных"""
-        with self._get_connection() as conn:
+        with self.pool.reader() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM violations WHERE id = ?", (violation_id,))
+            cursor.execute(f"SELECT {VIOLATION_COLUMNS} FROM violations WHERE id = ?", (violation_id,))
             row = cursor.fetchone()
             if row is None:
                 return None
-            
-            # Преобразуем строку в словарь
-            return {
-                "id": row["id"],
-                "zone_id": row["zone_id"],
-                "zone_name": row["zone_name"],
-                "timestamp": row["timestamp"],
-                "image_path": row["image_path"],
-                "detection": {
-                    "bbox": json.loads(row["detection_bbox"]),
-                    "confidence": row["detection_confidence"],
-                    "center": json.loads(row["detection_center"]),
-                    "class_id": 0
-                },
-                "status": row["status"],
-                "operator_response": bool(row["operator_response"]) if row["operator_response"] is not None else None,
-                "operator_id": row["operator_id"],
-                "response_time": row["response_time"]
-            }
+            return self._row_to_violation(row)
     
     def delete_violation(self, violation_id: str) -> bool:
         """Удаление нарушения из базы данных"""
-        with self.lock:
-            with self._get_connection() as conn:
-                cursor = conn.cursor()
-                # Проверяем, существует ли нарушение
-                cursor.execute("SELECT id FROM violations WHERE id = ?", (violation_id,))
-                if cursor.fetchone() is None:
-                    return False
-                
-                # Удаляем нарушение
-                cursor.execute("DELETE FROM violations WHERE id = ?", (violation_id,))
-                # Удаляем связанные ответы операторов
-                cursor.execute("DELETE FROM operator_responses WHERE violation_id = ?", (violation_id,))
-                conn.commit()
-                return True
+        # Удаление должно видеть все ранее поставленные в очередь записи
+        self.flush()
+        with self.pool.writer() as conn:
+            cursor = conn.cursor()
+            # Проверяем, существует ли нарушение
+            cursor.execute("SELECT id FROM violations WHERE id = ?", (violation_id,))
+            if cursor.fetchone() is None:
+                return False
+            
+            # Удаляем нарушение
+            cursor.execute("DELETE FROM violations WHERE id = ?", (violation_id,))
+            # Удаляем связанные ответы операторов
+            cursor.execute("DELETE FROM operator_responses WHERE violation_id = ?", (violation_id,))
+            conn.commit()
+            return True
+    
+    def is_image_referenced(self, image_path: str) -> bool:
+        """Используется ли файл снимка хотя бы одним нарушением"""
+        self.flush()
+        with self.pool.reader() as conn:
+            row = conn.execute("SELECT 1 FROM violations WHERE image_path = ? LIMIT 1", (image_path,)).fetchone()
+        return row is not None
+    
+    def get_expired_violations(self, status: str, before: str, limit: int) -> List[Dict]:
+        """Самые старые нарушения со статусом status, зарегистрированные раньше before"""
+        with self.pool.reader() as conn:
+            rows = conn.execute(f"""
+                SELECT {VIOLATION_COLUMNS} FROM violations
+                WHERE status = ? AND timestamp < ?
+                ORDER BY timestamp, id
+                LIMIT ?
+            """, (status, before, limit)).fetchall()
+        return [self._row_to_violation(row) for row in rows]
+    
+    def get_operator_responses(self, violation_ids: List[str]) -> List[Dict]:
+        """Ответы операторов на указанные нарушения"""
+        if not violation_ids:
+            return []
+        placeholders = ",".join("?" * len(violation_ids))
+        with self.pool.reader() as conn:
+            rows = conn.execute(f"""
+                SELECT id, violation_id, operator_id, response, timestamp
+                FROM operator_responses WHERE violation_id IN ({placeholders})
+            """, violation_ids).fetchall()
+        return [dict(row) for row in rows]
+    
+    def delete_violations(self, violation_ids: List[str]) -> int:
+        """Удаление пачки нарушений с ответами операторов одной короткой транзакцией"""
+        if not violation_ids:
+            return 0
+        placeholders = ",".join("?" * len(violation_ids))
+        with self.pool.writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"DELETE FROM operator_responses WHERE violation_id IN ({placeholders})", violation_ids)
+            cursor.execute(f"DELETE FROM violations WHERE id IN ({placeholders})", violation_ids)
+            deleted = cursor.rowcount
+            conn.commit()
+            return deleted
+    
+    def get_expired_system_events(self, before: str, limit: int) -> List[Dict]:
+        """Самые старые системные события, записанные раньше before"""
+        with self.pool.reader() as conn:
+            rows = conn.execute("""
+                SELECT id, event_type, message, timestamp, metadata FROM system_events
+                WHERE timestamp < ?
+                ORDER BY timestamp, id
+                LIMIT ?
+            """, (before, limit)).fetchall()
+        return [dict(row) for row in rows]
+    
+    def delete_system_events(self, event_ids: List[int]) -> int:
+        """Удаление пачки системных событий"""
+        if not event_ids:
+            return 0
+        placeholders = ",".join("?" * len(event_ids))
+        with self.pool.writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"DELETE FROM system_events WHERE id IN ({placeholders})", event_ids)
+            deleted = cursor.rowcount
+            conn.commit()
+            return deleted
+    
+    def compact(self, max_pages: int = 1000) -> int:
+        """
+        Возврат свободных страниц файла БД (incremental vacuum)
+        
+        Базе, созданной без auto_vacuum=INCREMENTAL, нужен однократный полный
+        VACUUM (enable_incremental_vacuum); до этого страницы не возвращаются.
+        
+        Returns:
+            Количество освобожденных страниц
+        """
+        with self.pool.writer() as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                if not self._vacuum_warned:
+                    self._vacuum_warned = True
+                    logger.warning("База данных создана без auto_vacuum=INCREMENTAL, освобожденное место "
+                                   "не возвращается; остановите сервер и выполните python main.py --vacuum")
+                return 0
+            
+            free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            conn.execute(f"PRAGMA incremental_vacuum({int(max_pages)})").fetchall()
+            conn.commit()
+            free_after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            return free_before - free_after
+    
+    def enable_incremental_vacuum(self):
+        """
+        Перевод существующей базы в режим auto_vacuum=INCREMENTAL
+        
+        Выполняет полный VACUUM: файл БД переписывается целиком, и все это
+        время запись заблокирована. Поэтому вызывается только вручную при
+        остановленном сервере (python main.py --vacuum), а не из фоновой очистки.
+        """
+        self.flush()
+        with self.pool.writer() as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                logger.info("Режим auto_vacuum=INCREMENTAL уже включен")
+                return
+            logger.info("Включение auto_vacuum=INCREMENTAL (полный VACUUM)")
+            conn.commit()
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            logger.info("Режим auto_vacuum=INCREMENTAL включен")
     
     def log_system_event(self, event_type: str, message: str, metadata: Optional[Dict] = None):
         """Логирование системного события"""
-        with self.lock:
-            with self._get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    INSERT INTO system_events (event_type, message, timestamp, metadata)
-                    VALUES (?, ?, ?, ?)
-                """, (
-                    event_type,
-                    message,
-                    datetime.now().isoformat(),
-                    json.dumps(metadata) if metadata else None
-                ))
-                conn.commit()
+        params = (
+            event_type,
+            message,
+            datetime.now().isoformat(),
+            json.dumps(metadata) if metadata else None
+        )
+        self._enqueue_write(lambda cursor: cursor.execute("""
+            INSERT INTO system_events (event_type, message, timestamp, metadata)
+            VALUES (?, ?, ?, ?)
+        """, params))
+    
+    def get_notification_clients(self) -> Dict[str, Dict]:
+        """
+        Известные клиенты уведомлений
+        
+        Returns:
+            client_id -> {"last_seq": последний выданный номер,
+                          "zones": список ID зон подписки или None (все зоны),
+                          "uses_ack": подтверждает ли клиент уведомления}
+        """
+        self.flush()
+        with self.pool.reader() as conn:
+            rows = conn.execute("SELECT client_id, last_seq, zones, uses_ack FROM notification_clients").fetchall()
+        return {
+            row[0]: {"last_seq": row[1], "zones": json.loads(row[2]) if row[2] is not None else None,
+                     "uses_ack": bool(row[3])}
+            for row in rows
+        }
+    
+    def register_notification_client(self, client_id: str):
+        """Учет клиента, для которого сохраняются неподтвержденные уведомления"""
+        last_seen = datetime.now().isoformat()
+        self._enqueue_write(lambda cursor: cursor.execute("""
+            INSERT INTO notification_clients (client_id, last_seen) VALUES (?, ?)
+            ON CONFLICT(client_id) DO UPDATE SET last_seen = excluded.last_seen
+        """, (client_id, last_seen)))
+    
+    def set_notification_client_uses_ack(self, client_id: str):
+        """Отметка клиента, который подтверждает уведомления (для него ведется outbox)"""
+        self._enqueue_write(lambda cursor: cursor.execute(
+            "UPDATE notification_clients SET uses_ack = 1 WHERE client_id = ?", (client_id,)
+        ))
+    
+    def set_notification_zones(self, client_id: str, zones: Optional[List[str]]):
+        """Сохранение подписки клиента на зоны (None - все зоны)"""
+        value = json.dumps(zones) if zones is not None else None
+        self._enqueue_write(lambda cursor: cursor.execute(
+            "UPDATE notification_clients SET zones = ? WHERE client_id = ?", (value, client_id)
+        ))
+    
+    def register_client(self, client_id: str, device_id: str, device_name: str, platform: str) -> Dict:
+        """
+        Регистрация устройства
+        
+        Если устройство с таким device_id уже зарегистрировано, обновляются
+        его название, платформа и last_seen, а client_id остается прежним.
+        
+        Returns:
+            Запись устройства (поля CLIENT_COLUMNS)
+        """
+        now = datetime.now().isoformat()
+        with self.pool.writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO clients (client_id, device_id, device_name, platform, registered_at, last_seen)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(device_id) DO UPDATE SET
+                    device_name = excluded.device_name,
+                    platform = excluded.platform,
+                    last_seen = excluded.last_seen
+            """, (client_id, device_id, device_name, platform, now, now))
+            row = cursor.execute(
+                f"SELECT {', '.join(CLIENT_COLUMNS)} FROM clients WHERE device_id = ?", (device_id,)
+            ).fetchone()
+            conn.commit()
+        return dict(zip(CLIENT_COLUMNS, row))
+    
+    def unregister_client(self, client_id: str) -> bool:
+        """Удаление устройства из реестра"""
+        with self.pool.writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM clients WHERE client_id = ?", (client_id,))
+            deleted = cursor.rowcount > 0
+            conn.commit()
+            return deleted
+    
+    def get_client(self, client_id: str) -> Optional[Dict]:
+        """Зарегистрированное устройство по client_id"""
+        with self.pool.reader() as conn:
+            row = conn.execute(
+                f"SELECT {', '.join(CLIENT_COLUMNS)} FROM clients WHERE client_id = ?", (client_id,)
+            ).fetchone()
+        return dict(zip(CLIENT_COLUMNS, row)) if row is not None else None
+    
+    def get_clients(self) -> List[Dict]:
+        """Все зарегистрированные устройства в порядке регистрации"""
+        with self.pool.reader() as conn:
+            rows = conn.execute(
+                f"SELECT {', '.join(CLIENT_COLUMNS)} FROM clients ORDER BY registered_at"
+            ).fetchall()
+        return [dict(zip(CLIENT_COLUMNS, row)) for row in rows]
+    
+    def update_clients_last_seen(self, last_seen: Dict[str, str]):
+        """Запись времени последней активности устройств одной пачкой (client_id -> время)"""
+        if not last_seen:
+            return
+        rows = [(seen, client_id) for client_id, seen in last_seen.items()]
+        self._enqueue_write(lambda cursor: cursor.executemany(
+            "UPDATE clients SET last_seen = MAX(last_seen, ?) WHERE client_id = ?", rows
+        ))
+    
+    def add_to_outbox(self, sequences: Dict[str, int], violation_id: Optional[str], payload: str,
+                      outbox_clients: Optional[Set[str]] = None):
+        """
+        Сохранение уведомления в outbox клиентов
+        
+        Args:
+            sequences: Номер уведомления для каждого клиента (client_id -> seq)
+            violation_id: ID нарушения, о котором уведомление
+            payload: Уведомление в JSON (без номера)
+            outbox_clients: Клиенты, для которых уведомление сохраняется до
+                подтверждения (по умолчанию все); у остальных только
+                запоминается выданный номер
+        """
+        if not sequences:
+            return
+        created_at = datetime.now().isoformat()
+        rows = [(client_id, seq, violation_id, payload, created_at) for client_id, seq in sequences.items()
+                if outbox_clients is None or client_id in outbox_clients]
+        
+        def operation(cursor):
+            cursor.executemany("""
+                INSERT OR REPLACE INTO notification_outbox (client_id, seq, violation_id, payload, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, rows)
+            cursor.executemany("""
+                UPDATE notification_clients SET last_seq = MAX(last_seq, ?) WHERE client_id = ?
+            """, [(seq, client_id) for client_id, seq in sequences.items()])
+        
+        self._enqueue_write(operation)
+    
+    def ack_notifications(self, client_id: str, seq: int):
+        """Подтверждение клиентом всех уведомлений с номером до seq включительно"""
+        def operation(cursor):
+            cursor.execute("DELETE FROM notification_outbox WHERE client_id = ? AND seq <= ?", (client_id, seq))
+            cursor.execute("""
+                UPDATE notification_clients SET acked_seq = MAX(acked_seq, ?) WHERE client_id = ?
+            """, (seq, client_id))
+        
+        self._enqueue_write(operation)
+    
+    def get_outbox(self, client_id: str, after_seq: int, upto_seq: Optional[int] = None,
+                   limit: Optional[int] = None) -> List[Tuple[int, str]]:
+        """
+        Неподтвержденные уведомления клиента с номером больше after_seq
+        
+        Returns:
+            Список пар (seq, payload) по возрастанию номера
+        """
+        self.flush()
+        query = "SELECT seq, payload FROM notification_outbox WHERE client_id = ? AND seq > ?"
+        params: list = [client_id, after_seq]
+        if upto_seq is not None:
+            query += " AND seq <= ?"
+            params.append(upto_seq)
+        query += " ORDER BY seq"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self.pool.reader() as conn:
+            return [(row[0], row[1]) for row in conn.execute(query, params).fetchall()]
+    
+    def prune_outbox(self, before: str) -> int:
+        """Удаление уведомлений, так и не подтвержденных до before"""
+        self.flush()
+        with self.pool.writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM notification_outbox WHERE created_at < ?", (before,))
+            deleted = cursor.rowcount
+            conn.commit()
+            return deleted
+    
+    @staticmethod
+    def parse_cursor(after: str) -> Tuple[str, str]:
+        """
+        Разбор курсора пагинации вида "<timestamp>,<id>"
+        
+        Raises:
+            ValueError: если курсор имеет неверный формат
+        """
+        timestamp, sep, violation_id = after.partition(',')
+        if not sep or not timestamp or not violation_id:
+            raise ValueError(f"Неверный формат курсора: {after!r}, ожидается <timestamp>,<id>")
+        return timestamp, violation_id
+    
+    @staticmethod
+    def make_cursor(violation: Dict) -> str:
+        """Курсор, указывающий на позицию сразу после данного нарушения"""
+        return f"{violation['timestamp']},{violation['id']}"
+    
+    @staticmethod
+    def make_change_cursor(change_seq: int) -> str:
+        """Непрозрачный для клиента курсор ленты изменений"""
+        return base64.urlsafe_b64encode(f"c{change_seq}".encode()).decode().rstrip("=")
+    
+    @staticmethod
+    def parse_change_cursor(cursor: str) -> int:
+        """
+        Номер изменения из курсора ленты изменений
+        
+        Raises:
+            ValueError: если курсор имеет неверный формат
+        """
+        try:
+            decoded = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+            if not decoded.startswith("c"):
+                raise ValueError
+            change_seq = int(decoded[1:])
+        except (ValueError, UnicodeDecodeError):
+            raise ValueError(f"Неверный курсор ленты изменений: {cursor!r}")
+        if change_seq < 0:
+            raise ValueError(f"Неверный курсор ленты изменений: {cursor!r}")
+        return change_seq
+    
+    def get_changes(self, since: int, limit: int = 100) -> Dict:
+        """
+        Нарушения, созданные, измененные или удаленные после изменения since
+        
+        Обе выборки идут по индексам change_seq, поэтому стоимость запроса
+        пропорциональна числу изменений, а не размеру журнала.
+        
+        Returns:
+            Словарь с ключами violations, deleted (ID удаленных), change_seq
+            (номер последнего возвращенного изменения), has_more и reset
+            (True, если нужные записи об удалении уже очищены и клиенту
+            следует синхронизироваться заново с нулевого курсора)
+        """
+        with self.pool.reader() as conn:
+            pruned = conn.execute(
+                "SELECT value FROM sync_state WHERE name = 'tombstones_pruned'"
+            ).fetchone()
+            if since > 0 and pruned is not None and since < pruned[0]:
+                return {"violations": [], "deleted": [], "change_seq": 0, "has_more": False, "reset": True}
+            
+            rows = conn.execute(f"""
+                SELECT {VIOLATION_COLUMNS}, change_seq FROM violations
+                WHERE change_seq > ? ORDER BY change_seq LIMIT ?
+            """, (since, limit + 1)).fetchall()
+            tombstones = conn.execute("""
+                SELECT id, change_seq FROM violation_tombstones
+                WHERE change_seq > ? ORDER BY change_seq LIMIT ?
+            """, (since, limit + 1)).fetchall()
+        
+        # Слияние двух упорядоченных выборок по номеру изменения
+        changes = sorted(
+            [(row[20], row) for row in rows] + [(row[1], row[0]) for row in tombstones],
+            key=lambda item: item[0]
+        )
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+        
+        violations = []
+        deleted = []
+        for change_seq, item in changes:
+            if isinstance(item, str):
+                deleted.append(item)
+            else:
+                violation = self._row_to_violation(item)
+                violation["change_seq"] = change_seq
+                violations.append(violation)
+        return {
+            "violations": violations,
+            "deleted": deleted,
+            "change_seq": changes[-1][0] if changes else since,
+            "has_more": has_more,
+            "reset": False
+        }
+    
+    def prune_tombstones(self, before: str) -> int:
+        """Удаление записей об удаленных нарушениях старше before"""
+        with self.pool.writer() as conn:
+            cursor = conn.cursor()
+            row = cursor.execute(
+                "SELECT MAX(change_seq) FROM violation_tombstones WHERE deleted_at < ?", (before,)
+            ).fetchone()
+            if row[0] is None:
+                return 0
+            cursor.execute("DELETE FROM violation_tombstones WHERE change_seq <= ?", (row[0],))
+            deleted = cursor.rowcount
+            cursor.execute(
+                "UPDATE sync_state SET value = MAX(value, ?) WHERE name = 'tombstones_pruned'", (row[0],)
+            )
+            conn.commit()
+            return deleted
+    
+    def _build_filters(self, status: Optional[str] = None,
+                       zone_id: Optional[str] = None,
+                       start_date: Optional[str] = None,
+                       end_date: Optional[str] = None,
+                       region: Optional[Tuple[int, int, int, int]] = None) -> Tuple[str, list]:
+        """
+        Построение условия WHERE для выборок нарушений
+        
+        region (x1, y1, x2, y2) отбирает нарушения, центр детекции которых
+        попадает в прямоугольник на кадре.
+        """
+        query = " WHERE 1=1"
+        params = []
+        
+        if status:
+            query += " AND status = ?"
+            params.append(status)
+        
+        if zone_id:
+            query += " AND zone_id = ?"
+            params.append(zone_id)
+        
+        if start_date:
+            query += " AND timestamp >= ?"
+            params.append(start_date)
+        
+        if end_date:
+            query += " AND timestamp <= ?"
+            params.append(end_date)
+        
+        if region:
+            x1, y1, x2, y2 = region
+            query += " AND center_x BETWEEN ? AND ? AND center_y BETWEEN ? AND ?"
+            params.extend([min(x1, x2), max(x1, x2), min(y1, y2), max(y1, y2)])
+        
+        return query, params
     
     def get_violations(self, status: Optional[str] = None, 
                       zone_id: Optional[str] = None,
                       start_date: Optional[str] = None,
                       end_date: Optional[str] = None,
                       limit: int = 100,
-                      offset: int = 0) -> List[Dict]:
-        """Получение нарушений с фильтрацией"""
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            
-            query = "SELECT * FROM violations WHERE 1=1"
-            params = []
-            
-            if status:
-                query += " AND status = ?"
-                params.append(status)
-            
-            if zone_id:
-                query += " AND zone_id = ?"
-                params.append(zone_id)
-            
-            if start_date:
-                query += " AND timestamp >= ?"
-                params.append(start_date)
-            
-            if end_date:
-                query += " AND timestamp <= ?"
-                params.append(end_date)
-            
-            query += " ORDER BY timestamp DESC LIMIT ? OFFSET ?"
-            params.extend([limit, offset])
-            
-            cursor.execute(query, params)
-            rows = cursor.fetchall()
-            
-            violations = []
-            for row in rows:
-                violation = dict(row)
-                violation['detection'] = {
-                    'bbox': json.loads(violation['detection_bbox']),
-                    'confidence': violation['detection_confidence'],
-                    'center': json.loads(violation['detection_center'])
-                }
-                del violation['detection_bbox']
-                del violation['detection_confidence']
-                del violation['detection_center']
-                violations.append(violation)
-            
-            return violations
+                      offset: int = 0,
+                      after: Optional[str] = None,
+                      region: Optional[Tuple[int, int, int, int]] = None) -> List[Dict]:
+        """
+        Получение нарушений с фильтрацией
+        
+        Если задан курсор after ("<timestamp>,<id>" последней записи предыдущей
+        страницы), используется keyset-пагинация и offset игнорируется:
+        стоимость любой страницы не зависит от ее номера.
+        """
+        where, params = self._build_filters(status, zone_id, start_date, end_date, region)
+        
+        if after:
+            where += " AND (timestamp, id) < (?, ?)"
+            params.extend(self.parse_cursor(after))
+            offset = 0
+        
+        query = f"SELECT {VIOLATION_COLUMNS} FROM violations{where} ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?"
+        params.extend([limit, offset])
+        
+        with self.pool.reader() as conn:
+            rows = conn.execute(query, params).fetchall()
+        
+        row_to_violation = self._row_to_violation
+        return [row_to_violation(row) for row in rows]
     
     def get_violations_count(self, status: Optional[str] = None,
                             zone_id: Optional[str] = None,
                             start_date: Optional[str] = None,
-                            end_date: Optional[str] = None) -> int:
+                            end_date: Optional[str] = None,
+                            region: Optional[Tuple[int, int, int, int]] = None) -> int:
         """Получение количества нарушений"""
-        with self._get_connection() as conn:
+        where, params = self._build_filters(status, zone_id, start_date, end_date, region)
+        
+        with self.pool.reader() as conn:
             cursor = conn.cursor()
-            
-            query = "SELECT COUNT(*) as count FROM violations WHERE 1=1"
-            params = []
-            
-            if status:
-                query += " AND status = ?"
-                params.append(status)
-            
-            if zone_id:
-                query += " AND zone_id = ?"
-                params.append(zone_id)
-            
-            if start_date:
-                query += " AND timestamp >= ?"
-                params.append(start_date)
-            
-            if end_date:
-                query += " AND timestamp <= ?"
-                params.append(end_date)
-            
-            cursor.execute(query, params)
+            cursor.execute(f"SELECT COUNT(*) as count FROM violations{where}", params)
             result = cursor.fetchone()
             return result['count'] if result else 0
     
+    def _get_stats_rows(self, cursor, start_date: Optional[str] = None,
+                        end_date: Optional[str] = None) -> List[Tuple[str, str, str, int]]:
+        """
+        Счетчики (час, зона, статус, количество) за период
+        
+        Часы, целиком попадающие в период, берутся из агрегатов
+        violation_stats_hourly. Для не более чем двух часов на границах
+        периода нарушения считаются по индексу timestamp.
+        """
+        rollup_query = "SELECT bucket, zone_id, status, count FROM violation_stats_hourly WHERE 1=1"
+        rollup_params = []
+        partial_buckets = []
+        
+        if start_date:
+            # Час целиком в периоде, если его префикс не меньше начала периода
+            rollup_query += " AND bucket >= ?"
+            rollup_params.append(start_date)
+            if start_date[:13] < start_date:
+                partial_buckets.append(start_date[:13])
+        
+        if end_date:
+            rollup_query += " AND bucket < ?"
+            rollup_params.append(end_date[:13])
+            if len(end_date) >= 13 and end_date[:13] not in partial_buckets:
+                partial_buckets.append(end_date[:13])
+        
+        cursor.execute(rollup_query, rollup_params)
+        rows = [tuple(row) for row in cursor.fetchall()]
+        
+        date_filter, date_params = self._build_filters(start_date=start_date, end_date=end_date)
+        for bucket in partial_buckets:
+            # '~' больше любого символа ISO-даты, поэтому диапазон покрывает весь час
+            cursor.execute(f"""
+                SELECT substr(timestamp, 1, 13) AS bucket, zone_id, status, COUNT(*) AS count
+                FROM violations{date_filter} AND timestamp >= ? AND timestamp < ?
+                GROUP BY zone_id, status
+            """, date_params + [bucket, bucket + '~'])
+            rows.extend(tuple(row) for row in cursor.fetchall())
+        
+        return rows
+    
     def get_statistics(self, start_date: Optional[str] = None,
-                      end_date: Optional[str] = None) -> Dict:
-        """Получение статистики по нарушениям"""
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            
-            date_filter = ""
-            params = []
-            if start_date:
-                date_filter += " AND timestamp >= ?"
-                params.append(start_date)
-            if end_date:
-                date_filter += " AND timestamp <= ?"
-                params.append(end_date)
-            
-            # Общее количество
-            cursor.execute(f"SELECT COUNT(*) as count FROM violations WHERE 1=1 {date_filter}", params)
-            total = cursor.fetchone()['count']
-            
-            # Подтвержденные
-            cursor.execute(f"SELECT COUNT(*) as count FROM violations WHERE status = 'confirmed' {date_filter}", params)
-            confirmed = cursor.fetchone()['count']
-            
-            # Ложные срабатывания
-            cursor.execute(f"SELECT COUNT(*) as count FROM violations WHERE status = 'false_positive' {date_filter}", params)
-            false_positive = cursor.fetchone()['count']
-            
-            # Ожидающие ответа
-            cursor.execute(f"SELECT COUNT(*) as count FROM violations WHERE status = 'pending' {date_filter}", params)
-            pending = cursor.fetchone()['count']
+                      end_date: Optional[str] = None,
+                      group_by: Optional[str] = None) -> Dict:
+        """
+        Получение статистики по нарушениям
+        
+        Args:
+            start_date: Начало периода (ISO format)
+            end_date: Конец периода (ISO format)
+            group_by: Дополнительная разбивка: "zone", "hour" или "day"
+        """
+        with self.pool.reader() as conn:
+            rows = self._get_stats_rows(conn.cursor(), start_date, end_date)
+        
+        def empty_counts() -> Dict[str, int]:
+            return {"total": 0, "confirmed": 0, "false_positive": 0, "pending": 0, "unanswered": 0}
+        
+        stats = empty_counts()
+        groups: Dict[str, Dict[str, int]] = {}
+        
+        for bucket, zone_id, status, count in rows:
+            stats["total"] += count
+            stats[status] = stats.get(status, 0) + count
             
-            return {
-                "total": total,
-                "confirmed": confirmed,
-                "false_positive": false_positive,
-                "pending": pending
-            }
+            if group_by:
+                if group_by == "zone":
+                    key = zone_id
+                elif group_by == "day":
+                    key = bucket[:10]
+                else:
+                    key = bucket
+                group = groups.setdefault(key, empty_counts())
+                group["total"] += count
+                group[status] = group.get(status, 0) + count
+        
+        if group_by == "zone":
+            stats["by_zone"] = groups
+        elif group_by in ("hour", "day"):
+            stats[f"by_{group_by}"] = [
+                {"bucket": key, **groups[key]} for key in sorted(groups)
+            ]
+        
+        return stats
+    
+    def iter_violations(self, start_date: Optional[str] = None,
+                        end_date: Optional[str] = None,
+                        chunk_size: int = 1000) -> Iterator[List[Dict]]:
+        """
+        Постраничный обход всех нарушений за период (для экспорта)
+        
+        Страницы читаются keyset-пагинацией, каждая в отдельной короткой
+        транзакции: соединение из пула не удерживается, пока клиент
+        медленно скачивает экспорт, а память не зависит от объема журнала.
+        """
+        after = None
+        while True:
+            chunk = self.get_violations(start_date=start_date, end_date=end_date,
+                                        limit=chunk_size, after=after)
+            if not chunk:
+                return
+            yield chunk
+            if len(chunk) < chunk_size:
+                return
+            after = self.make_cursor(chunk[-1])
     
     def export_violations_csv(self, start_date: Optional[str] = None,
-                             end_date: Optional[str] = None) -> str:
-        """Экспорт нарушений в CSV"""
+                             end_date: Optional[str] = None) -> Iterator[str]:
+        """Потоковый экспорт нарушений в CSV"""
         import csv
         import io
         
-        violations = self.get_violations(start_date=start_date, end_date=end_date, limit=10000)
-        
         output = io.StringIO()
         writer = csv.writer(output)
         
@@ -329,28 +1226,60 @@ class LoggingService:
         ])
         
         # Данные
-        for v in violations:
-            bbox = v['detection']['bbox']
-            writer.writerow([
-                v['id'],
-                v['zone_id'],
-                v['zone_name'],
-                v['timestamp'],
-                v['status'],
-                v.get('operator_response'),
-                v.get('operator_id'),
-                v.get('response_time'),
-                v['detection']['confidence'],
-                bbox[0], bbox[1], bbox[2], bbox[3]
-            ])
-        
-        return output.getvalue()
+        for chunk in self.iter_violations(start_date=start_date, end_date=end_date):
+            for v in chunk:
+                bbox = v['detection']['bbox']
+                writer.writerow([
+                    v['id'],
+                    v['zone_id'],
+                    v['zone_name'],
+                    v['timestamp'],
+                    v['status'],
+                    v.get('operator_response'),
+                    v.get('operator_id'),
+                    v.get('response_time'),
+                    v['detection']['confidence'],
+                    bbox[0], bbox[1], bbox[2], bbox[3]
+                ])
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate(0)
+        
+        if output.tell():
+            yield output.getvalue()
     
     def export_violations_json(self, start_date: Optional[str] = None,
-                              end_date: Optional[str] = None) -> str:
-        """Экспорт нарушений в JSON"""
-        violations = self.get_violations(start_date=start_date, end_date=end_date, limit=10000)
-        return json.dumps(violations, ensure_ascii=False, indent=2)
+                              end_date: Optional[str] = None) -> Iterator[str]:
+        """
+        Потоковый экспорт нарушений в JSON (массив объектов)
+        
+        Вывод совпадает с json.dumps(список, indent=2): каждый объект
+        сериализуется с отступом и сдвигается на уровень массива.
+        """
+        first = True
+        for chunk in self.iter_violations(start_date=start_date, end_date=end_date):
+            parts = []
+            for v in chunk:
+                item = json.dumps(v, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+                parts.append(("[\n  " if first else ",\n  ") + item)
+                first = False
+            yield "".join(parts)
+        yield "[]" if first else "\n]"
+    
+    def export_violations_ndjson(self, start_date: Optional[str] = None,
+                                end_date: Optional[str] = None) -> Iterator[str]:
+        """Потоковый экспорт нарушений в NDJSON (один JSON-объект на строку)"""
+        for chunk in self.iter_violations(start_date=start_date, end_date=end_date):
+            yield "".join(json.dumps(v, ensure_ascii=False) + "\n" for v in chunk)
+    
+    def close(self):
+        """Фиксация отложенных записей и закрытие соединений с базой данных"""
+        if self._writer_thread.is_alive():
+            self._write_queue.put(None)
+            self._writer_thread.join(timeout=5.0)
+            if self._writer_thread.is_alive():
+                logger.warning("Поток записи в базу данных не завершился в течение 5 секунд")
+        self.pool.close()
 
 
 # Глобальный экземпляр сервиса
@@ -3,8 +3,7 @@
 import cv2
 import time
 import threading
-from pathlib import Path
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
 from datetime import datetime
 import uuid
 import numpy as np
@@ -13,23 +12,28 @@ import asyncio
 from app.services.video_service import video_service
 from app.services.detection_service import detection_service, Detection
 from app.services.zone_service import zone_service
+from app.services.snapshot_store import snapshot_store, snapshot_cache, image_index
+from app.services.event_service import event_service
 from app.core.config import config
 from app.utils.logger import logger
 
 
 class Violation:
     """Класс для представления нарушения"""
-    def __init__(self, zone_id: str, zone_name: str, detection: Detection, image_path: str):
+    def __init__(self, zone_id: str, zone_name: str, detection: Detection, image_path: str,
+                 crop: Optional[Tuple[int, int, int, int]] = None):
         self.id = str(uuid.uuid4())
         self.zone_id = zone_id
         self.zone_name = zone_name
         self.detection = detection
         self.image_path = image_path
         self.timestamp = datetime.now().isoformat()
-        self.status = "pending"  # pending, confirmed, false_positive
+        self.status = "pending"  # pending, confirmed, false_positive, unanswered
         self.operator_response = None
         self.operator_id = None
         self.response_time = None
+        # Рамка нарушителя на снимке (снимок общий для всех нарушений кадра)
+        self.crop = list(crop) if crop is not None else None
     
     def to_dict(self) -> dict:
         return {
@@ -42,7 +46,8 @@ class Violation:
             "status": self.status,
             "operator_response": self.operator_response,
             "operator_id": self.operator_id,
-            "response_time": self.response_time
+            "response_time": self.response_time,
+            "crop": self.crop
         }
 
 
@@ -62,10 +67,6 @@ class MonitoringService:
         self.violations_queue: List[Violation] = []
         self.violations_storage: Dict[str, Violation] = {}
         
-        # Директория для сохранения изображений
-        self.violations_path = Path(config.get_violations_path())
-        self.violations_path.mkdir(parents=True, exist_ok=True)
-        
         # FPS для детекции (чтобы не перегружать систему)
         self.detection_fps = config.get('video.detection_fps', 10)
         self.last_detection_time = 0
@@ -82,6 +83,7 @@ class MonitoringService:
             self.monitoring_thread = threading.Thread(target=self._monitoring_loop, daemon=True)
             self.monitoring_thread.start()
             logger.info("Поток мониторинга запущен")
+        event_service.publish("monitoring", {"is_monitoring": True})
     
     def stop_monitoring(self):
         """Остановка мониторинга"""
@@ -91,6 +93,7 @@ class MonitoringService:
                 return
             logger.info("Остановка мониторинга нарушений")
             self.is_monitoring = False
+        event_service.publish("monitoring", {"is_monitoring": False})
         
         # Ждем завершения потока мониторинга
         if self.monitoring_thread and self.monitoring_thread.is_alive():
@@ -185,6 +188,8 @@ class MonitoringService:
                     logger.debug("Нарушений не обнаружено (детекции не попали в зоны)")
                 
                 # Обработка нарушений с дебаунсингом
+                accepted = []
+                accepted_zones = set()
                 for violation_data in violations:
                     zone_id = violation_data["zone_id"]
                     zone_name = violation_data["zone_name"]
@@ -201,27 +206,24 @@ class MonitoringService:
                     
                     # Дебаунсинг: проверяем, не было ли недавно нарушения в этой зоне
                     last_time = self.last_violations.get(zone_id, 0)
-                    if current_time - last_time < self.debounce_time:
+                    if current_time - last_time < self.debounce_time or zone_id in accepted_zones:
                         logger.debug(f"Нарушение в зоне '{zone_name}' пропущено из-за дебаунсинга (последнее было {current_time - last_time:.1f} сек назад)")
                         continue
                     
                     logger.info(f"Регистрация нарушения в зоне '{zone_name}' (ID: {zone_id})")
-                    
-                    # Создаем нарушение
-                    violation = self._create_violation(
-                        zone_id=zone_id,
-                        zone_name=violation_data["zone_name"],
-                        detection=detection,  # Используем правильный объект Detection
-                        frame=frame
-                    )
-                    
-                    if violation:
-                        self.last_violations[zone_id] = current_time
+                    accepted.append(violation_data)
+                    accepted_zones.add(zone_id)
+                
+                # Создаем нарушения кадра с одним общим снимком
+                if accepted:
+                    for violation in self._create_violations(accepted, frame):
+                        self.last_violations[violation.zone_id] = current_time
                         self._add_violation(violation)
                         # Логируем нарушение
                         self._log_violation(violation)
                         # Отправляем уведомление асинхронно
                         self._send_notification_async(violation)
+                        event_service.publish("violation", violation.to_dict())
                         logger.info(f"Нарушение {violation.id} зарегистрировано и отправлено")
             except Exception as e:
                 logger.error(f"Ошибка в цикле мониторинга: {e}", exc_info=True)
@@ -229,45 +231,69 @@ class MonitoringService:
         
         logger.info("Цикл мониторинга завершил работу")
     
-    def _create_violation(self, zone_id: str, zone_name: str, detection: Detection, frame: np.ndarray) -> Optional[Violation]:
-        """Создание нарушения с сохранением изображения"""
-        logger.debug(f"Создание нарушения для зоны {zone_name} (ID: {zone_id})")
+    def _create_violations(self, violations_data: List[dict], frame: np.ndarray) -> List[Violation]:
+        """
+        Создание нарушений одного кадра с сохранением общего снимка
+        
+        Кадр копируется, размечается (все рамки сразу) и кодируется один раз;
+        каждое нарушение ссылается на этот снимок и хранит свою рамку на нем (crop).
+        """
+        logger.debug(f"Создание {len(violations_data)} нарушений кадра")
         try:
-            # Сохраняем изображение
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-            image_filename = f"violation_{timestamp}_{zone_id[:8]}.jpg"
-            image_path = self.violations_path / image_filename
-            
-            logger.debug(f"Сохранение изображения нарушения: {image_path}")
-            
-            # Рисуем bounding box на изображении
+            # Рисуем bounding box'ы всех нарушений на одной копии кадра
             annotated_frame = frame.copy()
-            x1, y1, x2, y2 = detection.bbox
-            cv2.rectangle(annotated_frame, (x1, y1), (x2, y2), (0, 0, 255), 2)
-            cv2.putText(annotated_frame, f"Person {detection.confidence:.2f}", 
-                       (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
+            drawn = set()
+            for violation_data in violations_data:
+                detection = violation_data["detection"]
+                x1, y1, x2, y2 = detection.bbox
+                if (x1, y1, x2, y2) in drawn:
+                    continue
+                drawn.add((x1, y1, x2, y2))
+                cv2.rectangle(annotated_frame, (x1, y1), (x2, y2), (0, 0, 255), 2)
+                cv2.putText(annotated_frame, f"Person {detection.confidence:.2f}", 
+                           (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
             
-            # Сохраняем изображение
-            success = cv2.imwrite(str(image_path), annotated_frame)
-            if not success:
-                logger.error(f"Не удалось сохранить изображение нарушения: {image_path}")
-                return None
+            # Сохраняем изображение (вместе с миниатюрой) в хранилище снимков
+            try:
+                snapshot = snapshot_store.save(annotated_frame)
+            except Exception as e:
+                logger.error(f"Не удалось сохранить изображение нарушения: {e}")
+                return []
             
-            logger.debug(f"Изображение успешно сохранено: {image_path}")
+            logger.debug(f"Изображение успешно сохранено: {snapshot.path}")
             
-            # Создаем объект нарушения
-            violation = Violation(
-                zone_id=zone_id,
-                zone_name=zone_name,
-                detection=detection,
-                image_path=str(image_path)
-            )
+            # Рамки на снимке с учетом его уменьшения относительно кадра
+            frame_height, frame_width = frame.shape[:2]
+            max_x = max(0, int(frame_width * snapshot.scale) - 1)
+            max_y = max(0, int(frame_height * snapshot.scale) - 1)
             
-            logger.info(f"Нарушение создано: ID={violation.id}, зона={zone_name}, уверенность={detection.confidence:.2f}")
-            return violation
+            violations = []
+            for violation_data in violations_data:
+                detection = violation_data["detection"]
+                x1, y1, x2, y2 = detection.bbox
+                crop = (
+                    min(max(int(x1 * snapshot.scale), 0), max_x),
+                    min(max(int(y1 * snapshot.scale), 0), max_y),
+                    min(max(int(x2 * snapshot.scale), 0), max_x),
+                    min(max(int(y2 * snapshot.scale), 0), max_y)
+                )
+                violation = Violation(
+                    zone_id=violation_data["zone_id"],
+                    zone_name=violation_data["zone_name"],
+                    detection=detection,
+                    image_path=str(snapshot.path),
+                    crop=crop
+                )
+                # Закодированные байты снимка переиспользуются уведомлениями и API
+                snapshot_cache.put(violation.id, snapshot)
+                image_index.put(violation.id, violation.image_path)
+                
+                logger.info(f"Нарушение создано: ID={violation.id}, зона={violation.zone_name}, уверенность={detection.confidence:.2f}")
+                violations.append(violation)
+            return violations
         except Exception as e:
             logger.error(f"Ошибка при создании нарушения: {e}", exc_info=True)
-            return None
+            return []
     
     def _add_violation(self, violation: Violation):
         """Добавление нарушения в очередь и хранилище"""
@@ -318,6 +344,13 @@ class MonitoringService:
             except Exception as e:
                 print(f"Ошибка при обновлении статуса в логах: {e}")
             
+            event_service.publish("violation_status", {
+                "id": violation_id,
+                "status": status,
+                "operator_id": operator_id,
+                "operator_response": violation.operator_response,
+                "response_time": violation.response_time
+            })
             return True
     
     def delete_violation(self, violation_id: str) -> bool:
@@ -357,12 +390,10 @@ class MonitoringService:
             # Пытаемся использовать event loop приложения
             app_loop = notification_service.app_event_loop
             if app_loop is not None and app_loop.is_running():
-                # Используем run_coroutine_threadsafe для выполнения в event loop приложения
+                # Передаем нарушение в event loop приложения, где одновременные
+                # нарушения объединяются в одно уведомление
                 try:
-                    future = asyncio.run_coroutine_threadsafe(
-                        notification_service.send_notification(violation),
-                        app_loop
-                    )
+                    app_loop.call_soon_threadsafe(notification_service.submit, violation)
                     # Не ждем результата, просто запускаем
                     logger.debug(f"Уведомление о нарушении {violation.id} отправлено через event loop приложения")
                 except Exception as e:
@@ -1,34 +1,317 @@
 """Сервис для отправки уведомлений клиентам"""
 
 import json
+import time
 import base64
+import struct
 import asyncio
-from typing import Dict, List, Optional
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Set, Tuple, Union
 from datetime import datetime
 from pathlib import Path
 import threading
 
 from fastapi import WebSocket, WebSocketDisconnect
 from app.services.monitoring_service import monitoring_service, Violation
-from app.api.clients import clients_storage
+from app.services.snapshot_store import snapshot_cache, snapshot_store
+from app.services.logging_service import logging_service
+from app.services.escalation_service import escalation_service
+from app.services.client_registry import client_registry
+from app.core.database import run_db
+from app.core.bus import bus
+from app.core.config import config
 from app.utils.logger import logger
 
 
+# Кадр WebSocket: str - текстовый, bytes - бинарный
+Frame = Union[str, bytes]
+
+# Способы доставки снимка нарушения, которые клиент выбирает при подключении:
+#   base64    - снимок в поле image уведомления (исходный протокол)
+#   binary    - JSON-заголовок, за которым следует бинарный кадр с JPEG
+#   thumbnail - JSON-заголовок и бинарный кадр с миниатюрой, полный снимок
+#               клиент при необходимости загружает по image_url
+IMAGE_MODES = ("base64", "binary", "thumbnail")
+DEFAULT_IMAGE_MODE = "base64"
+
+# Тема шины, по которой основной процесс рассылает уведомления воркерам
+NOTIFICATIONS_TOPIC = "notifications"
+# Тема шины, по которой воркеры передают основному процессу подтверждения клиентов
+ACKS_TOPIC = "notifications.ack"
+# Задержка, в течение которой воркер копит подтверждения в одно сообщение, сек
+ACK_BATCH_DELAY = 0.05
+
+
+def encode_message(message: dict) -> str:
+    """Сериализация сообщения в текст WebSocket-кадра (так же, как send_json в Starlette)"""
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+def with_seq(frame: str, seq: int, replay: bool = False) -> str:
+    """
+    Добавление номера уведомления в уже сериализованный JSON-объект
+    
+    Номер у каждого клиента свой, поэтому он вставляется в начало готового
+    текста кадра, а не сериализуется заново вместе со всем уведомлением.
+    """
+    prefix = f'{{"seq":{seq},"replay":true,' if replay else f'{{"seq":{seq},'
+    return prefix + frame[1:]
+
+
+class ClientConnection:
+    """
+    Исходящий канал WebSocket-клиента
+    
+    У каждого соединения своя ограниченная очередь и своя задача-писатель,
+    поэтому медленный клиент задерживает только собственные сообщения.
+    """
+    
+    def __init__(self, client_id: str, websocket: WebSocket, queue_size: int, send_timeout: float,
+                 image_mode: str = DEFAULT_IMAGE_MODE, heartbeat: bool = False):
+        self.client_id = client_id
+        self.websocket = websocket
+        self.send_timeout = send_timeout
+        self.image_mode = image_mode
+        # Очередь заранее сериализованных кадров
+        self.queue: "asyncio.Queue[Frame]" = asyncio.Queue(maxsize=queue_size)
+        # Кадры, отправляемые до очереди (подтверждение подключения и
+        # пропущенные уведомления), чтобы они пришли раньше новых
+        self.backlog: List[Frame] = []
+        # На воркере: сообщения (номер уведомления, кадры), пришедшие до того,
+        # как основной процесс сообщил последний выданный клиенту номер
+        self.pending: Optional[List[Tuple[Optional[int], Sequence[Frame]]]] = None
+        self.writer_task: Optional[asyncio.Task] = None
+        # Клиент поддерживает ping/pong на уровне сообщений; остальных
+        # проверяет только ping/pong протокола WebSocket
+        self.heartbeat = heartbeat
+        # Время последнего сообщения от клиента (time.monotonic)
+        self.last_activity = time.monotonic()
+    
+    def touch(self):
+        """Отметка о том, что клиент на связи (получено любое сообщение)"""
+        self.last_activity = time.monotonic()
+    
+    def enqueue(self, frames: Sequence[Frame]) -> bool:
+        """
+        Постановка кадров в очередь без ожидания (False - очередь переполнена)
+        
+        Кадры одного сообщения (заголовок и бинарный снимок) ставятся в очередь
+        либо все, либо ни один, чтобы клиент не получил заголовок без снимка.
+        """
+        if self.queue.maxsize and self.queue.maxsize - self.queue.qsize() < len(frames):
+            return False
+        for frame in frames:
+            self.queue.put_nowait(frame)
+        return True
+    
+    def close(self):
+        """Остановка задачи-писателя"""
+        if self.writer_task is not None and not self.writer_task.done():
+            self.writer_task.cancel()
+
+
 class NotificationService:
     """Сервис для управления уведомлениями"""
     
     def __init__(self):
-        # Активные WebSocket соединения: client_id -> WebSocket
-        self.active_connections: Dict[str, WebSocket] = {}
+        # Активные WebSocket соединения: client_id -> ClientConnection
+        self.active_connections: Dict[str, ClientConnection] = {}
         self.lock = threading.Lock()
-        self.notification_timeout = 300  # 5 минут
         self.app_event_loop: Optional[asyncio.AbstractEventLoop] = None
+        # Размер очереди исходящих сообщений клиента и таймаут одной отправки
+        self.send_queue_size = config.get('notifications.send_queue_size', 32)
+        self.send_timeout = config.get('notifications.send_timeout', 5.0)
+        # Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+        self._background_tasks = set()
+        # Последний номер уведомления по каждому известному клиенту (client_id -> seq);
+        # загружается из БД при первом обращении
+        self._sequences: Optional[Dict[str, int]] = None
+        # Клиенты, подтверждающие уведомления (передавали since или ack):
+        # только для них уведомления хранятся в outbox до подтверждения
+        self._acking_clients: Set[str] = set()
+        # На воркере: подтверждения, еще не переданные основному процессу (client_id -> seq)
+        self._pending_acks: Dict[str, int] = {}
+        self._acks_timer: Optional[asyncio.TimerHandle] = None
+        self._sequences_lock = asyncio.Lock()
+        # Максимум уведомлений, досылаемых клиенту при переподключении
+        self.replay_limit = config.get('notifications.replay_limit', 1000)
+        # Подписки известных клиентов на зоны (None - все зоны) и индекс
+        # zone_id -> подписчики, по которому выбираются получатели уведомления
+        self._subscriptions: Dict[str, Optional[FrozenSet[str]]] = {}
+        self._zone_subscribers: Dict[str, Set[str]] = {}
+        self._all_zones_clients: Set[str] = set()
+        # Нарушения, зарегистрированные в течение coalesce_window секунд,
+        # отправляются одним групповым уведомлением
+        self.coalesce_window = config.get('notifications.coalesce_window', 0.5)
+        self.coalesce_max = config.get('notifications.coalesce_max', 20)
+        self._burst: List[Violation] = []
+        self._burst_timer: Optional[asyncio.TimerHandle] = None
+        # Клиенту с heartbeat, молчащему heartbeat_interval секунд, сервер
+        # отправляет ping; не ответившего за idle_timeout секунд считаем отключенным
+        self.heartbeat_interval = config.get('notifications.heartbeat_interval', 25.0)
+        self.idle_timeout = config.get('notifications.idle_timeout', 90.0)
+        self._heartbeat_task: Optional[asyncio.Task] = None
+    
+    def start(self, loop: asyncio.AbstractEventLoop):
+        """
+        Привязка к event loop приложения и к шине процессов
+        
+        Номера уведомлений, подписки и ответы операторов обслуживает основной
+        процесс; воркеры вызывают его методы через шину и получают от него
+        готовые кадры уведомлений для своих клиентов.
+        """
+        self.app_event_loop = loop
+        # Один таймер проверяет все соединения, а не отдельный на каждое
+        self._heartbeat_task = loop.create_task(self._heartbeat_loop())
+        if bus.is_primary:
+            bus.method("notifications.register")(self._register_remote)
+            bus.method("notifications.subscribe")(self._subscribe_remote)
+            bus.method("notifications.response")(self.handle_response)
+            bus.subscribe(ACKS_TOPIC, self._on_remote_acks)
+        else:
+            bus.subscribe(NOTIFICATIONS_TOPIC, self._on_remote_frames)
     
-    async def connect(self, client_id: str, websocket: WebSocket):
-        """Подключение клиента через WebSocket"""
+    def stop(self):
+        """Остановка проверки соединений"""
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+    
+    async def _heartbeat_loop(self):
+        """
+        Проверка соединений раз в heartbeat_interval секунд
+        
+        Молчащим клиентам отправляется {"type": "ping"} (клиент отвечает
+        {"type": "pong"}), а соединения без ответа дольше idle_timeout
+        закрываются. Так оборванное без закрытия соединение обнаруживается
+        заранее, а не при отправке уведомления о нарушении.
+        
+        Проверяются только клиенты, подключившиеся с heartbeat: прежние
+        клиенты (OkHttp pingInterval) не отвечают на ping сообщением и
+        проверяются ping/pong протокола WebSocket (server.ws_ping_interval).
+        """
+        ping = (encode_message({"type": "ping"}),)
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            now = time.monotonic()
+            for connection in self._connections():
+                if not connection.heartbeat or connection.pending is not None:
+                    continue
+                idle = now - connection.last_activity
+                if idle > self.idle_timeout:
+                    logger.warning(f"Клиент {connection.client_id} не отвечает {idle:.0f} сек, отключаем")
+                    self._spawn(self._evict(connection))
+                elif idle >= self.heartbeat_interval:
+                    self._deliver(connection, ping)
+    
+    async def _get_sequences(self) -> Dict[str, int]:
+        """
+        Номера уведомлений клиентов
+        
+        При первом обращении из БД читаются номера и подписки всех известных клиентов.
+        """
+        if self._sequences is None:
+            async with self._sequences_lock:
+                if self._sequences is None:
+                    clients = await run_db(logging_service.get_notification_clients)
+                    for client_id, info in clients.items():
+                        self._index_subscription(client_id, info["zones"])
+                        if info["uses_ack"]:
+                            self._acking_clients.add(client_id)
+                    self._sequences = {client_id: info["last_seq"] for client_id, info in clients.items()}
+        return self._sequences
+    
+    def _index_subscription(self, client_id: str, zones: Optional[Iterable[str]]):
+        """Замена подписки клиента в индексе зон"""
+        previous = self._subscriptions.get(client_id)
+        if previous is None:
+            self._all_zones_clients.discard(client_id)
+        else:
+            for zone_id in previous:
+                subscribers = self._zone_subscribers.get(zone_id)
+                if subscribers is not None:
+                    subscribers.discard(client_id)
+                    if not subscribers:
+                        del self._zone_subscribers[zone_id]
+        
+        subscription = frozenset(zones) if zones is not None else None
+        self._subscriptions[client_id] = subscription
+        if subscription is None:
+            self._all_zones_clients.add(client_id)
+        else:
+            for zone_id in subscription:
+                self._zone_subscribers.setdefault(zone_id, set()).add(client_id)
+    
+    def subscribe(self, client_id: str, zones: Optional[Iterable[str]]) -> Optional[List[str]]:
+        """
+        Подписка клиента на уведомления только по указанным зонам
+        
+        Args:
+            zones: ID зон; None - уведомления по всем зонам
+        
+        Returns:
+            Итоговый список зон подписки (None - все зоны)
+        """
+        zones = sorted({str(zone_id) for zone_id in zones}) if zones is not None else None
+        self._index_subscription(client_id, zones)
+        logging_service.set_notification_zones(client_id, zones)
+        logger.info(f"Клиент {client_id} подписан на зоны: {zones if zones is not None else 'все'}")
+        return zones
+    
+    def get_subscription(self, client_id: str) -> Optional[List[str]]:
+        """Зоны подписки клиента (None - все зоны)"""
+        zones = self._subscriptions.get(client_id)
+        return sorted(zones) if zones is not None else None
+    
+    def _group_recipients(self, violations: List[Violation]) -> List[str]:
+        """Клиенты, подписанные хотя бы на одну из зон нарушений"""
+        if len(violations) == 1:
+            return self.get_zone_recipients(violations[0].zone_id)
+        recipients = set()
+        for violation in violations:
+            recipients.update(self.get_zone_recipients(violation.zone_id))
+        return list(recipients)
+    
+    def get_zone_recipients(self, zone_id: str) -> List[str]:
+        """Известные клиенты, подписанные на уведомления по зоне"""
+        subscribers = self._zone_subscribers.get(zone_id)
+        if not subscribers:
+            return list(self._all_zones_clients)
+        return list(self._all_zones_clients | subscribers)
+    
+    async def connect(self, client_id: str, websocket: WebSocket,
+                      image_mode: Optional[str] = None, since: Optional[int] = None,
+                      zones: Optional[List[str]] = None, heartbeat: bool = False) -> ClientConnection:
+        """
+        Подключение клиента через WebSocket
+        
+        Args:
+            image_mode: Способ доставки снимков, запрошенный клиентом (см. IMAGE_MODES)
+            since: Номер последнего уведомления, полученного клиентом; все
+                неподтвержденные уведомления после него отправляются повторно.
+            zones: Зоны, уведомления по которым нужны клиенту; если не указаны,
+                сохраняется прежняя подписка (у нового клиента - все зоны).
+            heartbeat: Клиент отвечает на {"type": "ping"} сервера; молчащее
+                дольше idle_timeout соединение такого клиента закрывается.
+        
+        Если клиент указал image_mode, since или zones, после подключения ему
+        отправляется сообщение "connected" с выбранным режимом, подпиской и
+        последним выданным ему номером уведомления.
+        """
         await websocket.accept()
+        if bus.is_primary:
+            await self._get_sequences()
+        negotiated = image_mode if image_mode in IMAGE_MODES else DEFAULT_IMAGE_MODE
+        if image_mode is not None and image_mode != negotiated:
+            logger.warning(f"Клиент {client_id} запросил неизвестный режим изображений {image_mode}, используется {negotiated}")
+        connection = ClientConnection(client_id, websocket, self.send_queue_size, self.send_timeout, negotiated,
+                                      heartbeat)
+        if not bus.is_primary:
+            # До ответа основного процесса неизвестно, какие уведомления клиент
+            # получит из outbox, поэтому поступающие уведомления откладываются
+            connection.pending = []
         with self.lock:
-            self.active_connections[client_id] = websocket
+            previous = self.active_connections.get(client_id)
+            self.active_connections[client_id] = connection
             # Сохраняем event loop приложения при первом подключении
             if self.app_event_loop is None:
                 try:
@@ -40,35 +323,362 @@ class NotificationService:
                         self.app_event_loop = asyncio.get_event_loop()
                     except RuntimeError:
                         pass
-        logger.info(f"Клиент {client_id} подключен")
+        if previous is not None:
+            # Клиент переподключился, старое соединение больше не обслуживаем
+            previous.close()
+        
+        if bus.is_primary:
+            # Номера, выданные до этого момента, досылаются из outbox, а более
+            # поздние уведомления уже попадут в очередь нового соединения
+            registration = self._register_client(client_id, since, zones)
+        else:
+            try:
+                registration = await bus.call("notifications.register", client_id=client_id,
+                                               since=since, zones=zones)
+            except Exception:
+                self._remove(client_id, connection)
+                raise
+        last_seq = registration["last_seq"]
+        if connection.pending is not None:
+            pending, connection.pending = connection.pending, None
+            for seq, batch in pending:
+                if seq is None or seq > last_seq:
+                    self._deliver(connection, batch)
+        
+        if image_mode is not None or since is not None or zones is not None:
+            connection.backlog.append(encode_message({
+                "type": "connected",
+                "image_mode": negotiated,
+                "zones": registration["zones"],
+                "last_seq": last_seq
+            }))
+        if since is not None:
+            if since < last_seq:
+                missed = await run_db(logging_service.get_outbox, client_id, since, last_seq, self.replay_limit)
+                connection.backlog.extend(with_seq(payload, seq, replay=True) for seq, payload in missed)
+                if missed:
+                    logger.info(f"Клиенту {client_id} повторно отправляется {len(missed)} уведомлений")
+        
+        connection.writer_task = asyncio.create_task(self._writer_loop(connection))
+        # client_id WebSocket - это client_id зарегистрированного устройства
+        client_registry.touch(client_id)
+        logger.info(f"Клиент {client_id} подключен (изображения: {negotiated})")
+        return connection
+    
+    def _register_client(self, client_id: str, since: Optional[int],
+                         zones: Optional[List[str]]) -> dict:
+        """
+        Регистрация подключения клиента в основном процессе
+        
+        Выполняется без await, поэтому номер last_seq разделяет уведомления,
+        которые клиент получит из outbox, и уведомления, отправленные после
+        подключения.
+        """
+        last_seq = self._sequences.setdefault(client_id, 0)
+        logging_service.register_notification_client(client_id)
+        if zones is not None:
+            self.subscribe(client_id, zones)
+        elif client_id not in self._subscriptions:
+            self._index_subscription(client_id, None)
+        if since is not None:
+            self._mark_acking(client_id)
+            self.ack(client_id, min(since, last_seq))
+        return {"last_seq": last_seq, "zones": self.get_subscription(client_id)}
+    
+    async def _register_remote(self, client_id: str, since: Optional[int] = None,
+                               zones: Optional[List[str]] = None) -> dict:
+        """Регистрация клиента, подключившегося к воркеру (метод шины)"""
+        await self._get_sequences()
+        registration = self._register_client(client_id, since, zones)
+        # Воркер читает пропущенные уведомления из БД сразу после ответа
+        await run_db(logging_service.flush)
+        return registration
+    
+    async def _subscribe_remote(self, client_id: str, zones: Optional[List[str]] = None) -> Optional[List[str]]:
+        """Изменение подписки клиента (метод шины)"""
+        await self._get_sequences()
+        return self.subscribe(client_id, zones)
+    
+    async def change_subscription(self, client_id: str, zones: Optional[List[str]]) -> Optional[List[str]]:
+        """Изменение подписки клиента из любого процесса"""
+        return await bus.call("notifications.subscribe", client_id=client_id, zones=zones)
+    
+    def disconnect(self, client_id: str, connection: Optional[ClientConnection] = None):
+        """
+        Отключение клиента
+        
+        Если передано connection, клиент отключается только когда это
+        соединение все еще текущее (а не уже замененное переподключением).
+        """
+        current = self._remove(client_id, connection)
+        if current is not None:
+            current.close()
+            client_registry.touch(client_id)
+            logger.info(f"Клиент {client_id} отключен")
+    
+    def _remove(self, client_id: str, connection: Optional[ClientConnection] = None) -> Optional[ClientConnection]:
+        """Удаление соединения из списка активных (без остановки задачи-писателя)"""
+        with self.lock:
+            current = self.active_connections.get(client_id)
+            if current is None or (connection is not None and current is not connection):
+                return None
+            del self.active_connections[client_id]
+            return current
+    
+    async def _writer_loop(self, connection: ClientConnection):
+        """Задача-писатель: отправляет кадры из очереди клиента по одному"""
+        websocket = connection.websocket
+        try:
+            while True:
+                if connection.backlog:
+                    frame = connection.backlog.pop(0)
+                else:
+                    frame = await connection.queue.get()
+                if isinstance(frame, bytes):
+                    send = websocket.send_bytes(frame)
+                else:
+                    send = websocket.send_text(frame)
+                await asyncio.wait_for(send, connection.send_timeout)
+        except asyncio.CancelledError:
+            pass
+        except asyncio.TimeoutError:
+            logger.warning(f"Клиент {connection.client_id} не принял сообщение за {connection.send_timeout} сек, отключаем")
+            await self._evict(connection)
+        except Exception as e:
+            logger.error(f"Ошибка при отправке сообщения клиенту {connection.client_id}: {e}", exc_info=True)
+            await self._evict(connection)
+    
+    async def _evict(self, connection: ClientConnection):
+        """Принудительное отключение клиента, который не успевает принимать сообщения"""
+        if self._remove(connection.client_id, connection) is not None:
+            logger.info(f"Клиент {connection.client_id} отключен")
+        try:
+            await asyncio.wait_for(connection.websocket.close(code=1011), timeout=1.0)
+        except Exception:
+            pass
+        # Может быть вызвано из самой задачи-писателя, поэтому останавливаем ее последней
+        connection.close()
     
-    def disconnect(self, client_id: str):
-        """Отключение клиента"""
+    def _spawn(self, coro):
+        """Запуск фоновой задачи в event loop с сохранением ссылки на нее"""
+        task = asyncio.ensure_future(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+    
+    def _connections(self, client_ids: Optional[List[str]] = None) -> List[ClientConnection]:
+        """Снимок списка активных соединений (всех или только указанных клиентов)"""
         with self.lock:
-            if client_id in self.active_connections:
-                # Просто удаляем из списка, WebSocket закроется автоматически при завершении приложения
-                del self.active_connections[client_id]
-                logger.info(f"Клиент {client_id} отключен")
+            if client_ids is None:
+                return list(self.active_connections.values())
+            return [self.active_connections[c] for c in client_ids if c in self.active_connections]
     
-    async def send_notification(self, violation: Violation) -> List[str]:
+    def _fan_out(self, frames: Union[Frame, Dict[str, Sequence[Frame]]],
+                 client_ids: Optional[List[str]] = None,
+                 sequences: Optional[Dict[str, int]] = None) -> List[str]:
         """
-        Отправка уведомления всем подключенным клиентам
+        Постановка кадров в очереди клиентов без ожидания отправки
+        
+        Кадры сериализуются один раз вызывающим кодом и отправляются всем
+        получателям как есть, без повторного json.dumps на каждого клиента.
+        
+        Args:
+            frames: Один кадр для всех клиентов или кадры по режиму
+                доставки изображений (image_mode -> кадры)
+            client_ids: Получатели (по умолчанию все подключенные клиенты)
+            sequences: Номера уведомления по клиентам, добавляемые в первый кадр
         
         Returns:
-            Список ID клиентов, которым отправлено уведомление
+            Список ID клиентов, в чьи очереди поставлено сообщение
+        """
+        queued = []
+        for connection in self._connections(client_ids):
+            if isinstance(frames, dict):
+                batch = frames.get(connection.image_mode)
+                if batch is None:
+                    continue
+            else:
+                batch = (frames,)
+            seq = sequences.get(connection.client_id) if sequences is not None else None
+            if seq is not None:
+                batch = (with_seq(batch[0], seq),) + tuple(batch[1:])
+            if connection.pending is not None:
+                connection.pending.append((seq, batch))
+                queued.append(connection.client_id)
+            elif self._deliver(connection, batch):
+                queued.append(connection.client_id)
+        return queued
+    
+    def _deliver(self, connection: ClientConnection, batch: Sequence[Frame]) -> bool:
+        """Постановка кадров в очередь клиента; переполненный клиент отключается"""
+        if connection.enqueue(batch):
+            return True
+        if self._remove(connection.client_id, connection) is not None:
+            logger.warning(f"Очередь клиента {connection.client_id} переполнена, отключаем")
+            self._spawn(self._evict(connection))
+        return False
+    
+    def _publish_remote(self, frames: Union[Frame, Dict[str, Sequence[Frame]]],
+                        client_ids: Optional[List[str]] = None,
+                        sequences: Optional[Dict[str, int]] = None):
+        """
+        Передача готовых кадров воркерам для их клиентов
+        
+        Сообщение: длина JSON-заголовка, заголовок (получатели, номера,
+        типы и длины кадров) и байты кадров подряд.
         """
-        # Читаем изображение и кодируем в base64
-        image_data = None
+        if not bus.has_remote_subscribers(NOTIFICATIONS_TOPIC):
+            return
+        if not isinstance(frames, dict):
+            frames = {"*": (frames,)}
+        layout = {}
+        blobs = []
+        for mode, batch in frames.items():
+            layout[mode] = []
+            for frame in batch:
+                data = frame if isinstance(frame, bytes) else frame.encode('utf-8')
+                layout[mode].append(["b" if isinstance(frame, bytes) else "t", len(data)])
+                blobs.append(data)
+        header = json.dumps({
+            "client_ids": client_ids,
+            "sequences": sequences,
+            "frames": layout
+        }, separators=(",", ":")).encode('utf-8')
+        bus.publish(NOTIFICATIONS_TOPIC, struct.pack("!I", len(header)) + header + b"".join(blobs))
+    
+    def _on_remote_frames(self, payload: bytes):
+        """Кадры уведомления от основного процесса (на воркере)"""
+        (header_length,) = struct.unpack_from("!I", payload)
+        offset = 4 + header_length
+        header = json.loads(payload[4:offset])
+        frames: Dict[str, Sequence[Frame]] = {}
+        for mode, layout in header["frames"].items():
+            batch = []
+            for kind, length in layout:
+                data = payload[offset:offset + length]
+                offset += length
+                batch.append(data if kind == "b" else data.decode('utf-8'))
+            frames[mode] = tuple(batch)
+        self._fan_out(frames["*"][0] if "*" in frames else frames,
+                      header["client_ids"], header["sequences"])
+    
+    def send_to(self, client_id: str, message: dict) -> bool:
+        """Отправка сообщения одному клиенту через его очередь"""
+        return bool(self._fan_out(encode_message(message), [client_id]))
+    
+    def submit(self, violation: Violation):
+        """
+        Постановка нового нарушения на отправку (вызывается в event loop приложения)
+        
+        Первое нарушение отправляется сразу, без ожидания окна (вместе с
+        нарушениями того же кадра, поставленными в тот же проход event loop).
+        Нарушения, поступившие в течение coalesce_window секунд после него,
+        отправляются одним групповым уведомлением. Каждое нарушение при этом
+        уже зарегистрировано и записано в журнал отдельно.
+        """
+        if self.coalesce_window <= 0:
+            self._spawn(self.send_notification(violation))
+            return
+        self._burst.append(violation)
+        if self._burst_timer is None:
+            self._burst_timer = asyncio.get_running_loop().call_soon(self._open_window)
+        elif len(self._burst) >= self.coalesce_max:
+            self._flush_burst()
+    
+    def _open_window(self):
+        """Немедленная отправка первых нарушений и начало окна объединения"""
+        burst, self._burst = self._burst, []
+        self._burst_timer = asyncio.get_running_loop().call_later(self.coalesce_window, self._flush_burst)
+        if burst:
+            self._spawn(self._send_burst(burst))
+    
+    def _flush_burst(self):
+        """Отправка накопленных за окно нарушений"""
+        if self._burst_timer is not None:
+            self._burst_timer.cancel()
+            self._burst_timer = None
+        burst, self._burst = self._burst, []
+        if burst:
+            self._spawn(self._send_burst(burst))
+    
+    async def _send_burst(self, burst: List[Violation]):
+        """
+        Групповая отправка нарушений одного всплеска
+        
+        Нарушения группируются по набору получателей, чтобы клиент,
+        подписанный на часть зон, не получил нарушения из чужих зон.
+        """
+        await self._get_sequences()
+        groups: Dict[FrozenSet[str], List[Violation]] = {}
+        for violation in burst:
+            recipients = frozenset(self.get_zone_recipients(violation.zone_id))
+            groups.setdefault(recipients, []).append(violation)
+        for violations in groups.values():
+            if len(violations) > 1:
+                logger.info(f"Групповое уведомление о {len(violations)} нарушениях")
+            await self.send_notification(violations[0], related=violations[1:])
+    
+    async def send_notification(self, violation: Violation, client_ids: Optional[List[str]] = None,
+                                escalation: Optional[str] = None,
+                                related: Optional[List[Violation]] = None,
+                                track: bool = True) -> List[str]:
+        """
+        Отправка уведомления клиентам, подписанным на зону нарушения
+        
+        Уведомление ставится в очереди клиентов и отправляется их задачами-
+        писателями, поэтому метод не ждет медленных клиентов. Кадры строятся
+        один раз для каждого режима доставки изображений, который выбрал хотя
+        бы один подключенный клиент.
+        
+        Каждый известный клиент, в том числе отключенный, получает следующий
+        номер. Клиентам, которые подтверждают уведомления (since или ack),
+        уведомление сохраняется в outbox до подтверждения, чтобы его можно
+        было дослать при переподключении.
+        
+        Args:
+            violation: Нарушение
+            client_ids: Получатели (по умолчанию клиенты, подписанные на зону нарушения)
+            escalation: Причина повторного уведомления ("renotify" или
+                "escalate"); первое уведомление ставит нарушение на
+                отслеживание в escalation_service
+            related: Другие нарушения того же всплеска. Они перечисляются в
+                поле violations, а поля верхнего уровня и снимок относятся к
+                violation, поэтому старые клиенты видят обычное уведомление.
+            track: Ставить ли нарушение на отслеживание эскалации (False для
+                тестовых уведомлений, нарушений которых нет в monitoring_service)
+        
+        Returns:
+            Список ID клиентов, которым поставлено уведомление
+        """
+        sequences = await self._get_sequences()
+        group = [violation] + list(related or [])
+        recipients = client_ids if client_ids is not None else self._group_recipients(group)
+        modes = {connection.image_mode for connection in self._connections(recipients)}
+        if bus.has_remote_subscribers(NOTIFICATIONS_TOPIC):
+            # Режимы клиентов других процессов неизвестны, кадры строятся для всех
+            modes = set(IMAGE_MODES)
+        
+        # Байты снимка берем из кэша (заполняется при создании нарушения),
+        # с диска читаем только если нарушения там уже нет
+        snapshot = snapshot_cache.get(violation.id)
+        image_bytes = None
+        thumb_bytes = None
         try:
-            image_path = Path(violation.image_path)
-            if image_path.exists():
-                with open(image_path, 'rb') as f:
-                    image_bytes = f.read()
-                    image_data = base64.b64encode(image_bytes).decode('utf-8')
+            if modes & {"base64", "binary"}:
+                if snapshot is not None:
+                    image_bytes = snapshot.data
+                else:
+                    image_bytes = await asyncio.to_thread(self._read_image, violation.image_path)
+            if "thumbnail" in modes:
+                if snapshot is not None and snapshot.thumbnail is not None:
+                    thumb_bytes = snapshot.thumbnail
+                else:
+                    thumb_bytes = await asyncio.to_thread(self._read_thumbnail, violation.image_path)
         except Exception as e:
             logger.warning(f"Ошибка при чтении изображения: {e}")
         
         # Формируем уведомление
+        image_url = f"/api/violations/{violation.id}/image"
         notification = {
             "type": "violation",
             "violation_id": violation.id,
@@ -76,42 +686,156 @@ class NotificationService:
             "zone_id": violation.zone_id,
             "zone_name": violation.zone_name,
             "detection": violation.detection.to_dict(),
-            "image": image_data,  # base64 encoded image
-            "image_url": f"/api/violations/{violation.id}/image"
+            "crop": getattr(violation, "crop", None),
+            "image": None,
+            "image_url": image_url
         }
+        if escalation is not None:
+            notification["escalation"] = escalation
+        if len(group) > 1:
+            notification["violations"] = [
+                {
+                    "violation_id": v.id,
+                    "timestamp": v.timestamp,
+                    "zone_id": v.zone_id,
+                    "zone_name": v.zone_name,
+                    "detection": v.detection.to_dict(),
+                    "crop": getattr(v, "crop", None),
+                    "image_url": f"/api/violations/{v.id}/image"
+                }
+                for v in group
+            ]
         
-        # Отправляем всем подключенным клиентам
-        sent_to = []
-        disconnected_clients = []
-        
-        with self.lock:
-            clients_to_notify = list(self.active_connections.keys())
+        frames: Dict[str, Sequence[Frame]] = {}
+        if "base64" in modes:
+            image_data = base64.b64encode(image_bytes).decode('utf-8') if image_bytes is not None else None
+            frames["base64"] = (encode_message({**notification, "image": image_data}),)
+        if "binary" in modes:
+            frames["binary"] = self._binary_frames(notification, image_bytes, "full")
+        if "thumbnail" in modes:
+            frames["thumbnail"] = self._binary_frames(
+                {**notification, "thumbnail_url": f"{image_url}?size=thumb"}, thumb_bytes, "thumbnail"
+            )
         
-        for client_id in clients_to_notify:
-            try:
-                websocket = self.active_connections.get(client_id)
-                if websocket:
-                    await websocket.send_json(notification)
-                    sent_to.append(client_id)
-            except Exception as e:
-                logger.error(f"Ошибка при отправке уведомления клиенту {client_id}: {e}", exc_info=True)
-                disconnected_clients.append(client_id)
+        # Номера выдаются без await между ними и постановкой в очереди, чтобы
+        # подключившийся в этот момент клиент не получил уведомление дважды
+        # или не пропустил его
+        if client_ids is None:
+            recipients = self._group_recipients(group)
+        payload = encode_message(notification)
+        for mode in IMAGE_MODES:
+            frames.setdefault(mode, (payload,))
+        assigned = {}
+        for client_id in recipients:
+            if client_id in sequences:
+                sequences[client_id] += 1
+                assigned[client_id] = sequences[client_id]
+        logging_service.add_to_outbox(assigned, violation.id, payload, self._acking_clients)
         
-        # Удаляем отключенных клиентов
-        for client_id in disconnected_clients:
-            self.disconnect(client_id)
+        if escalation is None and track:
+            escalation_service.track(violation, related)
+        self._publish_remote(frames, recipients, assigned)
+        return self._fan_out(frames, recipients, sequences=assigned)
+    
+    @staticmethod
+    def _binary_frames(notification: dict, image_bytes: Optional[bytes], image_kind: str) -> Sequence[Frame]:
+        """
+        Кадры уведомления для бинарной доставки: JSON-заголовок и, если снимок
+        есть, следующий за ним бинарный кадр с JPEG
         
-        return sent_to
+        Заголовок сообщает клиенту, ждать ли бинарный кадр (image_size) и что
+        в нем лежит (image_kind: full или thumbnail).
+        """
+        header = {
+            **notification,
+            "image_kind": image_kind,
+            "image_size": len(image_bytes) if image_bytes is not None else 0
+        }
+        if image_bytes is None:
+            return (encode_message(header),)
+        return (encode_message(header), image_bytes)
+    
+    def ack(self, client_id: str, seq) -> bool:
+        """Подтверждение клиентом получения уведомлений с номером до seq включительно"""
+        if not isinstance(seq, int) or isinstance(seq, bool) or seq <= 0:
+            return False
+        if not bus.is_primary:
+            # В БД пишет только основной процесс: подтверждения передаются ему пачками
+            self._pending_acks[client_id] = max(seq, self._pending_acks.get(client_id, 0))
+            if self._acks_timer is None:
+                self._acks_timer = asyncio.get_running_loop().call_later(ACK_BATCH_DELAY, self._flush_acks)
+            return True
+        self._mark_acking(client_id)
+        logging_service.ack_notifications(client_id, seq)
+        return True
+    
+    def _flush_acks(self):
+        """Передача накопленных подтверждений основному процессу (на воркере)"""
+        self._acks_timer = None
+        acks, self._pending_acks = self._pending_acks, {}
+        if acks:
+            # Потерянное при обрыве шины подтверждение приведет лишь к повторной
+            # доставке уведомлений, которые клиент пропускает по seq
+            bus.publish(ACKS_TOPIC, json.dumps(acks).encode('utf-8'))
+    
+    def _on_remote_acks(self, payload: bytes):
+        """Подтверждения клиентов, подключенных к воркерам (в основном процессе)"""
+        for client_id, seq in json.loads(payload).items():
+            self.ack(client_id, seq)
+    
+    def _mark_acking(self, client_id: str):
+        """Включение outbox для клиента, который подтверждает уведомления"""
+        if client_id not in self._acking_clients:
+            self._acking_clients.add(client_id)
+            logging_service.set_notification_client_uses_ack(client_id)
+    
+    @staticmethod
+    def _read_image(image_path: str) -> Optional[bytes]:
+        """Чтение изображения нарушения с диска"""
+        path = Path(image_path)
+        if not path.exists():
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+    
+    @staticmethod
+    def _read_thumbnail(image_path: str) -> Optional[bytes]:
+        """Чтение миниатюры снимка (создается при первом обращении)"""
+        if not image_path or not Path(image_path).exists():
+            return None
+        with open(snapshot_store.get_thumbnail(Path(image_path)), 'rb') as f:
+            return f.read()
     
     async def handle_response(self, client_id: str, response: dict):
-        """Обработка ответа от клиента"""
-        violation_id = response.get("violation_id")
+        """
+        Обработка ответа от клиента
+        
+        Ответ на групповое уведомление может перечислять все нарушения
+        группы в поле violation_ids.
+        """
+        if not bus.is_primary:
+            # Статусы нарушений и таймеры эскалации находятся в основном процессе
+            return await bus.call("notifications.response", client_id=client_id, response=response)
+        
+        violation_ids = response.get("violation_ids")
+        if not isinstance(violation_ids, list):
+            violation_ids = [response.get("violation_id")]
+        violation_ids = [v for v in violation_ids if v is not None]
         operator_response = response.get("response")  # True для подтверждения, False для ложного срабатывания
         
-        if violation_id is None or operator_response is None:
+        if not violation_ids or operator_response is None:
             return False
         
-        # Обновляем статус нарушения
+        # Обновляем статус нарушений и логируем ответ вне event loop
+        success = False
+        for violation_id in violation_ids:
+            if await run_db(self._apply_response, client_id, violation_id, operator_response):
+                escalation_service.cancel(violation_id)
+                success = True
+        return success
+    
+    def _apply_response(self, client_id: str, violation_id: str, operator_response: bool) -> bool:
+        """Применение ответа оператора (синхронно, выполняется в db_executor)"""
         status = "confirmed" if operator_response else "false_positive"
         success = monitoring_service.update_violation_status(
             violation_id=violation_id,
@@ -143,23 +867,9 @@ class NotificationService:
             "message": message,
             "timestamp": datetime.now().isoformat()
         }
-        
-        disconnected_clients = []
-        
-        with self.lock:
-            clients = list(self.active_connections.keys())
-        
-        for client_id in clients:
-            try:
-                websocket = self.active_connections.get(client_id)
-                if websocket:
-                    await websocket.send_json(notification)
-            except Exception as e:
-                logger.error(f"Ошибка при отправке системного сообщения клиенту {client_id}: {e}", exc_info=True)
-                disconnected_clients.append(client_id)
-        
-        for client_id in disconnected_clients:
-            self.disconnect(client_id)
+        frame = encode_message(notification)
+        self._publish_remote(frame)
+        self._fan_out(frame)
 
 
 # Глобальный экземпляр сервиса
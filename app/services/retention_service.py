@@ -0,0 +1,238 @@
+"""Сервис хранения: архивирование и удаление устаревших записей"""
+
+import json
+import time
+import zipfile
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+from datetime import datetime, timedelta
+
+from app.core.config import config
+from app.services.logging_service import logging_service
+from app.services.snapshot_store import snapshot_store, snapshot_cache, image_index
+from app.utils.logger import logger
+
+
+class RetentionService:
+    """
+    Периодическая очистка журнала по политикам хранения
+
+    Устаревшие нарушения (срок хранения задается отдельно для каждого статуса),
+    ответы операторов, системные события и изображения нарушений переносятся
+    в сжатые ZIP-архивы и удаляются из БД и каталога изображений. Удаление
+    идет небольшими пачками, чтобы не удерживать соединение на запись.
+    """
+
+    def __init__(self):
+        self.enabled = config.get('retention.enabled', True)
+        self.interval = config.get('retention.interval', 3600)  # секунд между запусками
+        self.batch_size = config.get('retention.batch_size', 500)
+        self.batch_pause = config.get('retention.batch_pause', 0.1)  # пауза между пачками, сек
+        # Срок хранения в днях по статусам; null - хранить бессрочно
+        self.policies: Dict[str, Optional[int]] = config.get('retention.policies', {
+            "confirmed": 365,
+            "false_positive": 30,
+            "pending": 90,
+            "unanswered": 90
+        })
+        self.events_days: Optional[int] = config.get('retention.events_days', 90)
+        # Сколько дней хранить уведомления, не подтвержденные клиентами
+        self.outbox_days: Optional[int] = config.get('retention.outbox_days', 7)
+        # Сколько дней лента изменений помнит удаленные нарушения; клиенту,
+        # не синхронизировавшемуся дольше, придется загрузить журнал заново
+        self.tombstones_days: Optional[int] = config.get('retention.tombstones_days', 30)
+        self.vacuum_pages = config.get('retention.vacuum_pages', 1000)
+        self.archive_path = Path(config.get('retention.archive_path', 'data/archive'))
+
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._run_lock = threading.Lock()
+
+    def start(self):
+        """Запуск фонового потока очистки"""
+        if not self.enabled:
+            logger.info("Очистка журнала по политикам хранения отключена")
+            return
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name="retention", daemon=True)
+        self._thread.start()
+        logger.info(f"Очистка журнала запущена (интервал {self.interval} сек)")
+
+    def stop(self):
+        """Остановка фонового потока очистки"""
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=5.0)
+            if self._thread.is_alive():
+                logger.warning("Поток очистки журнала не завершился в течение 5 секунд")
+
+    def _loop(self):
+        """Цикл потока: запуск очистки раз в interval секунд"""
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Ошибка при очистке журнала: {e}", exc_info=True)
+            self._stop_event.wait(self.interval)
+
+    def run_once(self) -> Dict[str, int]:
+        """
+        Однократный проход очистки
+
+        Returns:
+            Количество заархивированных записей по категориям
+        """
+        with self._run_lock:
+            summary: Dict[str, int] = {}
+            bundle_path = self.archive_path / f"retention_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+            bundle: Optional[zipfile.ZipFile] = None
+
+            def open_bundle() -> zipfile.ZipFile:
+                nonlocal bundle
+                if bundle is None:
+                    self.archive_path.mkdir(parents=True, exist_ok=True)
+                    bundle = zipfile.ZipFile(bundle_path, 'a', compression=zipfile.ZIP_DEFLATED)
+                return bundle
+
+            try:
+                for status, days in self.policies.items():
+                    if days is None or self._stop_event.is_set():
+                        continue
+                    archived = self._archive_violations(open_bundle, status, days)
+                    if archived:
+                        summary[status] = archived
+
+                if self.events_days is not None and not self._stop_event.is_set():
+                    archived = self._archive_events(open_bundle, self.events_days)
+                    if archived:
+                        summary["system_events"] = archived
+                
+                if self.outbox_days is not None and not self._stop_event.is_set():
+                    cutoff = (datetime.now() - timedelta(days=self.outbox_days)).isoformat()
+                    pruned = logging_service.prune_outbox(cutoff)
+                    if pruned:
+                        summary["notification_outbox"] = pruned
+                
+                if self.tombstones_days is not None and not self._stop_event.is_set():
+                    cutoff = (datetime.now() - timedelta(days=self.tombstones_days)).isoformat()
+                    pruned = logging_service.prune_tombstones(cutoff)
+                    if pruned:
+                        summary["violation_tombstones"] = pruned
+            finally:
+                if bundle is not None:
+                    bundle.close()
+
+            if summary:
+                freed = logging_service.compact(self.vacuum_pages)
+                logger.info(f"Очистка журнала: заархивировано {summary}, архив {bundle_path}, освобождено страниц БД: {freed}")
+                logging_service.log_system_event(
+                    event_type="retention",
+                    message=f"Заархивированы устаревшие записи: {summary}",
+                    metadata={"archive": str(bundle_path), "archived": summary}
+                )
+            return summary
+
+    def _archive_violations(self, open_bundle, status: str, days: int) -> int:
+        """Архивирование и удаление нарушений со статусом status старше days дней"""
+        cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+        total = 0
+        batch_number = 0
+
+        while not self._stop_event.is_set():
+            # Поставленные в очередь смены статуса и ответы операторов должны
+            # попасть в архив, а не записаться после удаления строк
+            logging_service.flush()
+            violations = logging_service.get_expired_violations(status, cutoff, self.batch_size)
+            if not violations:
+                break
+
+            ids = [v["id"] for v in violations]
+            bundle = open_bundle()
+            batch_number += 1
+            prefix = f"{status}_{batch_number:05d}"
+            bundle.writestr(f"violations/{prefix}.ndjson", self._to_ndjson(violations))
+            bundle.writestr(
+                f"operator_responses/{prefix}.ndjson",
+                self._to_ndjson(logging_service.get_operator_responses(ids))
+            )
+            image_paths = self._archive_images(bundle, violations)
+
+            # Файлы удаляются только после того, как строки удалены из БД
+            total += logging_service.delete_violations(ids)
+            self._forget_in_memory(ids)
+            for violation_id in ids:
+                snapshot_cache.discard(violation_id)
+                image_index.discard(violation_id)
+            for image_path in image_paths:
+                # Снимок кадра может быть общим с нарушениями, которые еще хранятся
+                if logging_service.is_image_referenced(str(image_path)):
+                    continue
+                try:
+                    snapshot_store.delete(image_path)
+                except OSError as e:
+                    logger.warning(f"Не удалось удалить изображение {image_path}: {e}")
+
+            if len(violations) < self.batch_size:
+                break
+            time.sleep(self.batch_pause)
+
+        return total
+
+    def _archive_events(self, open_bundle, days: int) -> int:
+        """Архивирование и удаление системных событий старше days дней"""
+        cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+        total = 0
+        batch_number = 0
+
+        while not self._stop_event.is_set():
+            events = logging_service.get_expired_system_events(cutoff, self.batch_size)
+            if not events:
+                break
+
+            batch_number += 1
+            open_bundle().writestr(f"system_events/{batch_number:05d}.ndjson", self._to_ndjson(events))
+            total += logging_service.delete_system_events([e["id"] for e in events])
+
+            if len(events) < self.batch_size:
+                break
+            time.sleep(self.batch_pause)
+
+        return total
+
+    def _archive_images(self, bundle: zipfile.ZipFile, violations: List[Dict]) -> List[Path]:
+        """Копирование изображений нарушений в архив (JPEG уже сжат, поэтому без сжатия)"""
+        archived = []
+        for violation in violations:
+            image_path = Path(violation["image_path"]) if violation.get("image_path") else None
+            if image_path is None or image_path in archived or not image_path.exists():
+                continue
+            archived.append(image_path)
+            # Общий снимок кадра мог попасть в архив с предыдущей пачкой
+            arcname = f"images/{image_path.name}"
+            try:
+                bundle.getinfo(arcname)
+            except KeyError:
+                bundle.write(image_path, arcname, compress_type=zipfile.ZIP_STORED)
+        return archived
+
+    @staticmethod
+    def _forget_in_memory(violation_ids: List[str]):
+        """Удаление заархивированных нарушений из памяти сервиса мониторинга"""
+        try:
+            from app.services.monitoring_service import monitoring_service
+            for violation_id in violation_ids:
+                if monitoring_service.get_violation(violation_id) is not None:
+                    monitoring_service.delete_violation(violation_id)
+        except ImportError:
+            pass
+
+    @staticmethod
+    def _to_ndjson(records: List[Dict]) -> str:
+        return "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+
+
+# Глобальный экземпляр сервиса
+retention_service = RetentionService()
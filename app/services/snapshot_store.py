@@ -0,0 +1,193 @@
+"""Хранилище снимков нарушений"""
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from datetime import datetime
+from typing import Any, Optional
+
+import cv2
+import numpy as np
+
+from app.core.config import config
+from app.utils.logger import logger
+
+
+class Snapshot:
+    """Закодированный снимок нарушения"""
+    def __init__(self, path: Path, data: bytes, digest: str, thumbnail: Optional[bytes] = None,
+                 scale: float = 1.0):
+        self.path = path  # путь к файлу в хранилище
+        self.data = data  # байты JPEG
+        self.digest = digest  # sha256 содержимого
+        self.thumbnail = thumbnail  # байты миниатюры, если она кодировалась при сохранении
+        self.scale = scale  # масштаб снимка относительно исходного кадра
+
+
+class SnapshotStore:
+    """
+    Хранилище снимков нарушений с адресацией по содержимому
+
+    Снимок сохраняется как <root>/<ГГГГ>/<ММ>/<ДД>/<hh>/<sha256>.jpg, где hh -
+    первые два символа хеша, поэтому ни один каталог не разрастается до сотен
+    тысяч файлов. Рядом пишется уменьшенная копия <sha256>_thumb.jpg для
+    списков в веб-интерфейсе. Одинаковые снимки хранятся в одном файле.
+
+    Снимок кодируется один раз (качество и максимальный размер берутся из
+    notifications.image_quality и notifications.max_image_size), и эти же
+    байты отправляются в уведомлениях и отдаются по HTTP.
+    """
+
+    THUMB_SUFFIX = "_thumb"
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = Path(root or config.get_violations_path())
+        self.root.mkdir(parents=True, exist_ok=True)
+        # Качество снимка задается одним ключом notifications.image_quality:
+        # сохраненные байты без перекодирования отправляются в уведомлениях
+        self.jpeg_quality = config.get('notifications.image_quality', 85)
+        if config.get('storage.jpeg_quality') is not None:
+            logger.warning("Параметр storage.jpeg_quality не используется, "
+                           "качество снимков задается notifications.image_quality")
+        self.max_image_size = config.get('notifications.max_image_size', 1920)
+        self.thumbnail_width = config.get('storage.thumbnail_width', 320)
+        self.thumbnail_quality = config.get('storage.thumbnail_quality', 70)
+
+    def save(self, image: np.ndarray) -> Snapshot:
+        """
+        Кодирование и сохранение снимка вместе с миниатюрой
+
+        Returns:
+            Снимок с путем к полноразмерному файлу и его байтами
+        """
+        height, width = image.shape[:2]
+        scale = 1.0
+        if self.max_image_size and max(height, width) > self.max_image_size:
+            scale = self.max_image_size / max(height, width)
+            image = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))),
+                               interpolation=cv2.INTER_AREA)
+
+        ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ok:
+            raise ValueError("Не удалось закодировать снимок в JPEG")
+        jpeg_bytes = buffer.tobytes()
+
+        digest = hashlib.sha256(jpeg_bytes).hexdigest()
+        directory = self.root / datetime.now().strftime("%Y/%m/%d") / digest[:2]
+        image_path = directory / f"{digest}.jpg"
+        snapshot = Snapshot(image_path, jpeg_bytes, digest, scale=scale)
+        if image_path.exists():
+            return snapshot
+
+        directory.mkdir(parents=True, exist_ok=True)
+        self._write_atomic(image_path, jpeg_bytes)
+
+        thumb_bytes = self._encode_thumbnail(image)
+        if thumb_bytes is not None:
+            self._write_atomic(self.thumbnail_path(image_path), thumb_bytes)
+            snapshot.thumbnail = thumb_bytes
+
+        return snapshot
+
+    def thumbnail_path(self, image_path: Path) -> Path:
+        """Путь к миниатюре снимка"""
+        image_path = Path(image_path)
+        return image_path.with_name(f"{image_path.stem}{self.THUMB_SUFFIX}{image_path.suffix}")
+
+    def get_thumbnail(self, image_path: Path) -> Path:
+        """
+        Путь к миниатюре, при необходимости созданной из полного снимка
+
+        Снимки, сохраненные до появления миниатюр, получают их при первом
+        запросе. Если миниатюру создать не удалось, возвращается сам снимок.
+        """
+        image_path = Path(image_path)
+        thumb_path = self.thumbnail_path(image_path)
+        if thumb_path.exists():
+            return thumb_path
+
+        image = cv2.imread(str(image_path))
+        thumb_bytes = self._encode_thumbnail(image) if image is not None else None
+        if thumb_bytes is None:
+            return image_path
+        try:
+            self._write_atomic(thumb_path, thumb_bytes)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить миниатюру {thumb_path}: {e}")
+            return image_path
+        return thumb_path
+
+    def delete(self, image_path: Path):
+        """
+        Удаление снимка вместе с миниатюрой
+
+        Один файл может использоваться несколькими нарушениями (общий снимок
+        кадра, одинаковые снимки), поэтому вызывающий код удаляет его только
+        после того, как удалено последнее ссылающееся на него нарушение.
+        """
+        image_path = Path(image_path)
+        for path in (image_path, self.thumbnail_path(image_path)):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _encode_thumbnail(self, image: np.ndarray) -> Optional[bytes]:
+        """Уменьшение снимка до thumbnail_width по ширине и кодирование в JPEG"""
+        height, width = image.shape[:2]
+        if width > self.thumbnail_width:
+            scale = self.thumbnail_width / width
+            image = cv2.resize(image, (self.thumbnail_width, max(1, int(height * scale))),
+                               interpolation=cv2.INTER_AREA)
+        ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.thumbnail_quality])
+        return buffer.tobytes() if ok else None
+
+    @staticmethod
+    def _write_atomic(path: Path, data: bytes):
+        """Запись файла через временный файл, чтобы читатели не видели его частично"""
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+
+class LRUCache:
+    """
+    Ограниченный по размеру словарь в памяти с вытеснением давно не
+    запрашивавшихся записей (потокобезопасный)
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._items: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, key: str, value: Any):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def discard(self, key: str):
+        with self._lock:
+            self._items.pop(key, None)
+
+
+# Глобальные экземпляры хранилища, кэша и индекса
+snapshot_store = SnapshotStore()
+# Закодированные снимки недавних нарушений (violation_id -> Snapshot): заполняется
+# при создании нарушения, уведомления и HTTP-ответы не читают только что записанный файл
+snapshot_cache = LRUCache(config.get('notifications.image_cache_size', 64))
+# Пути к снимкам (violation_id -> путь): запросы изображений, в том числе
+# 304 Not Modified, обслуживаются без обращения к SQLite
+image_index = LRUCache(config.get('storage.image_index_size', 100000))
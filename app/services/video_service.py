@@ -1,12 +1,17 @@
 """Сервис для работы с видеопотоком"""
 
 import cv2
-import threading
 import time
+import struct
+import asyncio
+import threading
 from pathlib import Path
 from typing import Optional, Tuple
 from enum import Enum
 import numpy as np
+from app.core.bus import bus
+from app.core.config import config
+from app.core.frame_ring import FrameRing
 from app.utils.logger import logger
 
 
@@ -335,6 +340,14 @@ class VideoService:
     
     def get_frame(self) -> Optional[Tuple[bytes, float]]:
         """Получение текущего кадра в формате JPEG"""
+        result = self.get_annotated_frame()
+        if result is None:
+            return None
+        frame, fps = result
+        return encode_frame(frame, fps)
+    
+    def get_annotated_frame(self) -> Optional[Tuple[np.ndarray, float]]:
+        """Получение текущего кадра с рамками детекций (для видеопотока)"""
         # Проверяем флаг shutdown
         try:
             from app.main import app_shutting_down
@@ -382,15 +395,10 @@ class VideoService:
                     # Если ошибка при детекции, просто продолжаем без рамок
                     pass
                 
-                # Кодирование в JPEG
-                ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-                if not ret:
-                    return None
-                
                 self.last_frame = frame
                 self.last_frame_time = time.time()
                 
-                return (buffer.tobytes(), self.frame_rate)
+                return (frame, self.frame_rate)
             except Exception as e:
                 logger.warning(f"Ошибка при чтении кадра: {e}")
                 return None
@@ -439,6 +447,135 @@ class VideoService:
             return info
 
 
-# Глобальный экземпляр сервиса
+def encode_frame(frame: np.ndarray, fps: float) -> Optional[Tuple[bytes, float]]:
+    """Кодирование кадра видеопотока в JPEG"""
+    ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    if not ret:
+        return None
+    return (buffer.tobytes(), fps)
+
+
+# Тема шины с номерами кадров видеопотока основного процесса
+FRAME_TOPIC = "video.frame"
+_FRAME = struct.Struct("!IQd")  # PID писателя буфера, номер кадра, частота кадров
+
+
+class RemoteFrameSource:
+    """
+    Кадры видеопотока, получаемые воркером от основного процесса
+
+    Видео захватывает только основной процесс. Кадры с рамками детекций он
+    пишет в буфер кадров в разделяемой памяти (FrameRing), а по шине
+    сообщает только номер нового кадра. Воркер подписывается на номера,
+    пока у него есть хотя бы один зритель MJPEG-потока, читает кадр из
+    буфера без копирования и сам кодирует его в JPEG - один раз для всех
+    своих зрителей.
+    """
+
+    def __init__(self, max_age: float = 2.0):
+        self.max_age = max_age  # секунд, после которых кадр считается устаревшим
+        self.ring_name = config.get('video.frame_ring.name', 'drowning_pool_frames')
+        self.lock = threading.Lock()
+        self._viewers = 0
+        self._announced: Optional[Tuple[int, int, float, float]] = None  # PID, номер, fps, время получения
+        # Буфер и последний закодированный кадр используются потоками видеопотока
+        self._encode_lock = threading.Lock()
+        self._ring: Optional[FrameRing] = None
+        self._encoded: Optional[Tuple[int, bytes, float]] = None
+
+    def attach(self):
+        """Подключение зрителя (первый зритель включает пересылку кадров)"""
+        with self.lock:
+            self._viewers += 1
+            if self._viewers == 1:
+                bus.subscribe(FRAME_TOPIC, self._on_frame)
+
+    def detach(self):
+        """Отключение зрителя"""
+        with self.lock:
+            self._viewers -= 1
+            if self._viewers == 0:
+                bus.unsubscribe(FRAME_TOPIC, self._on_frame)
+                self._announced = None
+
+    def _on_frame(self, payload: bytes):
+        writer_pid, seq, fps = _FRAME.unpack(payload)
+        with self.lock:
+            self._announced = (writer_pid, seq, fps, time.time())
+
+    def get_frame(self) -> Optional[Tuple[bytes, float]]:
+        """Последний кадр в формате JPEG и частота кадров"""
+        with self.lock:
+            announced = self._announced
+        if announced is None or time.time() - announced[3] > self.max_age:
+            return None
+        writer_pid, seq, fps, _ = announced
+
+        with self._encode_lock:
+            if self._encoded is not None and self._encoded[0] == seq:
+                return self._encoded[1], self._encoded[2]
+            if self._ring is not None and self._ring.writer_pid != writer_pid:
+                # Основной процесс перезапущен и создал буфер заново
+                self._ring.close()
+                self._ring = None
+            if self._ring is None:
+                self._ring = FrameRing.attach(self.ring_name)
+                if self._ring is None:
+                    return None
+            result = self._ring.read(seq)
+            if result is None:
+                return None
+            encoded = encode_frame(result[0], fps)
+            del result
+            # Кадр мог быть перезаписан во время кодирования
+            if encoded is None or not self._ring.is_current(seq):
+                return None
+            self._encoded = (seq, encoded[0], fps)
+            return encoded
+
+
+def _write_to_ring(ring: FrameRing) -> Optional[Tuple[int, float]]:
+    """Захват кадра с рамками детекций и запись его в буфер кадров"""
+    result = video_service.get_annotated_frame()
+    if result is None:
+        return None
+    frame, fps = result
+    if frame.nbytes > ring.slot_size:
+        # Кадр больше слота (источник с разрешением выше video.frame_ring.max_*)
+        scale = (ring.slot_size / frame.nbytes) ** 0.5
+        height, width = frame.shape[:2]
+        frame = cv2.resize(frame, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+    return ring.write(frame, fps), fps
+
+
+async def relay_frames():
+    """
+    Передача кадров воркерам, у которых есть зрители (в основном процессе)
+
+    Пока подписчиков нет, кадры не читаются. Кадры не кодируются и не
+    копируются в сообщения шины: воркеры читают их из разделяемой памяти.
+    """
+    ring = FrameRing.create(
+        config.get('video.frame_ring.name', 'drowning_pool_frames'),
+        slots=config.get('video.frame_ring.slots', 4),
+        max_width=config.get('video.frame_ring.max_width', 1920),
+        max_height=config.get('video.frame_ring.max_height', 1080)
+    )
+    try:
+        while True:
+            await bus.wait_for_subscribers(FRAME_TOPIC)
+            written = await asyncio.to_thread(_write_to_ring, ring)
+            if written is None:
+                await asyncio.sleep(0.1)
+                continue
+            seq, fps = written
+            bus.publish(FRAME_TOPIC, _FRAME.pack(ring.writer_pid, seq, fps))
+            await asyncio.sleep(1.0 / fps)
+    finally:
+        ring.close()
+
+
+# Глобальные экземпляры сервиса и источника кадров воркера
 video_service = VideoService()
+remote_frames = RemoteFrameSource()
 
@@ -9,16 +9,28 @@ import threading
 
 from app.models.zone import Zone, ZoneCreate, ZoneUpdate, Point
 from app.core.config import config
+from app.core.bus import bus
+from app.services.event_service import event_service
 
 
 class ZoneService:
     """Сервис для управления запретными зонами"""
     
+    # Тема шины: зоны изменены в другом процессе и файл нужно перечитать
+    BUS_TOPIC = "zones"
+    
     def __init__(self):
         self.zones: dict = {}
         self.lock = threading.Lock()
         self.storage_path = Path("data/zones.json")
         self._load_zones()
+        bus.subscribe(self.BUS_TOPIC, self._on_remote_change)
+    
+    def _on_remote_change(self, payload: bytes):
+        """Перечитывание файла зон после изменения в другом процессе"""
+        with self.lock:
+            self.zones = {}
+            self._load_zones()
     
     def _load_zones(self):
         """Загрузка зон из файла"""
@@ -40,21 +52,24 @@ class ZoneService:
     def _save_zones(self):
         """Сохранение зон в файл"""
         try:
-            data = {}
-            for zone_id, zone in self.zones.items():
-                data[zone_id] = {
-                    "id": zone.id,
-                    "name": zone.name,
-                    "points": [{"x": p.x, "y": p.y} for p in zone.points],
-                    "created_at": zone.created_at,
-                    "updated_at": zone.updated_at
-                }
+            data = {zone_id: self.zone_to_dict(zone) for zone_id, zone in self.zones.items()}
             
             with open(self.storage_path, 'w', encoding='utf-8') as f:
                 json.dump(data, f, ensure_ascii=False, indent=2)
         except Exception as e:
             print(f"Ошибка при сохранении зон: {e}")
     
+    @staticmethod
+    def zone_to_dict(zone: Zone) -> dict:
+        """Представление зоны в виде словаря (файл зон, события веб-интерфейса)"""
+        return {
+            "id": zone.id,
+            "name": zone.name,
+            "points": [{"x": p.x, "y": p.y} for p in zone.points],
+            "created_at": zone.created_at,
+            "updated_at": zone.updated_at
+        }
+    
     def create_zone(self, zone_data: ZoneCreate) -> Zone:
         """Создание новой зоны"""
         with self.lock:
@@ -71,6 +86,8 @@ class ZoneService:
             
             self.zones[zone_id] = zone
             self._save_zones()
+            bus.publish(self.BUS_TOPIC, zone_id.encode('utf-8'))
+            event_service.publish("zone", {"action": "created", "zone": self.zone_to_dict(zone)})
             
             return zone
     
@@ -101,6 +118,8 @@ class ZoneService:
             zone.updated_at = datetime.now().isoformat()
             
             self._save_zones()
+            bus.publish(self.BUS_TOPIC, zone_id.encode('utf-8'))
+            event_service.publish("zone", {"action": "updated", "zone": self.zone_to_dict(zone)})
             return zone
     
     def delete_zone(self, zone_id: str) -> bool:
@@ -111,6 +130,8 @@ class ZoneService:
             
             del self.zones[zone_id]
             self._save_zones()
+            bus.publish(self.BUS_TOPIC, zone_id.encode('utf-8'))
+            event_service.publish("zone", {"action": "deleted", "zone_id": zone_id})
             return True
     
     def point_in_polygon(self, point: Tuple[int, int], polygon_points: List[Point]) -> bool:
@@ -54,6 +54,13 @@ def signal_handler(sig, frame):
 
 
 if __name__ == "__main__":
+    if "--vacuum" in sys.argv[1:]:
+        # Однократный перевод старой базы в режим incremental vacuum (сервер должен быть остановлен)
+        from app.services.logging_service import logging_service
+        logging_service.enable_incremental_vacuum()
+        logging_service.close()
+        sys.exit(0)
+    
     # Регистрируем обработчики сигналов ДО запуска сервера
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
@@ -61,16 +68,43 @@ if __name__ == "__main__":
     host = config.get_server_host()
     port = config.get_server_port()
     
+    workers = config.get('server.workers', 1)
+    # Живость WebSocket проверяется ping/pong протокола (на них отвечает
+    # любой клиент, в том числе OkHttp); соединение без ответа закрывается
+    ws_ping_interval = config.get('server.ws_ping_interval', 20.0)
+    ws_ping_timeout = config.get('server.ws_ping_timeout', 20.0)
+    if workers > 1 and not config.get('bus.enabled', False):
+        # Без шины каждый воркер захватывал бы видео и рассылал уведомления сам
+        logger.warning("Несколько воркеров требуют bus.enabled = true, запускается один процесс")
+        workers = 1
+    
     logger.info(f"Запуск сервера на {host}:{port}")
     logger.info("Для остановки нажмите Ctrl+C")
     
     try:
+        if workers > 1:
+            # Воркерами управляет uvicorn; основной процесс выбирается через шину
+            logger.info(f"Количество воркеров: {workers}")
+            uvicorn.run(
+                "app.main:app",
+                host=host,
+                port=port,
+                workers=workers,
+                log_level="info",
+                ws_ping_interval=ws_ping_interval,
+                ws_ping_timeout=ws_ping_timeout,
+                timeout_graceful_shutdown=5.0
+            )
+            sys.exit(0)
+        
         config_uvicorn = uvicorn.Config(
             "app.main:app",
             host=host,
             port=port,
             reload=config.get('server.debug', False),
             log_level="info",
+            ws_ping_interval=ws_ping_interval,
+            ws_ping_timeout=ws_ping_timeout,
             # Включаем graceful shutdown с увеличенным таймаутом
             timeout_graceful_shutdown=5.0
         )
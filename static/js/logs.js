@@ -3,20 +3,71 @@
 let currentPage = 0;
 const pageSize = 20;
 let currentFilters = {};
+let refreshTimer = null;
+let refreshLogs = false;
 
 // Инициализация
 document.addEventListener('DOMContentLoaded', async () => {
-    await loadZones();
     await loadStatistics();
     await loadLogs();
     setupEventListeners();
+    subscribeEvents();
 });
 
+// Подписка на поток событий сервера вместо периодических запросов
+function subscribeEvents() {
+    const source = new EventSource('/api/events');
+    
+    // Текущее состояние приходит при каждом (пере)подключении
+    source.addEventListener('snapshot', (event) => {
+        const state = JSON.parse(event.data);
+        renderZoneFilter(state.zones);
+    });
+    
+    source.addEventListener('zone', (event) => {
+        const change = JSON.parse(event.data);
+        const select = document.getElementById('filterZone');
+        const zoneId = change.zone ? change.zone.id : change.zone_id;
+        let option = select.querySelector(`option[value="${zoneId}"]`);
+        if (change.action === 'deleted') {
+            if (option) option.remove();
+            return;
+        }
+        if (!option) {
+            option = document.createElement('option');
+            option.value = zoneId;
+            select.appendChild(option);
+        }
+        option.textContent = change.zone.name;
+    });
+    
+    // Новые нарушения видны только на первой странице
+    source.addEventListener('violation', () => scheduleRefresh(currentPage === 0));
+    source.addEventListener('violation_status', () => scheduleRefresh(true));
+    source.addEventListener('violation_deleted', () => scheduleRefresh(true));
+}
+
+// Отложенное обновление: серия событий приводит к одному запросу
+function scheduleRefresh(withLogs) {
+    refreshLogs = refreshLogs || withLogs;
+    if (refreshTimer) return;
+    refreshTimer = setTimeout(async () => {
+        const reloadLogs = refreshLogs;
+        refreshTimer = null;
+        refreshLogs = false;
+        await loadStatistics();
+        if (reloadLogs) {
+            await loadLogs();
+        }
+    }, 1000);
+}
+
 function setupEventListeners() {
     document.getElementById('applyFilters').addEventListener('click', applyFilters);
     document.getElementById('resetFilters').addEventListener('click', resetFilters);
     document.getElementById('exportCsv').addEventListener('click', () => exportLogs('csv'));
     document.getElementById('exportJson').addEventListener('click', () => exportLogs('json'));
+    document.getElementById('exportNdjson').addEventListener('click', () => exportLogs('ndjson'));
     document.getElementById('prevPage').addEventListener('click', () => changePage(-1));
     document.getElementById('nextPage').addEventListener('click', () => changePage(1));
     
@@ -33,22 +84,21 @@ function setupEventListeners() {
     });
 }
 
-// Загрузка зон для фильтра
-async function loadZones() {
-    try {
-        const response = await fetch('/api/zones/');
-        const zones = await response.json();
-        
-        const select = document.getElementById('filterZone');
-        zones.forEach(zone => {
-            const option = document.createElement('option');
-            option.value = zone.id;
-            option.textContent = zone.name;
-            select.appendChild(option);
-        });
-    } catch (error) {
-        console.error('Ошибка при загрузке зон:', error);
+// Заполнение фильтра зон (первый пункт "Все зоны" сохраняется)
+function renderZoneFilter(zones) {
+    const select = document.getElementById('filterZone');
+    const selected = select.value;
+    while (select.options.length > 1) {
+        select.remove(1);
     }
+    zones.forEach(zone => {
+        const option = document.createElement('option');
+        option.value = zone.id;
+        option.textContent = zone.name;
+        select.appendChild(option);
+    });
+    select.value = selected;
+    if (select.value !== selected) select.value = '';
 }
 
 // Загрузка статистики
@@ -61,6 +111,7 @@ async function loadStatistics() {
         document.getElementById('statConfirmed').textContent = stats.confirmed || 0;
         document.getElementById('statFalse').textContent = stats.false_positive || 0;
         document.getElementById('statPending').textContent = stats.pending || 0;
+        document.getElementById('statUnanswered').textContent = stats.unanswered || 0;
     } catch (error) {
         console.error('Ошибка при загрузке статистики:', error);
     }
@@ -113,16 +164,19 @@ function renderLogsTable(violations) {
         const dateStr = date.toLocaleString('ru-RU');
         
         const statusClass = violation.status === 'confirmed' ? 'confirmed' : 
-                           violation.status === 'false_positive' ? 'false_positive' : 'pending';
+                           violation.status === 'false_positive' ? 'false_positive' :
+                           violation.status === 'unanswered' ? 'unanswered' : 'pending';
         const statusText = violation.status === 'confirmed' ? 'Подтверждено' :
-                          violation.status === 'false_positive' ? 'Ложное' : 'Ожидает';
+                          violation.status === 'false_positive' ? 'Ложное' :
+                          violation.status === 'unanswered' ? 'Без ответа' : 'Ожидает';
         
         return `
             <tr>
                 <td>${dateStr}</td>
                 <td>
-                    <img src="/api/violations/${violation.id}/image" 
+                    <img src="/api/violations/${violation.id}/image?size=thumb" 
                          alt="Нарушение" 
+                         loading="lazy" 
                          onclick="showImageModal('/api/violations/${violation.id}/image')"
                          style="cursor: pointer;">
                 </td>
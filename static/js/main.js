@@ -9,13 +9,69 @@ let zones = [];
 // Инициализация при загрузке страницы
 document.addEventListener('DOMContentLoaded', async () => {
     await loadModels();
-    await window.loadZones();
-    await checkMonitoringStatus();
     setupEventListeners();
-    // Загружаем конфигурацию после настройки обработчиков
-    await loadModelConfig();
+    // Статус мониторинга, зоны и параметры модели приходят из потока событий
+    subscribeEvents();
 });
 
+// Подписка на поток событий сервера вместо периодических запросов
+function subscribeEvents() {
+    const source = new EventSource('/api/events');
+    
+    // Текущее состояние приходит при каждом (пере)подключении
+    source.addEventListener('snapshot', (event) => {
+        const state = JSON.parse(event.data);
+        isMonitoring = state.monitoring.is_monitoring;
+        updateMonitoringStatus();
+        zones = state.zones;
+        renderZonesList();
+        redrawZones();
+        applyModelInfo(state.model);
+    });
+    
+    source.addEventListener('monitoring', (event) => {
+        isMonitoring = JSON.parse(event.data).is_monitoring;
+        updateMonitoringStatus();
+    });
+    
+    source.addEventListener('zone', (event) => {
+        const change = JSON.parse(event.data);
+        if (change.action === 'deleted') {
+            zones = zones.filter(zone => zone.id !== change.zone_id);
+        } else {
+            const index = zones.findIndex(zone => zone.id === change.zone.id);
+            if (index >= 0) {
+                zones[index] = change.zone;
+            } else {
+                zones.push(change.zone);
+            }
+        }
+        renderZonesList();
+        redrawZones();
+    });
+    
+    source.addEventListener('model', (event) => {
+        applyModelInfo(JSON.parse(event.data));
+    });
+}
+
+// Применение информации о модели (текущая модель и порог уверенности)
+function applyModelInfo(info) {
+    if (info.current_model) {
+        document.getElementById('detectionModel').value = info.current_model;
+        currentModel = info.current_model;
+        updateModelStatus(true);
+    }
+    
+    const slider = document.getElementById('confidenceThreshold');
+    const valueDisplay = document.getElementById('confidenceValue');
+    if (info.confidence_threshold !== undefined && slider && valueDisplay) {
+        const thresholdPercent = Math.round(info.confidence_threshold * 100);
+        slider.value = thresholdPercent;
+        valueDisplay.textContent = thresholdPercent + '%';
+    }
+}
+
 // Настройка обработчиков событий
 function setupEventListeners() {
     // Управление видео
@@ -88,42 +144,11 @@ async function loadModels() {
             option.textContent = model.display_name;
             select.appendChild(option);
         });
-        
-        // Загружаем текущую модель
-        const currentResponse = await fetch('/api/models/current');
-        const current = await currentResponse.json();
-        if (current.current_model) {
-            select.value = current.current_model;
-            currentModel = current.current_model;
-            updateModelStatus(true);
-        }
     } catch (error) {
         console.error('Ошибка при загрузке моделей:', error);
     }
 }
 
-// Загрузка конфигурации модели
-async function loadModelConfig() {
-    try {
-        const response = await fetch('/api/models/current');
-        const config = await response.json();
-        const slider = document.getElementById('confidenceThreshold');
-        const valueDisplay = document.getElementById('confidenceValue');
-        
-        if (config.confidence_threshold !== undefined && slider && valueDisplay) {
-            const thresholdPercent = Math.round(config.confidence_threshold * 100);
-            slider.value = thresholdPercent;
-            valueDisplay.textContent = thresholdPercent + '%';
-            console.log('Загружен порог уверенности:', thresholdPercent + '%');
-        } else {
-            if (!slider) console.warn('Элемент confidenceThreshold не найден');
-            if (!valueDisplay) console.warn('Элемент confidenceValue не найден');
-        }
-    } catch (error) {
-        console.error('Ошибка при загрузке конфигурации модели:', error);
-    }
-}
-
 // Применение порога уверенности
 async function applyConfidenceThreshold() {
     const slider = document.getElementById('confidenceThreshold');
@@ -159,18 +184,6 @@ window.loadZones = async function() {
     }
 };
 
-// Проверка статуса мониторинга
-async function checkMonitoringStatus() {
-    try {
-        const response = await fetch('/api/monitoring/status');
-        const status = await response.json();
-        isMonitoring = status.is_monitoring;
-        updateMonitoringStatus();
-    } catch (error) {
-        console.error('Ошибка при проверке статуса мониторинга:', error);
-    }
-}
-
 // Управление видео
 async function startCamera() {
     try {
@@ -417,11 +430,24 @@ function drawZones(highlightZoneId = null) {
     });
 }
 
-// Обновление canvas при изменении размера видео
+// Перерисовка зон без затирания зоны, которая сейчас рисуется (zones.js)
+function redrawZones() {
+    if (typeof isDrawing !== 'undefined' && isDrawing && typeof drawCurrentZone === 'function') {
+        drawCurrentZone();
+    } else {
+        drawZones();
+    }
+}
+
+// Обновление canvas только при изменении размера видео
 const video = document.getElementById('videoStream');
 if (video) {
-    video.addEventListener('load', () => drawZones());
-    setInterval(() => drawZones(), 1000); // Обновление каждую секунду
+    video.addEventListener('load', () => redrawZones());
+    if (typeof ResizeObserver !== 'undefined') {
+        new ResizeObserver(() => redrawZones()).observe(video);
+    } else {
+        window.addEventListener('resize', () => redrawZones());
+    }
 }
 
 // Экспорт функций для использования в других скриптах